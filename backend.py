@@ -0,0 +1,738 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shared backend plumbing for the AI engines
+Pooled async HTTP client, latency tracking, the error type engines raise on
+failed calls, a router that spreads calls over several engines, and a
+retry layer bounded by a per-update deadline
+"""
+
+import time
+import random
+import asyncio
+import logging
+import traceback
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import aiohttp
+
+from metrics import counter, histogram
+
+logger = logging.getLogger(__name__)
+
+BACKEND_REQUEST_SECONDS = histogram(
+    'bot_backend_request_seconds', 'Backend call duration by engine and outcome', ('engine', 'status')
+)
+BACKEND_RETRIES = counter('bot_backend_retries_total', 'Backend calls retried, by the failed status', ('status',))
+BACKEND_HEDGES = counter('bot_backend_hedges_total', 'Slow completions also sent to a second backend').labels()
+
+# ============================================================================
+# ERRORS
+# ============================================================================
+
+class BackendError(Exception):
+    """Raised by an engine when a completion could not be produced"""
+
+    def __init__(
+        self,
+        message: str,
+        user_message: str,
+        status: Optional[int] = None,
+        retry_after: Optional[float] = None,
+        retryable: Optional[bool] = None
+    ):
+        super().__init__(message)
+        self.user_message = user_message  # Safe to show in chat
+        self.status = status
+        self.retry_after = retry_after  # Seconds the backend asked us to wait
+        self.retryable = retryable  # None = decided by status
+
+
+class DeadlineExceeded(BackendError):
+    """Raised when the update's latency budget ran out before a reply"""
+
+    def __init__(self):
+        super().__init__(
+            "Reply deadline exceeded",
+            "⚠️ Jawab banne mein bahut time lag raha hai. Please thodi der baad try kijiye!"
+        )
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds from a Retry-After header (delta-seconds or HTTP date)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+# ============================================================================
+# POOLED HTTP CLIENT
+# ============================================================================
+
+class HTTPPool:
+    """
+    Shared aiohttp session with a bounded keep-alive connection pool
+
+    The session is created lazily on first use so it binds to the running
+    event loop, and is reused for every request until close() is called.
+    ``timeout`` bounds a whole request; streamed requests pass
+    stream_timeout instead, which only bounds connecting and each wait for
+    the next chunk, so a long generation is not cut off mid-reply.
+    """
+
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 100,
+        keepalive_timeout: float = 30.0,
+        timeout: float = 60.0
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Return the shared session, creating it on first use"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={'User-Agent': 'TelegramBot/1.0'}
+            )
+            logger.info(
+                f"🔌 HTTP pool ready (limit={self.limit}, per_host={self.limit_per_host})"
+            )
+        return self._session
+
+    async def close(self):
+        """Close the session and release pooled connections"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    @property
+    def stream_timeout(self) -> aiohttp.ClientTimeout:
+        """Per-request timeout for streamed responses: no total, ``timeout`` per connect and read"""
+        return aiohttp.ClientTimeout(total=None, sock_connect=self.timeout, sock_read=self.timeout)
+
+# ============================================================================
+# LATENCY TRACKING
+# ============================================================================
+
+class LatencyStats:
+    """Rolling window of call latencies (seconds) with percentile lookups"""
+
+    def __init__(self, window: int = 1000):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, seconds: float):
+        """Record one call latency"""
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def percentile(self, pct: float) -> float:
+        """Return the given percentile (0-100) of the rolling window"""
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def snapshot(self) -> Dict[str, float]:
+        """Summary suitable for logs and status endpoints"""
+        return {
+            'count': self.count,
+            'avg': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'last': self.samples[-1] if self.samples else 0.0
+        }
+
+# ============================================================================
+# CIRCUIT BREAKER
+# ============================================================================
+
+class CircuitBreaker:
+    """
+    Stops calling a backend after repeated failures, then probes it again
+
+    closed: calls flow. After failure_threshold consecutive failures it
+    opens and rejects calls for reset_timeout seconds, then goes half-open
+    and lets a single probe call through: success closes it, failure opens
+    it again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._open = False
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if not self._open:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def available(self) -> bool:
+        """Whether a call may be sent now (without claiming the half-open probe)"""
+        state = self.state
+        return state == self.CLOSED or (state == self.HALF_OPEN and not self._probing)
+
+    def begin(self):
+        """Mark a call as started; in half-open state it becomes the probe"""
+        if self.state == self.HALF_OPEN:
+            self._probing = True
+
+    def record_success(self):
+        self.failures = 0
+        self._open = False
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probing or self.failures >= self.failure_threshold:
+            if not self._open or self._probing:
+                self.trips += 1
+            self._open = True
+            self._probing = False
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """A call ended without a verdict (e.g. cancelled); free the probe"""
+        self._probing = False
+
+# ============================================================================
+# BACKEND ROUTER - Latency-aware selection, failover, hedging
+# ============================================================================
+
+def is_retryable(error: BackendError) -> bool:
+    """Whether another backend might succeed where this one failed"""
+    if error.retryable is not None:
+        return error.retryable
+    return error.status is None or error.status >= 500 or error.status in (408, 429)
+
+
+class RoutedBackend:
+    """One engine behind the router, with its health figures"""
+
+    MIN_SAMPLES = 3  # Backends with fewer calls rank last, in configuration order
+
+    def __init__(self, name: str, engine, breaker: CircuitBreaker, window: int = 200):
+        self.name = name
+        self.engine = engine
+        self.breaker = breaker
+        self.latency = LatencyStats(window)
+        self.outcomes = deque(maxlen=window)  # True = success
+        self.calls = 0
+        self.failures = 0
+
+    @property
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def score(self) -> float:
+        """Lower is better: blended p50/p95 latency inflated by the error rate"""
+        if len(self.outcomes) < self.MIN_SAMPLES or not self.latency.count:
+            return float('inf')  # Unmeasured or only failures so far: never ahead of a measured backend
+        latency = (self.latency.percentile(50) + self.latency.percentile(95)) / 2
+        return latency * (1 + 4 * self.error_rate)
+
+    def record(self, ok: bool, seconds: float):
+        self.calls += 1
+        self.outcomes.append(ok)
+        if ok:
+            self.latency.record(seconds)
+            self.breaker.record_success()
+        else:
+            self.failures += 1
+            self.breaker.record_failure()
+
+    def snapshot(self) -> Dict:
+        return {
+            'state': self.breaker.state,
+            'calls': self.calls,
+            'failures': self.failures,
+            'error_rate': self.error_rate,
+            'trips': self.breaker.trips,
+            'latency': self.latency.snapshot()
+        }
+
+
+class BackendRouter:
+    """
+    Routes engine calls over several backends
+
+    Drop-in for a single engine (complete / stream_response /
+    generate_response / close). Each call goes to the healthy backend with
+    the best rolling latency and error rate; backends whose circuit breaker
+    is open are skipped; backends with too few calls to rank come after the
+    measured ones, in configuration order. Retryable failures fail over to
+    the next backend.
+    With hedge_after > 0, a completion that has not returned within that
+    many seconds is also sent to the next backend and the first success
+    wins (the loser is cancelled). Streams are not hedged, and only fail
+    over until their first delta has been yielded.
+    """
+
+    STATS_LOG_EVERY = 1000
+
+    def __init__(
+        self,
+        backends: Sequence[Tuple[str, object]],
+        hedge_after: float = 0.0,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        window: int = 200
+    ):
+        if not backends:
+            raise ValueError("BackendRouter needs at least one backend")
+        self.backends = [
+            RoutedBackend(name, engine, CircuitBreaker(failure_threshold, reset_timeout), window)
+            for name, engine in backends
+        ]
+        self.hedge_after = hedge_after
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+        logger.info(
+            f"🔀 Backend router ready: {', '.join(b.name for b in self.backends)} "
+            f"(hedge after {f'{hedge_after}s' if hedge_after else 'off'})"
+        )
+
+    def rank(self) -> List[RoutedBackend]:
+        """Available backends, best first (configuration order breaks ties, so unmeasured ones keep it)"""
+        available = [b for b in self.backends if b.breaker.available()]
+        return sorted(available, key=RoutedBackend.score)
+
+    def _unavailable(self) -> BackendError:
+        return BackendError(
+            "All backends unavailable (circuit open)",
+            "⚠️ Abhi saare AI servers busy/down hain. Thodi der baad try kijiye!",
+            status=503
+        )
+
+    def _count_request(self):
+        self.requests += 1
+        if self.requests % self.STATS_LOG_EVERY == 0:
+            logger.info(f"🔀 Router stats: {self.stats()}")
+
+    async def _call(self, backend: RoutedBackend, args: tuple) -> str:
+        """One completion on one backend, recording its health"""
+        backend.breaker.begin()
+        started_at = time.perf_counter()
+        try:
+            result = await backend.engine.complete(*args)
+        except BackendError as e:
+            if is_retryable(e):
+                backend.record(False, time.perf_counter() - started_at)
+            else:
+                backend.breaker.release()
+            raise
+        except asyncio.CancelledError:
+            # Lost a hedge race: it took at least this long, which ranking should see
+            backend.latency.record(time.perf_counter() - started_at)
+            backend.breaker.release()
+            raise
+        backend.record(True, time.perf_counter() - started_at)
+        return result
+
+    async def complete(
+        self,
+        user_message: str,
+        conversation_history: Sequence,
+        user_context: str = "",
+        system_prompt: str = ""
+    ) -> str:
+        """Return the first successful completion, failing over and hedging as configured"""
+        self._count_request()
+        ranked = self.rank()
+        if not ranked:
+            raise self._unavailable()
+
+        args = (user_message, conversation_history, user_context, system_prompt)
+        pending: Dict[asyncio.Task, RoutedBackend] = {}
+        next_index = 0
+        hedged = False
+        last_error: Optional[BackendError] = None
+
+        def launch():
+            nonlocal next_index
+            backend = ranked[next_index]
+            next_index += 1
+            pending[asyncio.create_task(self._call(backend, args))] = backend
+
+        launch()
+        try:
+            while pending:
+                can_hedge = self.hedge_after > 0 and not hedged and next_index < len(ranked)
+                done, _ = await asyncio.wait(
+                    pending,
+                    timeout=self.hedge_after if can_hedge else None,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    # Primary is slow: race it against the next backend
+                    hedged = True
+                    self.hedges += 1
+                    BACKEND_HEDGES.inc()
+                    launch()
+                    continue
+
+                failed = False
+                for task in done:
+                    backend = pending.pop(task)
+                    try:
+                        result = task.result()
+                    except BackendError as e:
+                        logger.warning(f"⚠️ Backend {backend.name} failed: {e}")
+                        if not is_retryable(e):
+                            raise
+                        last_error = e
+                        failed = True
+                        continue
+                    if hedged and backend is not ranked[0]:
+                        self.hedge_wins += 1
+                    return result
+
+                if failed and next_index < len(ranked):
+                    self.failovers += 1
+                    launch()
+        finally:
+            for task in pending:
+                task.cancel()
+
+        raise last_error or self._unavailable()
+
+    async def stream_response(
+        self,
+        user_message: str,
+        conversation_history: Sequence,
+        user_context: str = "",
+        system_prompt: str = ""
+    ) -> AsyncIterator[str]:
+        """Stream from the best backend, failing over only before the first delta"""
+        self._count_request()
+        ranked = self.rank()
+        if not ranked:
+            raise self._unavailable()
+
+        last_error: Optional[BackendError] = None
+        for index, backend in enumerate(ranked):
+            if index:
+                self.failovers += 1
+            backend.breaker.begin()
+            started_at = time.perf_counter()
+            first_delta_at = None
+            try:
+                async for delta in backend.engine.stream_response(
+                    user_message, conversation_history, user_context, system_prompt
+                ):
+                    if first_delta_at is None:
+                        first_delta_at = time.perf_counter()
+                    yield delta
+            except BackendError as e:
+                if not is_retryable(e):
+                    backend.breaker.release()
+                    raise
+                backend.record(False, time.perf_counter() - started_at)
+                logger.warning(f"⚠️ Backend {backend.name} stream failed: {e}")
+                if first_delta_at is not None:
+                    raise
+                last_error = e
+                continue
+            except BaseException:
+                backend.breaker.release()  # Cancelled or closed by the consumer
+                raise
+            # Time to first delta is what users feel, so that is what gets ranked
+            backend.record(True, (first_delta_at or time.perf_counter()) - started_at)
+            return
+
+        raise last_error or self._unavailable()
+
+    async def generate_response(
+        self,
+        user_message: str,
+        conversation_history: Sequence,
+        user_context: str = "",
+        system_prompt: str = ""
+    ) -> str:
+        """Like complete(), but returns a user-facing message instead of raising"""
+        try:
+            return await self.complete(user_message, conversation_history, user_context, system_prompt)
+
+        except BackendError as e:
+            logger.error(str(e))
+            return e.user_message
+
+        except Exception as e:
+            logger.error(f"Unexpected error: {str(e)}")
+            return f"❌ Unexpected error: {str(e)}\n\n{traceback.format_exc()}"
+
+    async def close(self):
+        """Close every backend engine"""
+        for backend in self.backends:
+            await backend.engine.close()
+
+    def stats(self) -> Dict:
+        """Per-backend health plus hedging/failover counters"""
+        return {
+            'requests': self.requests,
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+            'failovers': self.failovers,
+            'backends': {b.name: b.snapshot() for b in self.backends}
+        }
+
+# ============================================================================
+# RETRIES - Backoff with jitter inside a per-update deadline
+# ============================================================================
+
+_deadline: ContextVar[Optional[float]] = ContextVar('backend_deadline', default=None)
+
+
+@contextmanager
+def deadline(seconds: Optional[float]) -> Iterator[None]:
+    """
+    Give every backend call made inside the block one shared time budget
+
+    The budget lives in a context variable, so it also covers tasks spawned
+    from the block (router hedges, background work). seconds=None or 0
+    removes any budget set by an outer block.
+    """
+    token = _deadline.set(time.monotonic() + seconds if seconds else None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def time_left() -> Optional[float]:
+    """Seconds left in the current deadline, or None without one"""
+    expires_at = _deadline.get()
+    return None if expires_at is None else expires_at - time.monotonic()
+
+
+class RetryingEngine:
+    """
+    Retries a wrapped engine's transient failures
+
+    429, 5xx, timeouts and connection errors are retried up to ``attempts``
+    times in total with exponential backoff and full jitter; a Retry-After
+    from the backend is waited out instead when it is longer. Every attempt
+    is cut off at the current deadline (see deadline()), and a retry whose
+    backoff would end past it is not started, so retries never push a reply
+    past the update's latency budget. Streams are only retried until their
+    first delta.
+    """
+
+    STATS_LOG_EVERY = 1000
+
+    def __init__(self, engine, attempts: int = 3, base_delay: float = 0.5, max_delay: float = 8.0):
+        self.engine = engine
+        self.attempts = max(1, attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.calls = 0
+        self.total_attempts = 0
+        self.retries = 0
+        self.succeeded = 0
+        self.recovered = 0  # Succeeded after at least one retry
+        self.failed = 0
+        self.deadline_exceeded = 0
+        self.retry_after_waits = 0
+        self.errors: Dict[str, int] = {}
+
+    def _backoff(self, attempt: int, error: BackendError) -> float:
+        """Full-jitter exponential delay, or the backend's Retry-After if longer"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        if error.retry_after is not None and error.retry_after > delay:
+            self.retry_after_waits += 1
+            return error.retry_after
+        return delay
+
+    def _record_error(self, error: BackendError):
+        key = str(error.status) if error.status is not None else type(error).__name__
+        self.errors[key] = self.errors.get(key, 0) + 1
+
+    def _start_call(self):
+        self.calls += 1
+        if self.calls % self.STATS_LOG_EVERY == 0:
+            logger.info(f"🔁 Retry stats: {self.stats()}")
+
+    async def _bounded(self, awaitable):
+        """Await one attempt, cut off at the deadline"""
+        remaining = time_left()
+        if remaining is None:
+            return await awaitable
+        if remaining <= 0:
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()
+            raise DeadlineExceeded()
+        try:
+            return await asyncio.wait_for(awaitable, remaining)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded()
+
+    async def _before_retry(self, attempt: int, error: BackendError):
+        """Sleep before the next attempt, or re-raise if it shouldn't happen"""
+        self._record_error(error)
+        if isinstance(error, DeadlineExceeded):
+            self.deadline_exceeded += 1
+            raise error
+        if not is_retryable(error) or attempt >= self.attempts:
+            raise error
+        delay = self._backoff(attempt, error)
+        remaining = time_left()
+        if remaining is not None and delay >= remaining:
+            self.deadline_exceeded += 1
+            raise error  # The retry could not finish in time; report the real failure
+        self.retries += 1
+        BACKEND_RETRIES.inc(status=error.status or 'network')
+        logger.warning(f"🔁 Retry {attempt}/{self.attempts - 1} in {delay:.2f}s after: {error}")
+        await asyncio.sleep(delay)
+
+    async def complete(
+        self,
+        user_message: str,
+        conversation_history: Sequence,
+        user_context: str = "",
+        system_prompt: str = ""
+    ) -> str:
+        """Return the wrapped engine's completion, retrying transient failures"""
+        self._start_call()
+        attempt = 0
+        while True:
+            attempt += 1
+            self.total_attempts += 1
+            try:
+                result = await self._bounded(self.engine.complete(
+                    user_message, conversation_history, user_context, system_prompt
+                ))
+            except BackendError as e:
+                try:
+                    await self._before_retry(attempt, e)
+                except BackendError:
+                    self.failed += 1
+                    raise
+                continue
+            self.succeeded += 1
+            if attempt > 1:
+                self.recovered += 1
+            return result
+
+    async def stream_response(
+        self,
+        user_message: str,
+        conversation_history: Sequence,
+        user_context: str = "",
+        system_prompt: str = ""
+    ) -> AsyncIterator[str]:
+        """Stream from the wrapped engine, retrying failures before the first delta"""
+        self._start_call()
+        attempt = 0
+        while True:
+            attempt += 1
+            self.total_attempts += 1
+            stream = self.engine.stream_response(
+                user_message, conversation_history, user_context, system_prompt
+            )
+            try:
+                try:
+                    first = await self._bounded(stream.__anext__())
+                except StopAsyncIteration:
+                    self.succeeded += 1
+                    return
+                except BackendError as e:
+                    try:
+                        await self._before_retry(attempt, e)
+                    except BackendError:
+                        self.failed += 1
+                        raise
+                    continue
+
+                # Once text is on screen the stream runs to the end or fails as is
+                yield first
+                try:
+                    async for delta in stream:
+                        yield delta
+                except BackendError as e:
+                    self._record_error(e)
+                    self.failed += 1
+                    raise
+                self.succeeded += 1
+                if attempt > 1:
+                    self.recovered += 1
+                return
+            finally:
+                await stream.aclose()
+
+    async def generate_response(
+        self,
+        user_message: str,
+        conversation_history: Sequence,
+        user_context: str = "",
+        system_prompt: str = ""
+    ) -> str:
+        """Like complete(), but returns a user-facing message instead of raising"""
+        try:
+            return await self.complete(user_message, conversation_history, user_context, system_prompt)
+
+        except BackendError as e:
+            logger.error(str(e))
+            return e.user_message
+
+        except Exception as e:
+            logger.error(f"Unexpected error: {str(e)}")
+            return f"❌ Unexpected error: {str(e)}\n\n{traceback.format_exc()}"
+
+    async def close(self):
+        await self.engine.close()
+
+    def stats(self) -> Dict:
+        """Attempt and outcome counters, plus the wrapped engine's stats if it has any"""
+        stats = {
+            'calls': self.calls,
+            'attempts': self.total_attempts,
+            'retries': self.retries,
+            'succeeded': self.succeeded,
+            'recovered': self.recovered,
+            'failed': self.failed,
+            'deadline_exceeded': self.deadline_exceeded,
+            'retry_after_waits': self.retry_after_waits,
+            'errors': dict(self.errors)
+        }
+        if hasattr(self.engine, 'stats'):
+            stats['engine'] = self.engine.stats()
+        return stats
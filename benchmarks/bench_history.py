@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Conversation history microbenchmark: list re-slicing vs RingBuffer
+
+Every simulated user is already at the 50-message cap, which is the steady
+state for active users. Appends hit users in random order, like concurrent
+chats do. Three paths are timed separately:
+
+- append:  storing one message (what add_to_history does)
+- read:    taking and iterating the "last 6" window the engines send
+- turn:    one append plus the three history reads a handle_message turn
+           performs (engine window, cache key slice, cache fingerprint)
+
+Usage: python benchmarks/bench_history.py [--users 10000] [--appends 500000]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from memory import HISTORY_LIMIT, RingBuffer
+
+
+def make_message(i: int) -> dict:
+    return {'timestamp': time.time(), 'role': 'user' if i % 2 else 'assistant', 'content': f"message {i}", 'topic': None}
+
+
+def list_append(histories: dict, user_id: int, message: dict):
+    """Previous MemorySystem.add_to_history behaviour"""
+    histories[user_id].append(message)
+    if len(histories[user_id]) > HISTORY_LIMIT:
+        histories[user_id] = histories[user_id][-HISTORY_LIMIT:]
+
+
+def ring_append(histories: dict, user_id: int, message: dict):
+    histories[user_id].append(message)
+
+
+def read_window(history):
+    for msg in history[-6:]:
+        msg['role']
+
+
+def full_turn(history):
+    read_window(history)
+    previous = history[:-1]
+    for msg in previous[-2:]:
+        msg['content']
+
+
+def timed(fn) -> float:
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def bench(make_histories, append, order, messages):
+    histories = make_histories()
+    append_s = timed(lambda: [append(histories, u, m) for u, m in zip(order, messages)])
+    read_s = timed(lambda: [read_window(histories[u]) for u in order])
+
+    histories = make_histories()
+
+    def turns():
+        for u, m in zip(order, messages):
+            append(histories, u, m)
+            full_turn(histories[u])
+    turn_s = timed(turns)
+
+    # Bytes allocated by the append path alone (list re-slicing allocates a new list each time)
+    histories = make_histories()
+    tracemalloc.start()
+    for u, m in zip(order[:50000], messages[:50000]):
+        append(histories, u, m)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return append_s, read_s, turn_s, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--appends', type=int, default=500000)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    order = [rng.randrange(args.users) for _ in range(args.appends)]
+    messages = [make_message(i) for i in range(args.appends)]
+    seed = [make_message(i) for i in range(HISTORY_LIMIT)]
+
+    results = {
+        "list re-slice": bench(lambda: {u: list(seed) for u in range(args.users)}, list_append, order, messages),
+        "RingBuffer": bench(lambda: {u: RingBuffer(HISTORY_LIMIT, seed) for u in range(args.users)}, ring_append, order, messages),
+    }
+
+    n = args.appends
+    print(f"{args.users} users at the {HISTORY_LIMIT}-message cap, {n} operations per path (µs/op)")
+    print(f"  {'':<14} {'append':>8} {'read':>8} {'turn':>8} {'append alloc peak':>18}")
+    for label, (append_s, read_s, turn_s, peak) in results.items():
+        print(f"  {label:<14} {append_s / n * 1e6:8.3f} {read_s / n * 1e6:8.3f} {turn_s / n * 1e6:8.3f} {peak / 1024:15.0f} KB")
+    old, new = results["list re-slice"], results["RingBuffer"]
+    print(f"  append speedup {old[0] / new[0]:.2f}x, turn speedup {old[2] / new[2]:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+History memory footprint: per-message dicts vs MessageRecord
+
+Builds the steady state of a busy bot (every user at the 50-message cap)
+twice, once with the old 4-key dicts holding ISO timestamp strings and once
+with MessageRecord, and reports the bytes allocated for each. Message
+contents are created up front and shared by both layouts, so the figures
+are the per-message overhead the layout adds on top of the text itself.
+
+Usage: python benchmarks/bench_message_footprint.py [--users 10000]
+"""
+
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from memory import HISTORY_LIMIT, MessageRecord, RingBuffer
+
+TOPICS = [None, 'python', 'javascript', 'apis', 'databases', 'deployment']
+
+
+def dict_message(i: int, content: str) -> dict:
+    """Previous MemorySystem.add_to_history entry"""
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'role': 'user' if i % 2 else 'assistant',
+        'content': content,
+        'topic': TOPICS[i % len(TOPICS)]
+    }
+
+
+def record_message(i: int, content: str) -> MessageRecord:
+    return MessageRecord(time.time(), 'user' if i % 2 else 'assistant', content, TOPICS[i % len(TOPICS)])
+
+
+def measure(build, users: int, contents: list) -> int:
+    """Bytes still allocated after building every user's history"""
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    histories = {
+        u: RingBuffer(HISTORY_LIMIT, (build(i, contents[i]) for i in range(HISTORY_LIMIT)))
+        for u in range(users)
+    }
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del histories
+    return after - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=10000)
+    args = parser.parse_args()
+
+    contents = [f"message {i} " * 8 for i in range(HISTORY_LIMIT)]
+    messages = args.users * HISTORY_LIMIT
+
+    old = measure(dict_message, args.users, contents)
+    new = measure(record_message, args.users, contents)
+
+    print(f"{args.users} users x {HISTORY_LIMIT} messages = {messages} history entries")
+    print(f"  {'':<14} {'total':>10} {'per message':>12}")
+    for label, total in (("dict + ISO", old), ("MessageRecord", new)):
+        print(f"  {label:<14} {total / 1024 / 1024:7.1f} MB {total / messages:9.0f} B")
+    print(f"  saved {(old - new) / 1024 / 1024:.1f} MB ({1 - new / old:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Long-term retrieval benchmark: BM25 index over one user's history
+
+Indexes --messages synthetic history entries (Zipf-distributed vocabulary,
+capped at the 200 characters MemorySystem stores) one at a time, as
+add_to_history does, then times top-k queries drawn from the same
+distribution. Also times the one-off rebuild a user pays when their index
+is built from the SQLite store.
+
+Usage: python benchmarks/bench_retrieval.py [--messages 10000] [--queries 2000] [--top-k 3]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from context_builder import BM25Index, HistoryRetriever
+from memory import MemoryStore, MessageRecord
+
+TECH_TERMS = (
+    "python javascript fastapi flask django react docker kubernetes postgres mysql redis "
+    "sqlite api rest graphql async await thread pool cache index query deploy render "
+    "webhook token error exception timeout retry memory leak test pytest class function"
+).split()
+
+
+def make_vocabulary(rng: random.Random, size: int):
+    words = TECH_TERMS + [
+        "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 9)))
+        for _ in range(size - len(TECH_TERMS))
+    ]
+    weights = [1 / (rank + 1) for rank in range(len(words))]  # Zipf
+    return words, weights
+
+
+def make_text(rng: random.Random, words, weights, length: int) -> str:
+    return " ".join(rng.choices(words, weights, k=length))[:200]
+
+
+def percentile(samples, pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--top-k', type=int, default=3)
+    parser.add_argument('--vocabulary', type=int, default=20000)
+    args = parser.parse_args()
+
+    rng = random.Random(12)
+    words, weights = make_vocabulary(rng, args.vocabulary)
+    texts = [make_text(rng, words, weights, rng.randint(8, 40)) for _ in range(args.messages)]
+    queries = [make_text(rng, words, weights, rng.randint(3, 12)) for _ in range(args.queries)]
+
+    # Incremental indexing
+    index = BM25Index()
+    started = time.perf_counter()
+    for text in texts:
+        index.add(text)
+    add_s = time.perf_counter() - started
+
+    # Queries
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        index.search(query, args.top_k, limit=len(index) - 6)
+        latencies.append(time.perf_counter() - started)
+
+    # Cold build from the SQLite store
+    with tempfile.TemporaryDirectory() as tmp:
+        store = MemoryStore(os.path.join(tmp, 'bench.db'), batch_size=1000)
+        now = time.time()
+        for i, text in enumerate(texts):
+            store.append_message(1, MessageRecord(now + i, 'user' if i % 2 else 'assistant', text))
+        store.flush()
+        retriever = HistoryRetriever(store=store, top_k=args.top_k, max_messages=args.messages)
+        started = time.perf_counter()
+        retriever.search(1, queries[0])
+        build_s = time.perf_counter() - started
+        store.close()
+
+    print(f"BM25 over {args.messages} messages, {len(index.postings)} terms, top-{args.top_k}")
+    print(f"  incremental add   {add_s / args.messages * 1e6:8.1f} µs/message")
+    print(f"  query p50         {percentile(latencies, 50) * 1e3:8.3f} ms")
+    print(f"  query p95         {percentile(latencies, 95) * 1e3:8.3f} ms")
+    print(f"  query p99         {percentile(latencies, 99) * 1e3:8.3f} ms")
+    print(f"  query mean        {statistics.mean(latencies) * 1e3:8.3f} ms")
+    print(f"  cold build (SQLite load + index) {build_s * 1e3:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Backend router benchmark against local stub servers
+
+Starts three stubs in-process: a primary with a heavy latency tail (like a
+Render instance that sometimes stalls), a steady but slower secondary, and
+a flaky one that fails a third of its calls. Sends --requests completions
+with --concurrency in flight through the primary alone, through the router
+without hedging, and through the router hedging after --hedge-after
+seconds, and reports latency percentiles and failures for each.
+
+Usage: python benchmarks/bench_router.py [--requests 400] [--concurrency 8] [--hedge-after 0.3]
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from backend import BackendError, BackendRouter, HTTPPool
+from bot import CustomAPIEngine
+from stub_backend import StubBackend, start_stub
+
+
+def percentile(samples, pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def run(engine, requests: int, concurrency: int):
+    """Latencies of successful calls and the failure count"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+
+    async def one(i: int):
+        nonlocal failures
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await engine.complete(f"question {i}", (), "", "system")
+            except BackendError:
+                failures += 1
+                return
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return latencies, failures
+
+
+async def bench(args):
+    stubs = {
+        'primary': StubBackend(latency=0.08, jitter=0.02, tail_rate=0.1, tail_latency=1.5, seed=1),
+        'secondary': StubBackend(latency=0.15, jitter=0.03, seed=2),
+        'flaky': StubBackend(latency=0.05, jitter=0.01, error_rate=0.33, seed=3),
+    }
+    runners, urls = [], {}
+    for name, stub in stubs.items():
+        runner, urls[name] = await start_stub(stub)
+        runners.append(runner)
+
+    pool = HTTPPool(timeout=10)
+    engines = {name: CustomAPIEngine(url, http_pool=pool) for name, url in urls.items()}
+    setups = [
+        ("primary only", engines['primary']),
+        ("router", BackendRouter(list(engines.items()))),
+        (f"router+hedge {args.hedge_after}s", BackendRouter(list(engines.items()), hedge_after=args.hedge_after)),
+    ]
+
+    print(f"{args.requests} requests, {args.concurrency} in flight")
+    print(f"  {'setup':<20} {'p50':>8} {'p95':>8} {'p99':>8} {'failed':>7}")
+    try:
+        for label, engine in setups:
+            latencies, failures = await run(engine, args.requests, args.concurrency)
+            cells = [f"{percentile(latencies, p) * 1e3:6.0f}ms" for p in (50, 95, 99)] if latencies else ["-"] * 3
+            print(f"  {label:<20} {cells[0]:>8} {cells[1]:>8} {cells[2]:>8} {failures:>7}")
+            if isinstance(engine, BackendRouter):
+                stats = engine.stats()
+                calls = ", ".join(f"{name} {b['calls']}" for name, b in stats['backends'].items())
+                print(f"  {'':<20} calls: {calls}; hedges {stats['hedges']} "
+                      f"(won {stats['hedge_wins']}), failovers {stats['failovers']}")
+    finally:
+        await pool.close()
+        for runner in runners:
+            await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--hedge-after', type=float, default=0.3)
+    args = parser.parse_args()
+    asyncio.run(bench(args))
+
+
+if __name__ == "__main__":
+    main()
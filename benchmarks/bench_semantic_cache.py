@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Semantic cache lookup latency at different index sizes
+
+Usage: python benchmarks/bench_semantic_cache.py [--sizes 10000 100000] [--lookups 2000]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from caching import SemanticCache
+
+TOPICS = [
+    "python", "javascript", "fastapi", "flask", "rest api", "database", "docker",
+    "deployment", "async", "decorator", "generator", "sql", "redis", "telegram bot",
+]
+TEMPLATES = [
+    "{topic} kya hota hai?",
+    "{topic} ko detail mein samjhao",
+    "how do I use {topic} in production",
+    "{topic} ke best practices batao",
+    "{topic} mein error aa raha hai, fix kaise kare",
+]
+
+
+def synthetic_message(rng: random.Random, i: int) -> str:
+    """Plausible user question with a unique suffix"""
+    template = rng.choice(TEMPLATES)
+    return template.format(topic=rng.choice(TOPICS)) + f" #{i}"
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def bench(size: int, lookups: int, dim: int, seed: int = 42):
+    rng = random.Random(seed)
+    cache = SemanticCache(capacity=size, dim=dim)
+
+    started = time.perf_counter()
+    for i in range(size):
+        cache.add(synthetic_message(rng, i), [], f"answer {i}")
+    fill_seconds = time.perf_counter() - started
+
+    queries = [synthetic_message(rng, rng.randrange(size * 2)) for _ in range(lookups)]
+    latencies = []
+    for query in queries:
+        t0 = time.perf_counter()
+        cache.lookup(query, [])
+        latencies.append(time.perf_counter() - t0)
+
+    matrix_mb = cache.vectors.nbytes / 1024 / 1024
+    print(
+        f"{size:>8} entries | dim {dim} | matrix {matrix_mb:7.1f} MB | fill {fill_seconds:6.2f}s | "
+        f"lookup p50 {percentile(latencies, 50) * 1000:7.3f} ms  "
+        f"p95 {percentile(latencies, 95) * 1000:7.3f} ms  "
+        f"p99 {percentile(latencies, 99) * 1000:7.3f} ms | hit rate {cache.stats()['hit_rate']:.1%}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--lookups', type=int, default=2000)
+    parser.add_argument('--dim', type=int, default=256)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        bench(size, args.lookups, args.dim)
+
+
+if __name__ == "__main__":
+    main()
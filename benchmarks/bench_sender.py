@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Outbound sender benchmark against a fake Telegram that enforces flood limits
+
+The fake API answers each call after --latency seconds and raises RetryAfter
+like Telegram does when a private chat gets more than about one message per
+second (after a short burst), a group or channel more than 20 per minute, or
+the bot more than 30 per second overall. --users replies of --chunks chunks
+each are sent at once, each followed by a channel notification, first the old
+way (chunks 0.5 s apart, notification awaited inline, 429s not handled)
+and then through OutboundSender. Reports reply completion times, 429s and
+messages lost.
+
+Usage: python benchmarks/bench_sender.py [--users 60] [--chunks 3] [--latency 0.05]
+"""
+
+import os
+import sys
+import math
+import time
+import asyncio
+import argparse
+import functools
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram.error import RetryAfter
+
+from telegram_io import OutboundSender, TokenBucket
+
+CHANNEL_ID = "-1001234567890"
+
+
+class FakeTelegram:
+    """send_message with Telegram-like per-chat, per-group and global limits"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.global_bucket = TokenBucket(30, burst=30)
+        self.chats = {}
+        self.delivered = 0
+        self.flood_errors = 0
+
+    def _check(self, bucket: TokenBucket):
+        wait = bucket.reserve()
+        if wait > 0:
+            bucket.tokens += 1  # Rejected calls don't use up the budget
+            self.flood_errors += 1
+            raise RetryAfter(max(1, math.ceil(wait)))
+
+    async def send_message(self, chat_id, text: str):
+        await asyncio.sleep(self.latency)
+        chat = self.chats.get(chat_id)
+        if chat is None:
+            group = str(chat_id).startswith('-')
+            chat = self.chats[chat_id] = TokenBucket(20 / 60, burst=3) if group else TokenBucket(1.0, burst=3)
+        self._check(chat)
+        self._check(self.global_bucket)
+        self.delivered += 1
+
+
+def percentile(samples, pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def old_reply(api: FakeTelegram, chat_id: int, chunks: int) -> bool:
+    """Chunks 0.5 s apart and an inline channel notification, as handle_message used to"""
+    try:
+        for i in range(chunks):
+            if i > 0:
+                await asyncio.sleep(0.5)
+            await api.send_message(chat_id, f"chunk {i}")
+    except RetryAfter:
+        return False
+    try:
+        await api.send_message(CHANNEL_ID, "notification")
+    except RetryAfter:
+        pass  # Logged and dropped
+    return True
+
+
+async def sender_reply(api: FakeTelegram, sender: OutboundSender, chat_id: int, chunks: int) -> bool:
+    for i in range(chunks):
+        await sender.run(chat_id, functools.partial(api.send_message, chat_id, f"chunk {i}"))
+    sender.post(CHANNEL_ID, functools.partial(api.send_message, CHANNEL_ID, "notification"))
+    return True
+
+
+async def measure(label: str, api: FakeTelegram, reply, users: int):
+    started = time.perf_counter()
+    done = []
+
+    async def one(chat_id: int):
+        ok = await reply(chat_id)
+        done.append((time.perf_counter() - started, ok))
+
+    await asyncio.gather(*(one(1000 + i) for i in range(users)))
+    times = [t for t, ok in done if ok]
+    failed = sum(1 for _, ok in done if not ok)
+    cells = [f"{percentile(times, p):6.2f}s" for p in (50, 95)] if times else ["-"] * 2
+    print(f"  {label:<14} {cells[0]:>8} {cells[1]:>8} {failed:>13} {api.flood_errors:>6}")
+
+
+async def bench(args):
+    print(f"{args.users} replies of {args.chunks} chunks at once, plus a channel notification each")
+    print(f"  {'setup':<14} {'p50':>8} {'p95':>8} {'replies lost':>13} {'429s':>6}")
+
+    api = FakeTelegram(args.latency)
+    await measure("fixed sleep", api, functools.partial(old_reply, api, chunks=args.chunks), args.users)
+
+    api = FakeTelegram(args.latency)
+    sender = OutboundSender()
+    await measure("sender", api, functools.partial(sender_reply, api, sender, chunks=args.chunks), args.users)
+    stats = sender.stats()
+    print(f"  {'':<14} notifications: {args.users - stats['dropped']} queued, {stats['dropped']} dropped "
+          f"(channel backed up); 429s retried: {stats['rate_limited']}")
+    await sender.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=60)
+    parser.add_argument('--chunks', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per Telegram call')
+    args = parser.parse_args()
+    asyncio.run(bench(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Reply splitter benchmark on large model-style responses
+
+Generates --responses replies of roughly --size characters each, mixing
+prose with **bold**, `inline code`, bare snake_case names and "* " bullets
+with fenced code blocks, the way Gemini answers coding questions. Compares
+the old fixed 4000-char slicing, sent raw with parse_mode='Markdown', with
+split_markdown(): messages per reply, chunks with an unclosed code fence,
+chunks Telegram's legacy Markdown parser would reject (each costs a second
+round trip for the plain-text resend), and split time per reply.
+
+Usage: python benchmarks/bench_splitter.py [--responses 200] [--size 20000] [--seed 7]
+"""
+
+import os
+import re
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram_io import TELEGRAM_MESSAGE_LIMIT, split_markdown
+
+WORDS = ("the request handler returns a response after the async call completes and "
+         "then we cache it so repeated questions are faster for every user").split()
+NAMES = ["user_id", "max_tokens", "http_pool", "get_history", "retry_after", "chat_id"]
+_LINK = re.compile(r'\[[^\]\n]*\]\([^)\n]*\)')
+
+
+def sentence(rng: random.Random) -> str:
+    words = rng.choices(WORDS, k=rng.randint(8, 20))
+    roll = rng.random()
+    if roll < 0.3:
+        words.insert(rng.randrange(len(words)), f"`{rng.choice(NAMES)}`")
+    elif roll < 0.45:
+        words.insert(rng.randrange(len(words)), rng.choice(NAMES))  # Bare snake_case
+    elif roll < 0.6:
+        words.insert(rng.randrange(len(words)), f"**{rng.choice(WORDS)} {rng.choice(WORDS)}**")
+    return " ".join(words).capitalize() + "."
+
+
+def make_response(rng: random.Random, size: int) -> str:
+    parts = []
+    length = 0
+    while length < size:
+        roll = rng.random()
+        if roll < 0.25:
+            lines = [f"    {rng.choice(NAMES)} = {rng.choice(NAMES)}({i})  # step {i}" for i in range(rng.randint(10, 80))]
+            block = "```python\n" + "\n".join(lines) + "\n```"
+        elif roll < 0.4:
+            block = "\n".join(f"* {sentence(rng)}" for _ in range(rng.randint(2, 6)))
+        else:
+            block = " ".join(sentence(rng) for _ in range(rng.randint(2, 6)))
+        parts.append(block)
+        length += len(block) + 2
+    return "\n\n".join(parts)
+
+
+def legacy_markdown_ok(text: str) -> bool:
+    """Rough model of Telegram's parse_mode='Markdown' parser: every entity must close"""
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if char == '\\' and i + 1 < len(text) and text[i + 1] in '_*`[':
+            i += 2
+        elif text.startswith('```', i):
+            end = text.find('```', i + 3)
+            if end < 0:
+                return False
+            i = end + 3
+        elif char in '_*`':
+            end = text.find(char, i + 1)
+            if end < 0:
+                return False
+            i = end + 1
+        elif char == '[':
+            match = _LINK.match(text, i)
+            if not match:
+                return False
+            i = match.end()
+        else:
+            i += 1
+    return True
+
+
+def unclosed_fence(text: str) -> bool:
+    return text.count('```') % 2 == 1
+
+
+def report(label: str, chunked, seconds: float):
+    chunks = [text for reply in chunked for text in reply]
+    rejected = sum(1 for text in chunks if not legacy_markdown_ok(text))
+    broken = sum(1 for text in chunks if unclosed_fence(text))
+    per_reply = len(chunks) / len(chunked)
+    round_trips = (len(chunks) + rejected) / len(chunked)
+    print(f"  {label:<16} {per_reply:>9.2f} {broken:>14} {rejected:>9} {round_trips:>12.2f} "
+          f"{seconds / len(chunked) * 1e3:>9.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--responses', type=int, default=200)
+    parser.add_argument('--size', type=int, default=20000, help='approximate characters per reply')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    responses = [make_response(rng, args.size) for _ in range(args.responses)]
+    print(f"{args.responses} replies of ~{args.size} chars")
+    print(f"  {'splitter':<16} {'msgs/reply':>9} {'unclosed fence':>14} {'rejected':>9} "
+          f"{'trips/reply':>12} {'time/reply':>11}")
+
+    started = time.perf_counter()
+    sliced = [[text[i:i + 4000] for i in range(0, len(text), 4000)] for text in responses]
+    report("4000-char slices", sliced, time.perf_counter() - started)
+
+    started = time.perf_counter()
+    chunks = [split_markdown(text) for text in responses]
+    split = [[markdown for markdown, _ in reply] for reply in chunks]
+    report("split_markdown", split, time.perf_counter() - started)
+
+    assert all(max(len(markdown), len(plain)) <= TELEGRAM_MESSAGE_LIMIT for reply in chunks for markdown, plain in reply)
+
+
+if __name__ == "__main__":
+    main()
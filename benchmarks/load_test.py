@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+End-to-end load test of the bot's message path against local stubs
+
+Drives AdvancedTelegramBot.handle_message of bot.py ("custom") and/or
+bot_gemini_free.py ("gemini") with real telegram.Update objects from
+--users simulated users, each sending --messages messages one after the
+other (closed loop, optional exponential --think time between them).
+Backend calls go to stub_backend.StubBackend on a local port, with
+configurable latency, tail, errors and SSE streaming (--stream). The Gemini
+variant gets the same stub through CustomAPIEngine in place of the SDK, so
+both measure the bot's own pipeline: scheduling, memory, prompt building,
+retries and sending. Telegram is a fake Bot that answers after
+--telegram-latency seconds; the bot's Telegram rate limits are lifted unless
+--telegram-limits is given.
+
+Reports messages/sec, p50/p95/p99 reply latency (handle_message start to
+return), failed backend calls, worst event-loop lag and peak RSS. Each
+variant runs in its own process so RSS figures don't mix. --output appends
+one JSON line per run to a file, to track a baseline over time.
+
+Usage: python benchmarks/load_test.py [--variant both] [--users 50] [--messages 20]
+       [--latency 0.2] [--jitter 0.05] [--error-rate 0] [--stream] [--output runs.jsonl]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import resource
+import subprocess
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from telegram import Chat, Message, Update
+from telegram.ext import ExtBot
+
+from backend import HTTPPool, RetryingEngine
+from stub_backend import StubBackend, start_stub
+
+VARIANTS = ('custom', 'gemini')
+QUESTIONS = [
+    "Python mein async await kaise kaam karta hai?",
+    "FastAPI endpoint ko Render pe deploy kaise karu?",
+    "SQL join aur subquery mein kya fark hai?",
+    "JavaScript promise chain ko debug kaise karein?",
+    "Docker image ka size kaise kam karu?",
+]
+
+
+class FakeTelegram(ExtBot):
+    """Bot whose API calls take LATENCY seconds and never leave the process"""
+
+    LATENCY = 0.02
+    calls = 0
+
+    async def _answer(self, chat_id, text: str = "") -> Message:
+        FakeTelegram.calls += 1
+        await asyncio.sleep(self.LATENCY)
+        return Message(FakeTelegram.calls, datetime.now(timezone.utc), Chat(chat_id, Chat.PRIVATE), text=text)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return await self._answer(chat_id, text)
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        return await self._answer(chat_id, text)
+
+    async def send_chat_action(self, chat_id, action, **kwargs):
+        await self._answer(chat_id)
+        return True
+
+
+def make_update(
+    telegram: FakeTelegram,
+    update_id: int,
+    user_id: int,
+    text: str,
+    chat_id: Optional[int] = None,
+    chat_type: str = Chat.PRIVATE
+) -> Update:
+    user = {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}", 'username': f"user{user_id}"}
+    chat = {'id': user_id if chat_id is None else chat_id, 'type': chat_type}
+    if chat_type == Chat.PRIVATE:
+        chat['first_name'] = user['first_name']
+    else:
+        chat['title'] = f"Chat{chat['id']}"
+    return Update.de_json({
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': chat,
+            'from': user,
+            'text': text
+        }
+    }, telegram)
+
+
+def build_bot(variant: str, url: str, pool: HTTPPool, args):
+    """The variant's AdvancedTelegramBot wired to the stub backend"""
+    rates = {} if args.telegram_limits else {'send_global_rate': 1e6, 'send_chat_rate': 1e6}
+    common = dict(
+        max_in_flight=args.max_in_flight,
+        stream_replies=args.stream,
+        stream_edit_interval=0.25,
+        **rates
+    )
+    if variant == 'custom':
+        from bot import AdvancedTelegramBot
+        return AdvancedTelegramBot(bot_token='1:load-test', api_url=url, http_pool=pool, **common)
+
+    from bot import CustomAPIEngine
+    from bot_gemini_free import AdvancedTelegramBot
+    from context_builder import ContextPacker
+    bot = AdvancedTelegramBot(bot_token='1:load-test', gemini_key='load-test', **common)
+    bot.gemini_engine = bot.ai_engine
+    bot.ai_engine = RetryingEngine(CustomAPIEngine(url, http_pool=pool, context_packer=ContextPacker()))
+    return bot
+
+
+async def close_bot(bot):
+    """Release what build_bot() and the bot opened, except the shared HTTP pool"""
+    await bot.loop_monitor.stop()
+    if bot.summarizer is not None:
+        await bot.summarizer.close()
+    await bot.ai_engine.close()
+    if getattr(bot, 'gemini_engine', None) is not None:
+        await bot.gemini_engine.close()
+    await bot.sender.close()
+    bot.memory.close()
+
+
+def percentile(samples, pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def run_variant(variant: str, args) -> dict:
+    stub = StubBackend(
+        latency=args.latency,
+        jitter=args.jitter,
+        tail_rate=args.tail_rate,
+        tail_latency=args.tail_latency,
+        error_rate=args.error_rate,
+        seed=args.seed
+    )
+    runner, url = await start_stub(stub)
+    pool = HTTPPool(limit=200, limit_per_host=200, timeout=30)
+    FakeTelegram.LATENCY = args.telegram_latency
+    telegram = FakeTelegram('1:load-test')
+    bot = build_bot(variant, url, pool, args)
+    context = SimpleNamespace(bot=telegram)
+    await bot.loop_monitor.start()
+
+    rng = random.Random(args.seed)
+    latencies = []
+    update_ids = iter(range(1, 10 ** 9))
+
+    async def simulated_user(user_id: int):
+        for i in range(args.messages):
+            text = f"{rng.choice(QUESTIONS)} (#{i})"
+            update = make_update(telegram, next(update_ids), user_id, text)
+            started = time.perf_counter()
+            await bot.handle_message(update, context)
+            latencies.append(time.perf_counter() - started)
+            if args.think:
+                await asyncio.sleep(rng.expovariate(1 / args.think))
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(simulated_user(100000 + u) for u in range(args.users)))
+        elapsed = time.perf_counter() - started
+        engine_stats = bot.ai_engine.stats() if hasattr(bot.ai_engine, 'stats') else {}
+        loop_stats = bot.loop_monitor.stats()
+    finally:
+        await close_bot(bot)
+        await pool.close()
+        await runner.cleanup()
+
+    return {
+        'messages': len(latencies),
+        'messages_per_sec': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1e3, 1),
+        'p95_ms': round(percentile(latencies, 95) * 1e3, 1),
+        'p99_ms': round(percentile(latencies, 99) * 1e3, 1),
+        'backend_requests': stub.requests,
+        'backend_errors': stub.errors,
+        'failed_calls': engine_stats.get('failed', 0),
+        'max_loop_lag_ms': loop_stats['max_lag_ms'],
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),  # KiB on Linux
+        'telegram_calls': FakeTelegram.calls
+    }
+
+
+def print_result(variant: str, result: dict):
+    print(f"  {variant:<8} {result['messages_per_sec']:>9.1f} {result['p50_ms']:>8.0f}ms {result['p95_ms']:>8.0f}ms "
+          f"{result['p99_ms']:>8.0f}ms {result['failed_calls']:>7} {result['max_loop_lag_ms']:>9.0f}ms "
+          f"{result['peak_rss_mb']:>8.1f}MB")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, timeout=10
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ''
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--variant', choices=VARIANTS + ('both',), default='both')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=20, help='messages per user')
+    parser.add_argument('--think', type=float, default=0.0, help='mean seconds between a user\'s messages')
+    parser.add_argument('--latency', type=float, default=0.2, help='stub seconds per reply')
+    parser.add_argument('--jitter', type=float, default=0.05)
+    parser.add_argument('--tail-rate', type=float, default=0.0)
+    parser.add_argument('--tail-latency', type=float, default=2.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--stream', action='store_true', help='stream replies (SSE from the stub, live edits)')
+    parser.add_argument('--telegram-latency', type=float, default=0.02)
+    parser.add_argument('--telegram-limits', action='store_true', help='keep the bot\'s Telegram rate limits')
+    parser.add_argument('--max-in-flight', type=int, default=32)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='append results as JSON lines to this file')
+    parser.add_argument('--json', action='store_true', help=argparse.SUPPRESS)  # Child process output
+    args = parser.parse_args()
+
+    if args.json:
+        print(json.dumps(asyncio.run(run_variant(args.variant, args))))
+        return
+
+    print(f"{args.users} users x {args.messages} messages, stub {args.latency * 1e3:.0f}±{args.jitter * 1e3:.0f} ms, "
+          f"errors {args.error_rate:.0%}, streaming {'on' if args.stream else 'off'}")
+    print(f"  {'variant':<8} {'msgs/sec':>9} {'p50':>10} {'p95':>10} {'p99':>10} {'failed':>7} "
+          f"{'loop lag':>11} {'peak RSS':>10}")
+    variants = VARIANTS if args.variant == 'both' else (args.variant,)
+    for variant in variants:
+        # A fresh process per variant keeps peak RSS and module state separate
+        child = subprocess.run(
+            [sys.executable, os.path.abspath(__file__)] + sys.argv[1:] + ['--variant', variant, '--json'],
+            capture_output=True, text=True
+        )
+        if child.returncode != 0:
+            print(f"  {variant:<8} failed: {(child.stderr.strip().splitlines() or ['?'])[-1]}")
+            continue
+        result = json.loads(child.stdout.strip().splitlines()[-1])
+        print_result(variant, result)
+        if args.output:
+            record = {
+                'timestamp': datetime.now(timezone.utc).isoformat(),
+                'commit': git_commit(),
+                'variant': variant,
+                'params': {k: v for k, v in vars(args).items() if k not in ('output', 'json', 'variant')},
+                **result
+            }
+            with open(args.output, 'a') as f:
+                f.write(json.dumps(record) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Replay a traffic recording against the bot and the stub backend
+
+Reads a file written with TRAFFIC_RECORD_PATH (see traffic.py) and feeds
+its updates back into AdvancedTelegramBot (--variant custom or gemini, as in
+load_test.py) with the recorded timing, at --speed times real time; quiet
+stretches longer than --max-gap seconds (restarts, nights) are cut short.
+Each anonymized user and chat becomes a stable fake id, and each text a
+filler text of the recorded length that carries its hash, so repeated
+questions repeat. The stub backend looks that hash up and answers the way
+the recorded call for the same text went: same duration, same error status,
+same reply length (a stream's whole duration comes before its first chunk).
+Calls it can't match, like summaries, get a random recorded outcome.
+
+Reports replay time against the recorded span, messages/sec, p50/p95/p99
+handling latency, the most updates in flight at once, failed backend calls,
+worst event-loop lag and peak RSS; --output appends them as a JSON line.
+
+Usage: python benchmarks/replay_traffic.py traffic.jsonl [--variant custom] [--speed 1]
+       [--max-gap 30] [--limit 0] [--stream] [--output runs.jsonl]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import resource
+from collections import deque
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Deque, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Chat
+
+from backend import HTTPPool
+from load_test import VARIANTS, FakeTelegram, build_bot, close_bot, git_commit, make_update, percentile
+from stub_backend import StubBackend, start_stub
+
+MARKER = re.compile(r'#([0-9a-f]{12})\b')
+FILLER = "python code error kaise fix karu async function database query deploy server list loop".split()
+
+Call = Tuple[float, str, int]  # (seconds, result, reply length)
+
+
+def load_recording(path: str, limit: int = 0) -> Tuple[List[Dict], Dict[str, Deque[Call]], int]:
+    """Updates in time order, backend calls queued per text hash, and unreadable lines"""
+    updates: List[Dict] = []
+    calls: Dict[str, Deque[Call]] = {}
+    skipped = 0
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                skipped += 1  # E.g. the last line of a recording cut off by a crash
+                continue
+            if record.get('e') == 'u' and 'u' in record:
+                updates.append(record)
+            elif record.get('e') == 'b':
+                calls.setdefault(record['h'], deque()).append((record['s'], record['r'], record.get('o', 0)))
+    updates.sort(key=lambda record: record['t'])
+    return updates[:limit] if limit else updates, calls, skipped
+
+
+def replay_text(text_hash: str, length: int) -> str:
+    """Stand-in text of the recorded length, the same for every occurrence of the hash"""
+    marker = f"#{text_hash}"
+    rng = random.Random(text_hash)
+    words = []
+    size = len(marker)
+    while size < length:
+        word = rng.choice(FILLER)
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words + [marker])
+
+
+def fake_ids(record: Dict) -> Tuple[int, int, str]:
+    """Stable Telegram-like (user id, chat id, chat type) for the anonymized record"""
+    user_id = int(record['u'], 16) % 10 ** 9 + 1
+    chat_type = record.get('ct', Chat.PRIVATE)
+    if chat_type == Chat.PRIVATE or 'c' not in record:
+        return user_id, user_id, Chat.PRIVATE
+    return user_id, -(10 ** 12 + int(record['c'], 16) % 10 ** 12), chat_type
+
+
+class ReplayStub(StubBackend):
+    """Stub backend that answers each text the way its recorded call went"""
+
+    def __init__(self, calls: Dict[str, Deque[Call]], default_latency: float, seed: int):
+        super().__init__(latency=0.0, seed=seed)  # No extra pacing between stream chunks
+        self.calls = calls
+        self.fallback = [call for queue in calls.values() for call in queue] or [(default_latency, 'ok', 200)]
+        self.matched = 0
+        self.unmatched = 0
+
+    def _plan(self, payload: Dict) -> Tuple[float, Optional[int], str]:
+        messages = payload.get('messages') or [{}]
+        hashes = MARKER.findall(messages[-1].get('content', ''))
+        queue = self.calls.get(hashes[-1]) if hashes else None
+        if queue:
+            seconds, result, length = queue.popleft()
+            self.matched += 1
+        else:
+            seconds, result, length = self.rng.choice(self.fallback)
+            self.unmatched += 1
+        if result.isdigit():
+            status = int(result)
+        else:
+            # "rejected" has no HTTP status, but must not be retried either
+            status = {'error': 503, 'rejected': 400}.get(result)  # "cancelled" calls just take their time
+        reply = ("stub reply " * (length // 11 + 1))[:max(1, length)]
+        return seconds, status, reply
+
+
+async def replay(args) -> Dict:
+    updates, calls, skipped = load_recording(args.recording, args.limit)
+    if not updates:
+        raise SystemExit(f"No updates in {args.recording}")
+    stub = ReplayStub(calls, args.latency, args.seed)
+    runner, url = await start_stub(stub)
+    pool = HTTPPool(limit=200, limit_per_host=200, timeout=60)
+    FakeTelegram.LATENCY = args.telegram_latency
+    telegram = FakeTelegram('1:replay')
+    bot = build_bot(args.variant, url, pool, args)
+    context = SimpleNamespace(bot=telegram)
+    await bot.loop_monitor.start()
+
+    latencies: List[float] = []
+    active = 0
+    peak_active = 0
+    replayed = 0
+    slip = 0.0
+
+    async def handle(update_id: int, record: Dict):
+        nonlocal active, peak_active
+        user_id, chat_id, chat_type = fake_ids(record)
+        if record['k'] == 'text':
+            text = replay_text(record['h'], record['n'])
+            handler = bot.handle_message
+        else:
+            text = f"/{record['cmd']}"
+            handler = getattr(bot, f"{record['cmd']}_command")
+        update = make_update(telegram, update_id, user_id, text, chat_id=chat_id, chat_type=chat_type)
+        active += 1
+        peak_active = max(peak_active, active)
+        started = time.perf_counter()
+        try:
+            await handler(update, context)
+        finally:
+            active -= 1
+        latencies.append(time.perf_counter() - started)
+
+    tasks = []
+    started = time.perf_counter()
+    offset = 0.0
+    previous = updates[0]['t']
+    try:
+        for update_id, record in enumerate(updates, 1):
+            offset += min(max(0.0, record['t'] - previous), args.max_gap) / args.speed
+            previous = record['t']
+            replayable = record['k'] == 'text' or (
+                record['k'] == 'cmd' and hasattr(bot, f"{record.get('cmd')}_command")
+            )
+            if not replayable:
+                continue
+            wait = started + offset - time.perf_counter()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            else:
+                slip = max(slip, -wait)  # The driver itself fell behind the recording
+            replayed += 1
+            tasks.append(asyncio.create_task(handle(update_id, record)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+        engine_stats = bot.ai_engine.stats() if hasattr(bot.ai_engine, 'stats') else {}
+        loop_stats = bot.loop_monitor.stats()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await close_bot(bot)
+        await pool.close()
+        await runner.cleanup()
+
+    return {
+        'updates': len(updates),
+        'replayed': replayed,
+        'users': len({record['u'] for record in updates}),
+        'unreadable_lines': skipped,
+        'recorded_span_s': round(updates[-1]['t'] - updates[0]['t'], 1),
+        'replay_s': round(elapsed, 1),
+        'driver_slip_ms': round(slip * 1e3, 1),
+        'messages_per_sec': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1e3, 1),
+        'p95_ms': round(percentile(latencies, 95) * 1e3, 1),
+        'p99_ms': round(percentile(latencies, 99) * 1e3, 1),
+        'peak_active': peak_active,
+        'backend_matched': stub.matched,
+        'backend_unmatched': stub.unmatched,
+        'backend_errors': stub.errors,
+        'failed_calls': engine_stats.get('failed', 0),
+        'max_loop_lag_ms': loop_stats['max_lag_ms'],
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),  # KiB on Linux
+        'telegram_calls': FakeTelegram.calls
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('recording', help='file written with TRAFFIC_RECORD_PATH')
+    parser.add_argument('--variant', choices=VARIANTS, default='custom')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed, 10 = ten times faster')
+    parser.add_argument('--max-gap', type=float, default=30.0, help='longest recorded pause kept, in seconds')
+    parser.add_argument('--limit', type=int, default=0, help='replay only the first N updates')
+    parser.add_argument('--latency', type=float, default=0.2, help='stub seconds per reply if nothing was recorded')
+    parser.add_argument('--stream', action='store_true', help='stream replies (SSE from the stub, live edits)')
+    parser.add_argument('--telegram-latency', type=float, default=0.02)
+    parser.add_argument('--telegram-limits', action='store_true', help='keep the bot\'s Telegram rate limits')
+    parser.add_argument('--max-in-flight', type=int, default=32)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='append results as JSON lines to this file')
+    args = parser.parse_args()
+    if args.speed <= 0:
+        parser.error("--speed must be positive")
+
+    result = asyncio.run(replay(args))
+    print(f"{args.recording}: {result['replayed']}/{result['updates']} updates from {result['users']} users, "
+          f"recorded over {result['recorded_span_s']:.0f}s, replayed in {result['replay_s']:.1f}s "
+          f"({args.speed:g}x, gaps capped at {args.max_gap:g}s, driver slip {result['driver_slip_ms']:.0f} ms)")
+    print(f"  {'variant':<8} {'msgs/sec':>9} {'p50':>10} {'p95':>10} {'p99':>10} {'in flight':>10} "
+          f"{'failed':>7} {'matched':>8} {'loop lag':>11} {'peak RSS':>10}")
+    print(f"  {args.variant:<8} {result['messages_per_sec']:>9.1f} {result['p50_ms']:>8.0f}ms "
+          f"{result['p95_ms']:>8.0f}ms {result['p99_ms']:>8.0f}ms {result['peak_active']:>10} "
+          f"{result['failed_calls']:>7} {result['backend_matched']:>8} {result['max_loop_lag_ms']:>9.0f}ms "
+          f"{result['peak_rss_mb']:>8.1f}MB")
+    if args.output:
+        record = {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'commit': git_commit(),
+            'variant': args.variant,
+            'params': {k: v for k, v in vars(args).items() if k not in ('output', 'variant')},
+            **result
+        }
+        with open(args.output, 'a') as f:
+            f.write(json.dumps(record) + "\n")
+
+
+if __name__ == "__main__":
+    main()
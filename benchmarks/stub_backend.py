@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local stub of the custom chat API for router, load and failure testing
+
+Speaks the protocol CustomAPIEngine expects: POST a chat payload, get
+{"content": ...} back, or Server-Sent Events when the payload has
+"stream": true. Latency, errors and a cold start are configurable, so a
+few stubs side by side can stand in for a fast, a slow and a flaky
+backend. Errors can carry a Retry-After header.
+
+Usage: python benchmarks/stub_backend.py [--port 8081] [--latency 0.2] [--jitter 0.05]
+       [--tail-rate 0.05] [--tail-latency 2] [--error-rate 0.1] [--cold-start 5]
+       [--fail-first 3] [--retry-after 1]
+"""
+
+import json
+import random
+import asyncio
+import argparse
+from typing import Dict, Optional, Tuple
+
+from aiohttp import web
+
+
+class StubBackend:
+    """Request handler with configurable latency, tail, errors and cold start"""
+
+    def __init__(
+        self,
+        latency: float = 0.2,
+        jitter: float = 0.0,
+        tail_rate: float = 0.0,
+        tail_latency: float = 2.0,
+        error_rate: float = 0.0,
+        error_status: int = 503,
+        cold_start: float = 0.0,
+        fail_first: int = 0,
+        retry_after: Optional[float] = None,
+        chunks: int = 8,
+        seed: Optional[int] = None
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.cold_start = cold_start
+        self.fail_first = fail_first
+        self.retry_after = retry_after
+        self.chunks = chunks
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self._warm = asyncio.Event() if cold_start > 0 else None
+        self._warming = False
+
+    async def _warm_up(self):
+        """Hold requests until the cold start is over"""
+        if self._warm is not None and not self._warm.is_set():
+            if not self._warming:
+                self._warming = True
+                await asyncio.sleep(self.cold_start)
+                self._warm.set()
+            else:
+                await self._warm.wait()
+
+    def _plan(self, payload: Dict) -> Tuple[float, Optional[int], str]:
+        """How long this request takes, the error status it fails with (if any) and its reply"""
+        delay = self.latency + self.rng.uniform(-self.jitter, self.jitter)
+        if self.tail_rate and self.rng.random() < self.tail_rate:
+            delay = self.tail_latency
+        failed = self.requests <= self.fail_first or (self.error_rate and self.rng.random() < self.error_rate)
+        messages = payload.get('messages') or [{}]
+        reply = f"stub reply to: {messages[-1].get('content', '')[:80]}"
+        return max(0.0, delay), self.error_status if failed else None, reply
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        self.requests += 1
+        payload = await request.json()
+        await self._warm_up()
+        delay, error_status, reply = self._plan(payload)
+        await asyncio.sleep(delay)
+
+        if error_status is not None:
+            self.errors += 1
+            headers = {'Retry-After': str(self.retry_after)} if self.retry_after is not None else None
+            return web.json_response({'error': 'stub failure'}, status=error_status, headers=headers)
+
+        if not payload.get('stream'):
+            return web.json_response({'content': reply})
+
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        step = max(1, len(reply) // self.chunks)
+        for start in range(0, len(reply), step):
+            event = json.dumps({'content': reply[start:start + step]})
+            await response.write(f"data: {event}\n\n".encode())
+            await asyncio.sleep(self.latency / self.chunks)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+
+def make_app(stub: StubBackend) -> web.Application:
+    app = web.Application()
+    app.router.add_post('/', stub.handle)
+    app.router.add_post('/chat', stub.handle)
+    return app
+
+
+async def start_stub(stub: StubBackend, host: str = '127.0.0.1', port: int = 0):
+    """Serve the stub in the running loop; returns (runner, url)"""
+    runner = web.AppRunner(make_app(stub), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{bound_port}/chat"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds per reply')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--tail-rate', type=float, default=0.0, help='fraction of slow replies')
+    parser.add_argument('--tail-latency', type=float, default=2.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-status', type=int, default=503)
+    parser.add_argument('--cold-start', type=float, default=0.0, help='delay before the first reply')
+    parser.add_argument('--fail-first', type=int, default=0, help='fail this many requests first')
+    parser.add_argument('--retry-after', type=float, default=None, help='Retry-After sent with errors')
+    args = parser.parse_args()
+
+    stub = StubBackend(
+        latency=args.latency,
+        jitter=args.jitter,
+        tail_rate=args.tail_rate,
+        tail_latency=args.tail_latency,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        cold_start=args.cold_start,
+        fail_first=args.fail_first,
+        retry_after=args.retry_after
+    )
+    print(f"Stub backend on http://{args.host}:{args.port}/chat")
+    web.run_app(make_app(stub), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,18 +7,51 @@ Built for Render Deployment with Custom Claude FastAPI Integration + Flask Healt
 
 import os
 import json
+import hashlib
+import time
+import codecs
+import asyncio
+import functools
 import logging
 from datetime import datetime, timezone
-from typing import Dict, List, Optional
-from collections import defaultdict
+from urllib.parse import urlparse
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Tuple
+import tempfile
 import traceback
-import requests
+import aiohttp
 import threading
 import signal
 import sys
-from flask import Flask, jsonify
+from flask import Flask, Response, jsonify
 
-from telegram import Update, User
+from backend import (
+    BACKEND_REQUEST_SECONDS,
+    BackendError,
+    BackendRouter,
+    HTTPPool,
+    RetryingEngine,
+    deadline,
+    parse_retry_after
+)
+from caching import ResponseCache, SemanticCache
+from context_builder import ContextPacker, ConversationSummarizer, HistoryRetriever
+from health import LoopMonitor
+from memory import MessageRecord, MemoryStore, MemorySystem
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY, register_bot_metrics
+from scheduling import FairScheduler, MessageCoalescer
+from telegram_io import (
+    BotApplication,
+    ChannelDigest,
+    OutboundSender,
+    StreamingReply,
+    TimedUpdateQueue,
+    WebhookServer,
+    split_message,
+    wait_for_stop_signal
+)
+from traffic import RecordingEngine, TrafficRecorder
+
+from telegram import Update
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -57,8 +90,17 @@ def home():
 
 @flask_app.route('/health')
 def health():
-    """Health check for monitoring"""
-    return jsonify({'status': 'healthy', 'timestamp': datetime.now(timezone.utc).isoformat()})
+    """Health check for monitoring; 503 when the bot's event loop is wedged or swamped"""
+    check = flask_app.config.get('HEALTH_CHECK')
+    if check is None:
+        return jsonify({'status': 'healthy', 'timestamp': datetime.now(timezone.utc).isoformat()})
+    report = check()
+    return jsonify(report), 503 if report['status'] == 'unhealthy' else 200
+
+@flask_app.route('/metrics')
+def metrics():
+    """Prometheus metrics"""
+    return Response(REGISTRY.render(), content_type=METRICS_CONTENT_TYPE)
 
 def run_flask():
     """Run Flask server in background thread"""
@@ -111,181 +153,228 @@ SYSTEM_PROMPT = """Tu ek advanced AI assistant hai joh:
 - Actual implementation ke liye code examples de
 """
 
+SUMMARY_PROMPT = """Tu ek conversation summarizer hai.
+Purani summary aur naye messages ko mila kar ek chhoti, updated summary likh:
+- User kya seekh raha hai, kaunse topics aur problems discuss hue
+- Important decisions, code details aur user ki preferences
+- Bullet points, maximum 8 lines, koi greeting ya extra text nahi
+"""
+
 # ============================================================================
-# MEMORY SYSTEM - User Context & Learning Tracking
+# CUSTOM API WRAPPER - Your FastAPI Integration
 # ============================================================================
 
-class MemorySystem:
-    """Advanced memory system for tracking user interactions and learning progress"""
-    
-    def __init__(self):
-        self.user_memories: Dict[int, Dict] = {}
-        self.conversation_history: Dict[int, List] = defaultdict(list)
-        self.learning_progress: Dict[int, Dict] = {}
-        
-    def initialize_user(self, user_id: int, user: User):
-        """Initialize memory for a new user"""
-        if user_id not in self.user_memories:
-            self.user_memories[user_id] = {
-                'user_name': user.first_name or 'Friend',
-                'created_at': datetime.now().isoformat(),
-                'total_interactions': 0,
-                'topics_explored': [],
-                'coding_skills': [],
-                'questions_asked': [],
-                'learning_pace': 'adaptive',
-                'preferences': {}
-            }
-            self.learning_progress[user_id] = {
-                'python': 0,
-                'javascript': 0,
-                'apis': 0,
-                'databases': 0,
-                'deployment': 0
-            }
-    
-    def add_to_history(self, user_id: int, role: str, content: str, topic: str = None):
-        """Add message to conversation history"""
-        self.conversation_history[user_id].append({
-            'timestamp': datetime.now().isoformat(),
-            'role': role,
-            'content': content[:200],  # Store first 200 chars
-            'topic': topic
+class CustomAPIEngine:
+    """Custom AI Engine using your FastAPI endpoint (async, pooled keep-alive connections)"""
+    
+    def __init__(
+        self,
+        api_url: str,
+        http_pool: Optional[HTTPPool] = None,
+        context_packer: Optional[ContextPacker] = None,
+        max_tokens: int = 4000
+    ):
+        self.api_url = api_url
+        self.name = urlparse(api_url).netloc or api_url  # Metrics label
+        self.http_pool = http_pool or HTTPPool()
+        self.context_packer = context_packer or ContextPacker()
+        self.max_tokens = max_tokens
+    
+    def _build_payload(
+        self,
+        user_message: str,
+        conversation_history: Sequence[MessageRecord],
+        user_context: str,
+        system_prompt: str,
+        stream: bool = False
+    ) -> Dict:
+        """Build the chat payload for your API"""
+        messages = []
+        packed = self.context_packer.pack(user_message, conversation_history, user_context, system_prompt)
+        
+        # Add system prompt as first message
+        enhanced_system = packed.system_prompt + "\n" + packed.user_context
+        messages.append({
+            "role": "system",
+            "content": enhanced_system
         })
         
-        # Keep last 50 messages
-        if len(self.conversation_history[user_id]) > 50:
-            self.conversation_history[user_id] = self.conversation_history[user_id][-50:]
-    
-    def get_context(self, user_id: int) -> str:
-        """Get user context for better responses"""
-        if user_id not in self.user_memories:
-            return ""
-        
-        mem = self.user_memories[user_id]
-        history = self.conversation_history.get(user_id, [])
-        
-        context = f"""
-**User Context:**
-- Name: {mem['user_name']}
-- Total Interactions: {mem['total_interactions']}
-- Topics: {', '.join(mem['topics_explored'][-5:]) if mem['topics_explored'] else 'New user'}
-- Recent Questions: {mem['questions_asked'][-2:] if mem['questions_asked'] else 'None'}
-- Learning Pace: {mem['learning_pace']}
-        """
-        return context
+        # Add recent conversation history that fits the token budget
+        for role, content in packed.turns:
+            messages.append({
+                "role": role,
+                "content": content
+            })
+        
+        # Add current message
+        messages.append({
+            "role": "user",
+            "content": user_message
+        })
+        
+        return {
+            "messages": messages,
+            "max_tokens": self.max_tokens,
+            "temperature": 0.7,
+            "stream": stream
+        }
     
-    def update_after_response(self, user_id: int, question: str, topic: str = None):
-        """Update memory after each response"""
-        if user_id not in self.user_memories:
-            return
+    async def complete(
+        self,
+        user_message: str,
+        conversation_history: Sequence[MessageRecord],
+        user_context: str = "",
+        system_prompt: str = SYSTEM_PROMPT
+    ) -> str:
+        """Call your FastAPI and return the completion, raising BackendError on failure"""
+        payload = self._build_payload(user_message, conversation_history, user_context, system_prompt)
         
-        mem = self.user_memories[user_id]
-        mem['total_interactions'] += 1
-        mem['questions_asked'].append(question[:50])
+        started_at = time.perf_counter()
+        status = 'error'
+        try:
+            async with self.http_pool.session.post(self.api_url, json=payload) as response:
+                status = str(response.status)
+                if response.status != 200:
+                    raise BackendError(
+                        f"API Error: Status {response.status}",
+                        f"❌ API Error: Status code {response.status}\n\nKripya baad mein try kijiye.",
+                        status=response.status,
+                        retry_after=parse_retry_after(response.headers.get('Retry-After'))
+                    )
+                data = await response.json(content_type=None)
+                return data.get('content', 'No response received')
         
-        if topic and topic not in mem['topics_explored']:
-            mem['topics_explored'].append(topic)
+        except asyncio.TimeoutError:
+            status = 'timeout'
+            raise BackendError("API Timeout", "⚠️ Request timeout ho gaya. Please try again!")
         
-        # Keep last 10 questions
-        mem['questions_asked'] = mem['questions_asked'][-10:]
-    
-    def get_conversation_summary(self, user_id: int) -> str:
-        """Get summary of recent conversation"""
-        history = self.conversation_history.get(user_id, [])
-        if not history:
-            return "No previous conversation"
+        except aiohttp.ClientError as e:
+            status = 'connection_error'
+            raise BackendError(
+                f"API Request Error: {str(e)}",
+                f"❌ Connection Error: {str(e)}\n\nKripya baad mein try kijiye."
+            )
         
-        # Get last 5 exchanges
-        recent = history[-10:]
-        summary = "Recent conversation:\n"
-        for msg in recent:
-            role = "You" if msg['role'] == 'user' else "Assistant"
-            summary += f"{role}: {msg['content']}...\n"
+        except asyncio.CancelledError:
+            status = 'cancelled'
+            raise
         
-        return summary
-
-# ============================================================================
-# CUSTOM API WRAPPER - Your FastAPI Integration
-# ============================================================================
-
-class CustomAPIEngine:
-    """Custom AI Engine using your FastAPI endpoint"""
+        finally:
+            BACKEND_REQUEST_SECONDS.observe(time.perf_counter() - started_at, engine=self.name, status=status)
     
-    def __init__(self, api_url: str):
-        self.api_url = api_url
+    async def stream_response(
+        self,
+        user_message: str,
+        conversation_history: Sequence[MessageRecord],
+        user_context: str = "",
+        system_prompt: str = SYSTEM_PROMPT
+    ) -> AsyncIterator[str]:
+        """
+        Stream the completion as text deltas, raising BackendError on failure
+        
+        Understands Server-Sent Events (``data: {...}`` lines ending with
+        ``data: [DONE]``) and plain chunked text. A backend that ignores the
+        stream flag and answers with JSON is yielded as a single delta.
+        """
+        payload = self._build_payload(
+            user_message, conversation_history, user_context, system_prompt, stream=True
+        )
+        
+        started_at = time.perf_counter()
+        status = 'error'
+        try:
+            async with self.http_pool.session.post(
+                self.api_url, json=payload, timeout=self.http_pool.stream_timeout
+            ) as response:
+                status = 'cancelled'  # Until the body has been read to the end
+                if response.status != 200:
+                    status = str(response.status)
+                    raise BackendError(
+                        f"API Error: Status {response.status}",
+                        f"❌ API Error: Status code {response.status}\n\nKripya baad mein try kijiye.",
+                        status=response.status,
+                        retry_after=parse_retry_after(response.headers.get('Retry-After'))
+                    )
+                
+                content_type = response.headers.get('Content-Type', '')
+                if 'application/json' in content_type:
+                    data = await response.json(content_type=None)
+                    yield data.get('content', 'No response received')
+                
+                elif 'text/event-stream' in content_type:
+                    async for raw_line in response.content:
+                        line = raw_line.decode('utf-8', errors='replace').strip()
+                        if not line.startswith('data:'):
+                            continue
+                        data = line[5:].strip()
+                        if data == '[DONE]':
+                            break
+                        delta = self._parse_stream_event(data)
+                        if delta:
+                            yield delta
+                
+                else:
+                    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+                    async for chunk in response.content.iter_any():
+                        delta = decoder.decode(chunk)
+                        if delta:
+                            yield delta
+                status = str(response.status)
+        
+        except asyncio.TimeoutError:
+            status = 'timeout'
+            raise BackendError("API Timeout", "⚠️ Request timeout ho gaya. Please try again!")
+        
+        except aiohttp.ClientError as e:
+            status = 'connection_error'
+            raise BackendError(
+                f"API Request Error: {str(e)}",
+                f"❌ Connection Error: {str(e)}\n\nKripya baad mein try kijiye."
+            )
         
-    def generate_response(
+        finally:
+            BACKEND_REQUEST_SECONDS.observe(time.perf_counter() - started_at, engine=self.name, status=status)
+    
+    @staticmethod
+    def _parse_stream_event(data: str) -> str:
+        """Extract the text delta from one SSE data payload"""
+        try:
+            event = json.loads(data)
+        except json.JSONDecodeError:
+            return data
+        if not isinstance(event, dict):
+            return str(event)
+        if 'content' in event:
+            return event['content'] or ""
+        if 'delta' in event and isinstance(event['delta'], str):
+            return event['delta']
+        # OpenAI-compatible chunk
+        choices = event.get('choices') or [{}]
+        return (choices[0].get('delta') or {}).get('content') or ""
+    
+    async def generate_response(
         self,
         user_message: str,
-        conversation_history: List[Dict],
+        conversation_history: Sequence[MessageRecord],
         user_context: str = "",
         system_prompt: str = SYSTEM_PROMPT
     ) -> str:
         """Generate response using your custom FastAPI"""
         
         try:
-            # Build messages array
-            messages = []
-            
-            # Add system prompt as first message
-            enhanced_system = system_prompt + "\n" + user_context
-            messages.append({
-                "role": "system",
-                "content": enhanced_system
-            })
-            
-            # Add recent conversation history (last 3 exchanges = 6 messages)
-            for msg in conversation_history[-6:]:
-                messages.append({
-                    "role": msg['role'],
-                    "content": msg['content']
-                })
-            
-            # Add current message
-            messages.append({
-                "role": "user",
-                "content": user_message
-            })
-            
-            # Prepare payload for your API
-            payload = {
-                "messages": messages,
-                "max_tokens": 4000,
-                "temperature": 0.7,
-                "stream": False
-            }
-            
-            # Call your FastAPI
-            response = requests.post(
-                self.api_url,
-                json=payload,
-                headers={
-                    'Content-Type': 'application/json',
-                    'User-Agent': 'TelegramBot/1.0'
-                },
-                timeout=60
-            )
-            
-            # Check response
-            if response.status_code == 200:
-                data = response.json()
-                return data.get('content', 'No response received')
-            else:
-                logger.error(f"API Error: Status {response.status_code}")
-                return f"❌ API Error: Status code {response.status_code}\n\nKripya baad mein try kijiye."
-        
-        except requests.Timeout:
-            logger.error("API Timeout")
-            return "⚠️ Request timeout ho gaya. Please try again!"
+            return await self.complete(user_message, conversation_history, user_context, system_prompt)
         
-        except requests.RequestException as e:
-            logger.error(f"API Request Error: {str(e)}")
-            return f"❌ Connection Error: {str(e)}\n\nKripya baad mein try kijiye."
+        except BackendError as e:
+            logger.error(str(e))
+            return e.user_message
         
         except Exception as e:
             logger.error(f"Unexpected error: {str(e)}")
             return f"❌ Unexpected error: {str(e)}\n\n{traceback.format_exc()}"
+    
+    async def close(self):
+        """Release pooled HTTP connections"""
+        await self.http_pool.close()
 
 # ============================================================================
 # TELEGRAM BOT HANDLERS
@@ -294,12 +383,151 @@ class CustomAPIEngine:
 class AdvancedTelegramBot:
     """Advanced Telegram Bot with custom API integration"""
     
-    def __init__(self, bot_token: str, api_url: str, channel_id: str = None):
+    def __init__(
+        self,
+        bot_token: str,
+        api_url: str,
+        channel_id: str = None,
+        http_pool: Optional[HTTPPool] = None,
+        concurrent_updates: int = 256,
+        max_in_flight: int = 32,
+        coalesce_window: float = 0.0,
+        supersede_in_flight: bool = False,
+        stream_replies: bool = False,
+        stream_edit_interval: float = 1.0,
+        response_cache: Optional[ResponseCache] = None,
+        semantic_cache: Optional[SemanticCache] = None,
+        semantic_cache_path: Optional[str] = None,
+        memory_store: Optional[MemoryStore] = None,
+        memory_max_users: int = 0,
+        memory_max_bytes: int = 0,
+        context_packer: Optional[ContextPacker] = None,
+        api_max_tokens: int = 4000,
+        summary_mode: str = "model",
+        summary_trigger_turns: int = 16,
+        summary_keep_recent: int = 6,
+        summary_max_tokens: int = 300,
+        retrieval_top_k: int = 3,
+        retrieval_max_tokens: int = 300,
+        retrieval_max_users: int = 200,
+        retrieval_max_messages: int = 1000,
+        extra_backends: Optional[List[Tuple[str, object]]] = None,
+        hedge_after: float = 0.0,
+        breaker_failures: int = 5,
+        breaker_reset: float = 30.0,
+        retry_attempts: int = 3,
+        retry_base_delay: float = 0.5,
+        retry_max_delay: float = 8.0,
+        reply_deadline: float = 90.0,
+        webhook_url: Optional[str] = None,
+        webhook_path: str = '/telegram',
+        webhook_secret: Optional[str] = None,
+        webhook_max_connections: int = 40,
+        port: int = 10000,
+        slow_callback: float = 0.25,
+        health_degraded_lag: float = 0.5,
+        health_unhealthy_lag: float = 5.0,
+        health_degraded_backlog: int = 100,
+        health_unhealthy_backlog: int = 1000,
+        send_global_rate: float = 30.0,
+        send_chat_rate: float = 1.0,
+        send_group_rate: float = 20 / 60,
+        channel_digest_interval: float = 60.0,
+        channel_digest_max_events: int = 50,
+        traffic_recorder: Optional[TrafficRecorder] = None
+    ):
         self.bot_token = bot_token
         self.api_url = api_url
         self.channel_id = channel_id
-        self.memory = MemorySystem()
-        self.ai_engine = CustomAPIEngine(api_url)
+        self.concurrent_updates = concurrent_updates
+        self.scheduler = FairScheduler(max_in_flight)
+        self.coalescer = MessageCoalescer(coalesce_window)
+        self.supersede_in_flight = supersede_in_flight
+        self.stream_replies = stream_replies
+        self.stream_edit_interval = stream_edit_interval
+        self.response_cache = response_cache
+        self.semantic_cache = semantic_cache
+        self.semantic_cache_path = semantic_cache_path
+        retriever = None
+        if retrieval_top_k > 0:
+            retriever = HistoryRetriever(
+                store=memory_store,
+                top_k=retrieval_top_k,
+                max_tokens=retrieval_max_tokens,
+                exclude_recent=context_packer.max_turns if context_packer else 6,
+                max_users=retrieval_max_users,
+                max_messages=retrieval_max_messages
+            )
+        self.memory = MemorySystem(
+            store=memory_store,
+            content_limit=200,
+            max_users=memory_max_users,
+            max_bytes=memory_max_bytes,
+            retriever=retriever
+        )
+        self.ai_engine = CustomAPIEngine(
+            api_url,
+            http_pool=http_pool,
+            context_packer=context_packer,
+            max_tokens=api_max_tokens
+        )
+        if traffic_recorder is not None:
+            # Innermost, so every attempt is recorded as the backend saw it
+            self.ai_engine = RecordingEngine(self.ai_engine, traffic_recorder)
+        if extra_backends:
+            # Route over the custom API plus fallbacks: failover, hedging, circuit breaking
+            self.ai_engine = BackendRouter(
+                [(api_url, self.ai_engine)] + list(extra_backends),
+                hedge_after=hedge_after,
+                failure_threshold=breaker_failures,
+                reset_timeout=breaker_reset
+            )
+        if retry_attempts > 1:
+            self.ai_engine = RetryingEngine(
+                self.ai_engine,
+                attempts=retry_attempts,
+                base_delay=retry_base_delay,
+                max_delay=retry_max_delay
+            )
+        self.reply_deadline = reply_deadline
+        self.webhook_url = webhook_url
+        self.webhook_path = webhook_path
+        self.webhook_secret = webhook_secret
+        self.webhook_max_connections = webhook_max_connections
+        self.port = port
+        register_bot_metrics(self.scheduler, self.memory, response_cache, semantic_cache)
+        self.loop_monitor = LoopMonitor(
+            slow_callback=slow_callback,
+            degraded_lag=health_degraded_lag,
+            unhealthy_lag=health_unhealthy_lag,
+            degraded_backlog=health_degraded_backlog,
+            unhealthy_backlog=health_unhealthy_backlog,
+            backlog=self.update_backlog
+        )
+        self.sender = OutboundSender(
+            global_rate=send_global_rate,
+            chat_rate=send_chat_rate,
+            group_rate=send_group_rate
+        )
+        self.channel_digest = None
+        if channel_id:
+            # Channel activity goes out as periodic digests, never inline with a reply
+            self.channel_digest = ChannelDigest(
+                self.sender,
+                channel_id,
+                interval=channel_digest_interval,
+                max_events=channel_digest_max_events
+            )
+        self.summarizer = None
+        if summary_mode != "off":
+            self.summarizer = ConversationSummarizer(
+                self.memory,
+                summarize=self.summarize_turns if summary_mode == "model" else None,
+                trigger_turns=summary_trigger_turns,
+                keep_recent=summary_keep_recent,
+                max_tokens=summary_max_tokens
+            )
+        self.traffic_recorder = traffic_recorder
         self.application = None
     
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -333,17 +561,11 @@ class AdvancedTelegramBot:
 ╚════════════════════════════════════════════════════════════╝
         """
         
-        await update.message.reply_text(welcome_message)
+        await self.reply(update, welcome_message)
         
-        # Send to channel if configured
-        if self.channel_id:
-            try:
-                await context.bot.send_message(
-                    chat_id=self.channel_id,
-                    text=f"🆕 New user joined: {user.first_name} (@{user.username or 'unknown'})"
-                )
-            except Exception as e:
-                logger.error(f"Channel notification error: {e}")
+        # Report to channel if configured (posted with the next digest)
+        if self.channel_digest is not None:
+            self.channel_digest.add('join', f"{user.first_name} (@{user.username or 'unknown'})")
     
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /help command"""
@@ -399,6 +621,7 @@ class AdvancedTelegramBot:
 /status - Aapka progress aur stats
 /clear - History clear karo
 /channel - Updates channel link
+/cache on|off - Common questions ke cached jawab on/off karo
 
 **TIPS FOR BEST RESULTS:**
 ✅ Aapna questions detail mein pocho
@@ -409,21 +632,22 @@ class AdvancedTelegramBot:
 🔥 Ab pocho jo bhi chahiye! Mein sirf jawab dene ke liye hoon!
         """
         
-        await update.message.reply_text(help_text)
+        await self.reply(update, help_text)
     
     async def status_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Show user status and learning progress"""
         user_id = update.effective_user.id
         
-        if user_id not in self.memory.user_memories:
-            await update.message.reply_text(
+        if not self.memory.has_user(user_id):
+            await self.reply(
+                update,
                 "❌ Pehle /start se start karo!\n"
                 "then kuch questions pocho aur meri memory develop hogi."
             )
             return
         
-        mem = self.memory.user_memories[user_id]
-        progress = self.memory.learning_progress.get(user_id, {})
+        mem = self.memory.get_user(user_id)
+        progress = self.memory.get_progress(user_id)
         
         status_text = f"""
 📊 **YOUR AI ASSISTANT STATUS**
@@ -448,16 +672,39 @@ class AdvancedTelegramBot:
 🎯 Keep learning! Jab bhi pocho, detailed explanations denge!
         """
         
-        await update.message.reply_text(status_text)
+        await self.reply(update, status_text)
     
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Main message handler - advanced AI response"""
+        # The latency budget covers the whole update: waiting, retries and the reply
+        with deadline(self.reply_deadline):
+            # Rapid follow-up messages are merged into the first one's turn
+            texts = await self.coalescer.collect(
+                (update.effective_chat.id, update.effective_user.id), update.message.text
+            )
+            if texts is None:
+                return
+            
+            user_id = update.effective_user.id
+            if self.supersede_in_flight and self.scheduler.cancel(user_id):
+                logger.info(f"⏹️ Newer message from {user_id} superseded the pending reply")
+            
+            # One turn per user at a time, global slots shared round-robin
+            try:
+                async with self.scheduler.turn(user_id):
+                    await self.process_message(update, context, "\n".join(texts))
+            except asyncio.CancelledError:
+                if not self.scheduler.was_cancelled(asyncio.current_task()):
+                    raise
+                # Superseded, cleared or shutting down: the reply is outdated, send nothing
+    
+    async def process_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE, message_text: str):
+        """Reply to one (possibly merged) message; runs inside the user's scheduler turn"""
         user = update.effective_user
         user_id = user.id
-        message_text = update.message.text
         
         # Initialize if new user
-        if user_id not in self.memory.user_memories:
+        if not self.memory.has_user(user_id):
             self.memory.initialize_user(user_id, user)
         
         # Show typing indicator
@@ -469,57 +716,190 @@ class AdvancedTelegramBot:
             self.memory.update_after_response(user_id, message_text)
             
             # Get user context
-            user_context = self.memory.get_context(user_id)
+            user_context = self.memory.get_context(user_id, message_text)
             
             # Get conversation history
-            history = self.memory.conversation_history.get(user_id, [])
+            history = self.memory.get_history(user_id)
             
-            # Generate response using your custom API
-            response = self.ai_engine.generate_response(
-                user_message=message_text,
-                conversation_history=history,
-                user_context=user_context,
-                system_prompt=SYSTEM_PROMPT
-            )
+            # Serve repeated questions from the answer caches, unless the answer
+            # draws on the running summary or retrieved past messages
+            cacheable = not self.memory.has_conversation_context(user_context)
+            response = self.cached_answer(user_id, message_text, history) if cacheable else None
+            
+            if response is not None:
+                await self.send_reply(update, response)
+            else:
+                if self.stream_replies:
+                    # Stream tokens into a live-edited message
+                    response, completed = await self.stream_reply(
+                        update, context, message_text, history, user_context
+                    )
+                else:
+                    # Generate response using your custom API
+                    response, completed = await self.generate_reply(message_text, history, user_context)
+                    await self.send_reply(update, response)
+                
+                if completed and cacheable:
+                    self.store_answer(user_id, message_text, history, response)
             
             # Add to memory
             self.memory.add_to_history(user_id, 'assistant', response)
             
-            # Send response in chunks if too long (Telegram limit: 4096 chars)
-            if len(response) > 4000:
-                # Split response into chunks
-                chunks = [response[i:i+4000] for i in range(0, len(response), 4000)]
-                for i, chunk in enumerate(chunks):
-                    if i > 0:
-                        # Small delay between messages
-                        import asyncio
-                        await asyncio.sleep(0.5)
-                    await update.message.reply_text(chunk)
-            else:
-                await update.message.reply_text(response)
+            # Fold older turns into the running summary in the background
+            if self.summarizer is not None:
+                self.summarizer.maybe_schedule(user_id)
             
-            # Send update to channel
-            if self.channel_id:
-                try:
-                    summary = message_text[:50] + "..." if len(message_text) > 50 else message_text
-                    await context.bot.send_message(
-                        chat_id=self.channel_id,
-                        text=f"💬 Query: {summary}\nUser: {user.first_name}"
-                    )
-                except Exception as e:
-                    logger.error(f"Channel update error: {e}")
+            # Report to channel (posted with the next digest)
+            if self.channel_digest is not None:
+                summary = message_text[:50] + "..." if len(message_text) > 50 else message_text
+                self.channel_digest.add('query', f"{user.first_name}: {summary}")
         
         except Exception as e:
             error_msg = f"❌ Error: {str(e)}\n\nKripya baad mein try kijiye."
             logger.error(f"Message handling error: {traceback.format_exc()}")
-            await update.message.reply_text(error_msg)
+            await self.reply(update, error_msg)
+    
+    async def summarize_turns(self, previous: str, turns: Sequence[MessageRecord]) -> str:
+        """Ask the engine to fold older turns into the running summary"""
+        transcript = "\n".join(
+            f"{'User' if msg.role == 'user' else 'Assistant'}: {msg.content}" for msg in turns
+        )
+        prompt = f"Purani summary:\n{previous or 'Koi nahi'}\n\nNaye messages:\n{transcript}"
+        # Runs in the background after the reply, so the update's deadline doesn't apply
+        with deadline(None):
+            return await self.ai_engine.complete(prompt, (), "", SUMMARY_PROMPT)
+    
+    def cached_answer(self, user_id: int, message_text: str, history: Sequence[MessageRecord]) -> Optional[str]:
+        """Look the turn up in the exact, then the semantic answer cache"""
+        # History already ends with the current message; answers are personalized, so scoped per user
+        previous = history[:-1]
+        
+        if self.response_cache is not None and not self.response_cache.is_opted_out(user_id):
+            response = self.response_cache.get(self.response_cache.make_key(message_text, previous, user_id))
+            if response is not None:
+                return response
+        
+        if self.semantic_cache is not None and not self.semantic_cache.is_opted_out(user_id):
+            return self.semantic_cache.lookup(message_text, previous, user_id)
+        return None
+    
+    def store_answer(self, user_id: int, message_text: str, history: Sequence[MessageRecord], response: str):
+        """Remember a completed answer in every answer cache the user allows"""
+        previous = history[:-1]
+        
+        if self.response_cache is not None and not self.response_cache.is_opted_out(user_id):
+            self.response_cache.set(self.response_cache.make_key(message_text, previous, user_id), response)
+        
+        if self.semantic_cache is not None and not self.semantic_cache.is_opted_out(user_id):
+            self.semantic_cache.add(message_text, previous, response, user_id)
+    
+    async def generate_reply(
+        self,
+        message_text: str,
+        history: Sequence[MessageRecord],
+        user_context: str
+    ) -> Tuple[str, bool]:
+        """Ask the engine for a full reply; returns (text, completed)"""
+        try:
+            response = await self.ai_engine.complete(
+                user_message=message_text,
+                conversation_history=history,
+                user_context=user_context,
+                system_prompt=SYSTEM_PROMPT
+            )
+            return response, True
+        except BackendError as e:
+            logger.error(str(e))
+            return e.user_message, False
+    
+    async def reply(self, update: Update, text: str):
+        """Answer in the update's chat through the outbound sender"""
+        await self.sender.run(update.effective_chat.id, functools.partial(update.message.reply_text, text))
+    
+    async def send_reply(self, update: Update, response: str):
+        """Send a reply, split at paragraphs/code blocks if too long (Telegram limit: 4096 chars)"""
+        for chunk in split_message(response):
+            await self.reply(update, chunk)
+    
+    async def stream_reply(
+        self,
+        update: Update,
+        context: ContextTypes.DEFAULT_TYPE,
+        message_text: str,
+        history: Sequence[MessageRecord],
+        user_context: str
+    ) -> Tuple[str, bool]:
+        """Stream the engine output into a progressively edited Telegram message; returns (text, completed)"""
+        reply = StreamingReply(
+            context.bot,
+            update.effective_chat.id,
+            edit_interval=self.stream_edit_interval,
+            sender=self.sender
+        )
+        started_at = time.perf_counter()
+        completed = True
+        
+        try:
+            async for delta in self.ai_engine.stream_response(
+                user_message=message_text,
+                conversation_history=history,
+                user_context=user_context,
+                system_prompt=SYSTEM_PROMPT
+            ):
+                await reply.push(delta)
+        except BackendError as e:
+            logger.error(str(e))
+            completed = False
+            await reply.push(("\n\n" if reply.text else "") + e.user_message)
+        
+        if reply.first_token_at is not None:
+            logger.info(f"⚡ First token after {reply.first_token_at - started_at:.2f}s")
+        return await reply.finish(), completed
+    
+    async def cache_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Turn response caching on or off for this user"""
+        user_id = update.effective_user.id
+        caches = [c for c in (self.response_cache, self.semantic_cache) if c is not None]
+        
+        if not caches:
+            await self.reply(update, "ℹ️ Response cache is bot par enabled nahi hai.")
+            return
+        
+        if context.args and context.args[0].lower() == 'off':
+            for cache in caches:
+                cache.opt_out(user_id)
+            await self.reply(
+                update,
+                "🔒 Cache off! Ab har jawab fresh generate hoga."
+            )
+        elif context.args and context.args[0].lower() == 'on':
+            for cache in caches:
+                cache.opt_in(user_id)
+            await self.reply(
+                update,
+                "⚡ Cache on! Common questions ke jawab turant milenge."
+            )
+        else:
+            state = "off" if caches[0].is_opted_out(user_id) else "on"
+            await self.reply(
+                update,
+                f"💾 Response cache: {state}\n"
+                "Use: /cache on ya /cache off"
+            )
     
     async def clear_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Clear conversation history"""
         user_id = update.effective_user.id
-        self.memory.conversation_history[user_id] = []
         
-        await update.message.reply_text(
+        # Abort any reply still being generated for the old conversation,
+        # including messages still waiting in their coalescing window
+        self.coalescer.discard((update.effective_chat.id, user_id))
+        self.scheduler.cancel(user_id)
+        async with self.scheduler.turn(user_id):
+            self.memory.clear_history(user_id)
+        
+        await self.reply(
+            update,
             "✨ Conversation history clear ho gayi!\n"
             "Ab se fresh start karenge! 🚀"
         )
@@ -528,13 +908,15 @@ class AdvancedTelegramBot:
         """Send channel link"""
         if self.channel_id:
             channel_link = "https://t.me/+UqvupdHeiCoxZGQ1"
-            await update.message.reply_text(
+            await self.reply(
+                update,
                 f"📢 **Updates Channel Join Karo!**\n\n"
                 f"New features, tips aur latest updates ke liye:\n"
                 f"{channel_link}"
             )
         else:
-            await update.message.reply_text(
+            await self.reply(
+                update,
                 "📢 Channel link abhi available nahi hai.\n"
                 "Bot admin se pocho!"
             )
@@ -550,6 +932,7 @@ class AdvancedTelegramBot:
         self.application.add_handler(CommandHandler("status", self.status_command))
         self.application.add_handler(CommandHandler("clear", self.clear_command))
         self.application.add_handler(CommandHandler("channel", self.channel_command))
+        self.application.add_handler(CommandHandler("cache", self.cache_command))
         
         # Message handler
         self.application.add_handler(MessageHandler(
@@ -560,14 +943,99 @@ class AdvancedTelegramBot:
         # Error handler
         self.application.add_error_handler(self.error_handler)
     
+    def update_backlog(self) -> int:
+        """Updates and messages received but not yet being handled"""
+        pending = 0
+        if self.application is not None and isinstance(self.application.update_queue, TimedUpdateQueue):
+            pending = self.application.update_queue.pending
+        return pending + self.scheduler.queued
+    
+    async def post_init(self, application: Application):
+        """Start watching the event loop and posting channel digests once it is running"""
+        await self.loop_monitor.start()
+        if self.channel_digest is not None:
+            await self.channel_digest.start(application.bot)
+    
+    async def post_shutdown(self, application: Application):
+        """Release engine resources once the application has stopped"""
+        await self.loop_monitor.stop()
+        await self.sender.close()
+        if self.summarizer is not None:
+            await self.summarizer.close()
+        await self.ai_engine.close()
+        self.memory.close()
+        if self.traffic_recorder is not None:
+            self.traffic_recorder.close()
+        if self.semantic_cache is not None and self.semantic_cache_path:
+            self.semantic_cache.save(self.semantic_cache_path)
+    
+    async def pre_stop(self, application: Application):
+        """Abort in-flight replies so shutdown doesn't wait on the backend"""
+        cancelled = self.scheduler.cancel_all()
+        if cancelled:
+            logger.info(f"⏹️ Cancelled {cancelled} in-flight replies for shutdown")
+        if self.channel_digest is not None:
+            await self.channel_digest.stop()  # Last digest goes out while the bot can still send
+    
+    async def serve_webhook(self):
+        """Receive updates and health checks on one aiohttp server until SIGINT/SIGTERM"""
+        server = WebhookServer(
+            self.application,
+            path=self.webhook_path,
+            secret_token=self.webhook_secret,
+            port=self.port,
+            info={
+                'bot': 'Advanced AI Telegram Bot',
+                'version': '2.0',
+                'api': 'Custom Claude Sonnet FastAPI'
+            },
+            health=self.loop_monitor.check
+        )
+        await self.application.initialize()
+        await self.application.start()
+        await self.post_init(self.application)
+        try:
+            await server.start()
+            await self.application.bot.set_webhook(
+                self.webhook_url.rstrip('/') + self.webhook_path,
+                secret_token=self.webhook_secret,
+                allowed_updates=Update.ALL_TYPES,
+                drop_pending_updates=True,
+                max_connections=self.webhook_max_connections
+            )
+            logger.info("✅ Bot is running (webhook)! Press Ctrl+C to stop.")
+            await wait_for_stop_signal()
+        finally:
+            logger.info("🛑 Shutting down gracefully...")
+            await server.stop()
+            await self.application.stop()
+            await self.application.shutdown()
+            await self.post_shutdown(self.application)
+    
     def run(self):
-        """Start the bot using run_polling (blocking call)"""
-        self.application = Application.builder().token(self.bot_token).build()
+        """Start the bot: webhook server if webhook_url is set, else run_polling (blocking call)"""
+        builder = (
+            Application.builder()
+            .token(self.bot_token)
+            .concurrent_updates(self.concurrent_updates)
+            .update_queue(TimedUpdateQueue(recorder=self.traffic_recorder))
+            .application_class(BotApplication, kwargs={'pre_stop': self.pre_stop})
+            .post_init(self.post_init)
+            .post_shutdown(self.post_shutdown)
+        )
+        if self.webhook_url:
+            builder = builder.updater(None)  # Updates arrive through WebhookServer
+        self.application = builder.build()
         
         self.setup_handlers()
         
         logger.info("🤖 Advanced AI Telegram Bot Starting...")
         logger.info(f"🌐 API URL: {self.api_url}")
+        
+        if self.webhook_url:
+            asyncio.run(self.serve_webhook())
+            return
+        
         logger.info("✅ Bot is running! Press Ctrl+C to stop.")
         
         # Run polling (blocking call - keeps running)
@@ -589,7 +1057,64 @@ def main():
     - TELEGRAM_BOT_TOKEN: Your Telegram bot token
     - CUSTOM_API_URL: Your custom FastAPI endpoint (default: https://claude-sonnet-fastapi.onrender.com/chat)
     - CHANNEL_ID: (Optional) Telegram channel ID for updates
-    - PORT: (Optional) Flask server port (default: 10000)
+    - PORT: (Optional) Health check / metrics / webhook server port (default: 10000)
+    - WEBHOOK_URL: (Optional) Public base URL (e.g. https://your-app.onrender.com); enables webhook mode instead of polling
+    - WEBHOOK_PATH: (Optional) Path Telegram posts updates to (default: /telegram)
+    - WEBHOOK_SECRET: (Optional) Secret token Telegram sends with every update (default: derived from the bot token)
+    - WEBHOOK_MAX_CONNECTIONS: (Optional) Parallel update deliveries Telegram may open, 1-100 (default: 40)
+    - API_TIMEOUT: (Optional) Backend request timeout in seconds; for streamed replies, max wait per chunk (default: 60)
+    - API_POOL_LIMIT: (Optional) Max pooled connections in total (default: 100)
+    - API_POOL_LIMIT_PER_HOST: (Optional) Max pooled connections per host (default: 100)
+    - API_MAX_TOKENS: (Optional) max_tokens requested from the backend (default: 4000)
+    - MAX_CONCURRENT_UPDATES: (Optional) Updates processed concurrently (default: 256)
+    - MAX_IN_FLIGHT_REQUESTS: (Optional) Messages answered at once across all users, 0 = no cap (default: 32)
+    - COALESCE_WINDOW_MS: (Optional) Merge messages a user sends within this many ms into one reply, 0 = off (default: 0)
+    - SUPERSEDE_IN_FLIGHT: (Optional) "true" to cancel a pending reply when the user sends a newer message (default: false)
+    - STREAM_REPLIES: (Optional) "true" to stream tokens into a live-edited message (default: false)
+    - STREAM_EDIT_INTERVAL: (Optional) Seconds between streaming message edits (default: 1.0)
+    - RESPONSE_CACHE_SIZE: (Optional) Cached answers kept, 0 disables the cache (default: 0)
+    - RESPONSE_CACHE_TTL: (Optional) Seconds a cached answer stays valid (default: 3600)
+    - RESPONSE_CACHE_HISTORY_TURNS: (Optional) History entries included in the cache key (default: 2)
+    - SEMANTIC_CACHE_SIZE: (Optional) Similar-question cache capacity, 0 disables it (default: 0)
+    - SEMANTIC_CACHE_THRESHOLD: (Optional) Cosine similarity needed for a hit (default: 0.92)
+    - SEMANTIC_CACHE_PATH: (Optional) File the semantic cache is saved to and loaded from
+    - MEMORY_DB_PATH: (Optional) SQLite file for persistent user memory (default: in-memory only)
+    - MEMORY_FLUSH_INTERVAL: (Optional) Seconds between write-behind batches (default: 0.5)
+    - MEMORY_BATCH_SIZE: (Optional) Max writes per batch (default: 200)
+    - MEMORY_MAX_USERS: (Optional) Users kept in RAM, idle ones spill to disk (default: 0 = unbounded)
+    - MEMORY_MAX_MB: (Optional) Approximate RAM budget for user memory in MB (default: 0 = unbounded)
+    - CONTEXT_TOKEN_BUDGET: (Optional) Estimated input tokens per backend request (default: 2000)
+    - CONTEXT_MAX_TURNS: (Optional) Most history entries sent with a request (default: 6)
+    - SUMMARY_MODE: (Optional) "model", "extractive" or "off" rolling history summaries (default: model)
+    - SUMMARY_TRIGGER_TURNS: (Optional) Unsummarized history entries that trigger a summary (default: 16)
+    - SUMMARY_KEEP_RECENT: (Optional) Newest entries left out of the summary (default: 6)
+    - SUMMARY_MAX_TOKENS: (Optional) Size cap of the running summary (default: 300)
+    - RETRIEVAL_TOP_K: (Optional) Relevant past messages added to the prompt, 0 disables (default: 3)
+    - RETRIEVAL_MAX_TOKENS: (Optional) Size cap of the retrieved snippets (default: 300)
+    - RETRIEVAL_MAX_USERS: (Optional) Per-user search indexes kept in RAM (default: 200)
+    - RETRIEVAL_MAX_MESSAGES: (Optional) Newest history entries each search index covers (default: 1000)
+    - BACKEND_URLS: (Optional) Comma-separated extra chat endpoints to fail over / hedge to
+    - GOOGLE_GEMINI_API_KEY: (Optional) Adds Gemini as a fallback backend
+    - HEDGE_AFTER_MS: (Optional) Send a slow request to the next backend too after this many ms, 0 = off (default: 0)
+    - BREAKER_FAILURES: (Optional) Consecutive failures that take a backend out of rotation (default: 5)
+    - BREAKER_RESET_SECONDS: (Optional) Seconds before a failed backend is probed again (default: 30)
+    - RETRY_ATTEMPTS: (Optional) Tries per backend call for 429/5xx/network errors, 1 = no retries (default: 3)
+    - RETRY_BASE_DELAY: (Optional) First retry backoff in seconds, doubled each retry, with jitter (default: 0.5)
+    - RETRY_MAX_DELAY: (Optional) Backoff cap in seconds (default: 8)
+    - REPLY_DEADLINE_SECONDS: (Optional) Latency budget per message incl. retries, 0 = none (default: 90)
+    - SLOW_CALLBACK_MS: (Optional) Log the stack of anything blocking the event loop this long, 0 = off (default: 250)
+    - HEALTH_LAG_DEGRADED_MS: (Optional) Event-loop lag that makes /health report "degraded", 0 = off (default: 500)
+    - HEALTH_LAG_UNHEALTHY_MS: (Optional) Event-loop lag that makes /health answer 503 "unhealthy", 0 = off (default: 5000)
+    - HEALTH_BACKLOG_DEGRADED: (Optional) Unhandled updates/messages that make /health "degraded", 0 = off (default: 100)
+    - HEALTH_BACKLOG_UNHEALTHY: (Optional) Unhandled updates/messages that make /health 503 "unhealthy", 0 = off (default: 1000)
+    - TELEGRAM_GLOBAL_RATE: (Optional) Messages per second sent across all chats (default: 30)
+    - TELEGRAM_CHAT_RATE: (Optional) Messages per second sent to one private chat (default: 1)
+    - TELEGRAM_GROUP_RATE: (Optional) Messages per minute sent to one group or channel (default: 20)
+    - CHANNEL_DIGEST_INTERVAL: (Optional) Seconds between channel activity digests (default: 60)
+    - CHANNEL_DIGEST_MAX_EVENTS: (Optional) Post a digest early once this many events are waiting (default: 50)
+    - TRAFFIC_RECORD_PATH: (Optional) Append anonymized updates and backend latencies here, for replay (default: off)
+    - TRAFFIC_RECORD_SALT: (Optional) Secret for the anonymizing hashes; set it to link users across restarts (default: random)
+    - TRAFFIC_RECORD_MAX_MB: (Optional) Stop recording once the file reaches this size, 0 = no cap (default: 100)
     """
     
     # Get credentials from environment
@@ -601,20 +1126,157 @@ def main():
     if not bot_token:
         raise ValueError("❌ TELEGRAM_BOT_TOKEN environment variable not set!")
     
+    # Backend connection pool
+    http_pool = HTTPPool(
+        limit=int(os.getenv('API_POOL_LIMIT', 100)),
+        limit_per_host=int(os.getenv('API_POOL_LIMIT_PER_HOST', 100)),
+        timeout=float(os.getenv('API_TIMEOUT', 60))
+    )
+    
+    # Persistent memory (survives restarts when MEMORY_DB_PATH is on a persistent disk)
+    memory_store = None
+    memory_db_path = os.getenv('MEMORY_DB_PATH')
+    memory_max_users = int(os.getenv('MEMORY_MAX_USERS', 0))
+    memory_max_bytes = int(float(os.getenv('MEMORY_MAX_MB', 0)) * 1024 * 1024)
+    if memory_db_path or memory_max_users or memory_max_bytes:
+        # Bounded memory without a database spills idle users to a scratch file
+        memory_store = MemoryStore(
+            memory_db_path or os.path.join(tempfile.gettempdir(), 'telegram_bot_memory_spill.db'),
+            batch_size=int(os.getenv('MEMORY_BATCH_SIZE', 200)),
+            flush_interval=float(os.getenv('MEMORY_FLUSH_INTERVAL', 0.5)),
+            reset=not memory_db_path
+        )
+    
+    # Response cache for repeated questions
+    response_cache = None
+    cache_size = int(os.getenv('RESPONSE_CACHE_SIZE', 0))
+    if cache_size > 0:
+        response_cache = ResponseCache(
+            max_entries=cache_size,
+            ttl=float(os.getenv('RESPONSE_CACHE_TTL', 3600)),
+            history_turns=int(os.getenv('RESPONSE_CACHE_HISTORY_TURNS', 2))
+        )
+    
+    # Semantic cache for similar (not identical) questions
+    semantic_cache = None
+    semantic_cache_path = os.getenv('SEMANTIC_CACHE_PATH')
+    semantic_size = int(os.getenv('SEMANTIC_CACHE_SIZE', 0))
+    if semantic_size > 0:
+        semantic_cache = SemanticCache(
+            capacity=semantic_size,
+            threshold=float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.92)),
+            history_turns=int(os.getenv('RESPONSE_CACHE_HISTORY_TURNS', 2))
+        )
+        if semantic_cache_path:
+            semantic_cache.load(semantic_cache_path)
+    
+    # Prompt context budget
+    context_packer = ContextPacker(
+        budget=int(os.getenv('CONTEXT_TOKEN_BUDGET', 2000)),
+        max_turns=int(os.getenv('CONTEXT_MAX_TURNS', 6))
+    )
+    
+    # Fallback backends for the router
+    api_max_tokens = int(os.getenv('API_MAX_TOKENS', 4000))
+    extra_backends = [
+        (url, CustomAPIEngine(url, http_pool=http_pool, context_packer=context_packer, max_tokens=api_max_tokens))
+        for url in (u.strip() for u in os.getenv('BACKEND_URLS', '').split(','))
+        if url
+    ]
+    gemini_key = os.getenv('GOOGLE_GEMINI_API_KEY')
+    if gemini_key:
+        try:
+            from bot_gemini_free import GeminiAIEngine
+            extra_backends.append((
+                "gemini",
+                GeminiAIEngine(
+                    gemini_key,
+                    workers=int(os.getenv('GEMINI_WORKERS', 8)),
+                    mode=os.getenv('GEMINI_EXECUTION_MODE', 'thread'),
+                    context_packer=context_packer
+                )
+            ))
+        except ImportError as e:
+            logger.warning(f"⚠️ Gemini fallback disabled: {e}")
+    
+    # Opt-in traffic recording for offline replay (benchmarks/replay_traffic.py)
+    traffic_recorder = None
+    traffic_record_path = os.getenv('TRAFFIC_RECORD_PATH')
+    if traffic_record_path:
+        traffic_recorder = TrafficRecorder(
+            traffic_record_path,
+            salt=os.getenv('TRAFFIC_RECORD_SALT'),
+            max_bytes=int(float(os.getenv('TRAFFIC_RECORD_MAX_MB', 100)) * 1024 * 1024)
+        )
+    
+    # Webhook mode: updates and health checks share one async server
+    webhook_url = os.getenv('WEBHOOK_URL')
+    webhook_secret = os.getenv('WEBHOOK_SECRET') or hashlib.sha256(bot_token.encode()).hexdigest()[:32]
+    
     logger.info("🚀 Initializing Advanced AI Telegram Bot...")
     logger.info(f"🌐 Using Custom API: {api_url}")
     
-    # Start Flask server in background thread
-    flask_thread = threading.Thread(target=run_flask, daemon=True)
-    flask_thread.start()
-    logger.info(f"🌍 Flask health check server started on port {os.getenv('PORT', 10000)}")
+    if not webhook_url:
+        # Start Flask server in background thread
+        flask_thread = threading.Thread(target=run_flask, daemon=True)
+        flask_thread.start()
+        logger.info(f"🌍 Flask health check server started on port {os.getenv('PORT', 10000)}")
     
     # Create and run bot
     bot = AdvancedTelegramBot(
         bot_token=bot_token,
         api_url=api_url,
-        channel_id=channel_id
+        channel_id=channel_id,
+        http_pool=http_pool,
+        concurrent_updates=int(os.getenv('MAX_CONCURRENT_UPDATES', 256)),
+        max_in_flight=int(os.getenv('MAX_IN_FLIGHT_REQUESTS', 32)),
+        coalesce_window=int(os.getenv('COALESCE_WINDOW_MS', 0)) / 1000,
+        supersede_in_flight=os.getenv('SUPERSEDE_IN_FLIGHT', 'false').lower() == 'true',
+        stream_replies=os.getenv('STREAM_REPLIES', 'false').lower() == 'true',
+        stream_edit_interval=float(os.getenv('STREAM_EDIT_INTERVAL', 1.0)),
+        response_cache=response_cache,
+        semantic_cache=semantic_cache,
+        semantic_cache_path=semantic_cache_path,
+        memory_store=memory_store,
+        memory_max_users=memory_max_users,
+        memory_max_bytes=memory_max_bytes,
+        context_packer=context_packer,
+        summary_mode=os.getenv('SUMMARY_MODE', 'model').lower(),
+        summary_trigger_turns=int(os.getenv('SUMMARY_TRIGGER_TURNS', 16)),
+        summary_keep_recent=int(os.getenv('SUMMARY_KEEP_RECENT', 6)),
+        summary_max_tokens=int(os.getenv('SUMMARY_MAX_TOKENS', 300)),
+        retrieval_top_k=int(os.getenv('RETRIEVAL_TOP_K', 3)),
+        retrieval_max_tokens=int(os.getenv('RETRIEVAL_MAX_TOKENS', 300)),
+        retrieval_max_users=int(os.getenv('RETRIEVAL_MAX_USERS', 200)),
+        retrieval_max_messages=int(os.getenv('RETRIEVAL_MAX_MESSAGES', 1000)),
+        api_max_tokens=api_max_tokens,
+        extra_backends=extra_backends,
+        hedge_after=int(os.getenv('HEDGE_AFTER_MS', 0)) / 1000,
+        breaker_failures=int(os.getenv('BREAKER_FAILURES', 5)),
+        breaker_reset=float(os.getenv('BREAKER_RESET_SECONDS', 30)),
+        retry_attempts=int(os.getenv('RETRY_ATTEMPTS', 3)),
+        retry_base_delay=float(os.getenv('RETRY_BASE_DELAY', 0.5)),
+        retry_max_delay=float(os.getenv('RETRY_MAX_DELAY', 8)),
+        reply_deadline=float(os.getenv('REPLY_DEADLINE_SECONDS', 90)),
+        webhook_url=webhook_url,
+        webhook_path=os.getenv('WEBHOOK_PATH', '/telegram'),
+        webhook_secret=webhook_secret,
+        webhook_max_connections=int(os.getenv('WEBHOOK_MAX_CONNECTIONS', 40)),
+        port=int(os.getenv('PORT', 10000)),
+        slow_callback=int(os.getenv('SLOW_CALLBACK_MS', 250)) / 1000,
+        health_degraded_lag=int(os.getenv('HEALTH_LAG_DEGRADED_MS', 500)) / 1000,
+        health_unhealthy_lag=int(os.getenv('HEALTH_LAG_UNHEALTHY_MS', 5000)) / 1000,
+        health_degraded_backlog=int(os.getenv('HEALTH_BACKLOG_DEGRADED', 100)),
+        health_unhealthy_backlog=int(os.getenv('HEALTH_BACKLOG_UNHEALTHY', 1000)),
+        send_global_rate=float(os.getenv('TELEGRAM_GLOBAL_RATE', 30)),
+        send_chat_rate=float(os.getenv('TELEGRAM_CHAT_RATE', 1)),
+        send_group_rate=float(os.getenv('TELEGRAM_GROUP_RATE', 20)) / 60,
+        channel_digest_interval=float(os.getenv('CHANNEL_DIGEST_INTERVAL', 60)),
+        channel_digest_max_events=int(os.getenv('CHANNEL_DIGEST_MAX_EVENTS', 50)),
+        traffic_recorder=traffic_recorder
     )
+    # The Flask thread keeps answering while the loop is blocked, so it reports the loop's health
+    flask_app.config['HEALTH_CHECK'] = bot.loop_monitor.check
     
     # Handle signals for graceful shutdown
     def signal_handler(sig, frame):
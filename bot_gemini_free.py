@@ -13,13 +13,19 @@ Google Gemini API:
 
 import os
 import json
+import hashlib
+import time
+import asyncio
+import functools
 import logging
-from datetime import datetime
-from typing import Dict, List, Optional
-from collections import defaultdict
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple
+import tempfile
 import traceback
 
-from telegram import Update, User
+from telegram import Update
+from telegram.error import BadRequest
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -28,6 +34,33 @@ from telegram.ext import (
     ContextTypes,
 )
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+
+from backend import (
+    BACKEND_REQUEST_SECONDS,
+    BackendError,
+    BackendRouter,
+    HTTPPool,
+    LatencyStats,
+    RetryingEngine,
+    deadline
+)
+from caching import ResponseCache, SemanticCache
+from context_builder import ContextPacker, ConversationSummarizer, HistoryRetriever
+from health import LoopMonitor
+from memory import MessageRecord, MemoryStore, MemorySystem
+from metrics import register_bot_metrics
+from scheduling import FairScheduler, MessageCoalescer
+from telegram_io import (
+    BotApplication,
+    OutboundSender,
+    StreamingReply,
+    TimedUpdateQueue,
+    WebhookServer,
+    split_markdown,
+    wait_for_stop_signal
+)
+from traffic import RecordingEngine, TrafficRecorder
 
 # ============================================================================
 # LOGGING CONFIGURATION
@@ -102,138 +135,311 @@ SYSTEM_PROMPT = """Tu ek advanced AI assistant hai joh:
 Tu ALWAYS helpful, honest, aur informative be. Kabi bhi misinformation mat de.
 """
 
-# ============================================================================
-# MEMORY SYSTEM - User Context & Learning Tracking
-# ============================================================================
-
-class MemorySystem:
-    """Advanced memory system for tracking user interactions"""
-    
-    def __init__(self):
-        self.user_memories: Dict[int, Dict] = {}
-        self.conversation_history: Dict[int, List] = defaultdict(list)
-        self.learning_progress: Dict[int, Dict] = {}
-        
-    def initialize_user(self, user_id: int, user: User):
-        """Initialize memory for a new user"""
-        if user_id not in self.user_memories:
-            self.user_memories[user_id] = {
-                'user_name': user.first_name or 'Friend',
-                'created_at': datetime.now().isoformat(),
-                'total_interactions': 0,
-                'topics_explored': [],
-                'questions_asked': [],
-                'learning_pace': 'adaptive',
-            }
-            self.learning_progress[user_id] = {
-                'python': 0,
-                'javascript': 0,
-                'apis': 0,
-                'databases': 0,
-                'deployment': 0
-            }
-    
-    def add_to_history(self, user_id: int, role: str, content: str, topic: str = None):
-        """Add message to conversation history"""
-        self.conversation_history[user_id].append({
-            'timestamp': datetime.now().isoformat(),
-            'role': role,
-            'content': content[:300] if len(content) > 300 else content,
-            'topic': topic
-        })
-        
-        # Keep last 50 messages
-        if len(self.conversation_history[user_id]) > 50:
-            self.conversation_history[user_id] = self.conversation_history[user_id][-50:]
-    
-    def get_context(self, user_id: int) -> str:
-        """Get user context for better responses"""
-        if user_id not in self.user_memories:
-            return ""
-        
-        mem = self.user_memories[user_id]
-        
-        context = f"""
-**User Context:**
-- Name: {mem['user_name']}
-- Total Interactions: {mem['total_interactions']}
-- Topics: {', '.join(mem['topics_explored'][-5:]) if mem['topics_explored'] else 'New user'}
-- Recent Questions: {mem['questions_asked'][-2:] if mem['questions_asked'] else 'None'}
-        """
-        return context
-    
-    def update_after_response(self, user_id: int, question: str, topic: str = None):
-        """Update memory after each response"""
-        if user_id not in self.user_memories:
-            return
-        
-        mem = self.user_memories[user_id]
-        mem['total_interactions'] += 1
-        mem['questions_asked'].append(question[:50])
-        
-        if topic and topic not in mem['topics_explored']:
-            mem['topics_explored'].append(topic)
-        
-        mem['questions_asked'] = mem['questions_asked'][-10:]
+SUMMARY_PROMPT = """Tu ek conversation summarizer hai.
+Purani summary aur naye messages ko mila kar ek chhoti, updated summary likh:
+- User kya seekh raha hai, kaunse topics aur problems discuss hue
+- Important decisions, code details aur user ki preferences
+- Bullet points, maximum 8 lines, koi greeting ya extra text nahi
+"""
 
 # ============================================================================
 # GOOGLE GEMINI AI ENGINE - 100% FREE
 # ============================================================================
 
+# What the SDK raises for a prompt or reply stopped by its safety filters
+BLOCKED_ERRORS = (genai.types.BlockedPromptException, genai.types.StopCandidateException, ValueError)
+
+
 class GeminiAIEngine:
-    """Advanced AI Engine using Google Gemini (FREE TIER)"""
+    """
+    Advanced AI Engine using Google Gemini (FREE TIER)
     
-    def __init__(self, api_key: str):
+    The SDK call is blocking, so it runs either through the SDK's async API
+    (mode="async") or on a bounded thread pool (mode="thread", default) and
+    never on the event loop itself.
+    """
+    
+    STATS_LOG_EVERY = 100
+    
+    def __init__(
+        self,
+        api_key: str,
+        workers: int = 8,
+        mode: str = "thread",
+        context_packer: Optional[ContextPacker] = None
+    ):
         """Initialize Gemini API"""
         genai.configure(api_key=api_key)
         self.model = genai.GenerativeModel('gemini-pro')
-        logger.info(f"✅ Gemini AI Engine initialized (FREE)")
+        
+        if mode == "async" and not hasattr(self.model, 'generate_content_async'):
+            logger.warning("⚠️ Installed SDK has no async API, falling back to thread pool")
+            mode = "thread"
+        self.mode = mode
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='gemini')
+        self.context_packer = context_packer or ContextPacker()
+        
+        # Pool sizing metrics
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.in_flight = 0
+        self.queue_wait = LatencyStats()
+        self.latency = LatencyStats()
+        
+        logger.info(f"✅ Gemini AI Engine initialized (FREE, mode={self.mode}, workers={workers})")
     
-    def generate_response(
+    def _build_prompt(
         self,
         user_message: str,
-        conversation_history: List[Dict],
-        user_context: str = "",
-        system_prompt: str = SYSTEM_PROMPT
+        conversation_history: Sequence[MessageRecord],
+        user_context: str,
+        system_prompt: str
     ) -> str:
-        """Generate response using Google Gemini"""
+        """Build the full text prompt for Gemini"""
+        # Build conversation context
+        context_messages = []
+        packed = self.context_packer.pack(user_message, conversation_history, user_context, system_prompt)
+        
+        # Add system prompt
+        context_messages.append(f"System Instructions:\n{packed.system_prompt}\n")
         
+        # Add user context
+        if packed.user_context:
+            context_messages.append(f"User Background:\n{packed.user_context}\n")
+        
+        # Add recent conversation history that fits the token budget
+        for role, content in packed.turns:
+            role_text = "User" if role == 'user' else "Assistant"
+            context_messages.append(f"{role_text}: {content}")
+        
+        # Add current message
+        context_messages.append(f"User: {user_message}")
+        
+        # Combine all context
+        return "\n".join(context_messages)
+    
+    def _generation_config(self):
+        """Generation settings shared by every call"""
+        return genai.types.GenerationConfig(
+            max_output_tokens=2048,
+            temperature=0.7,
+        )
+    
+    def _run_in_worker(self, fn: Callable, submitted_at: float):
+        """Run a blocking SDK call on a worker thread, tracking queue metrics"""
+        started_at = time.perf_counter()
+        with self._lock:
+            self.queued -= 1
+            self.in_flight += 1
+        self.queue_wait.record(started_at - submitted_at)
         try:
-            # Build conversation context
-            context_messages = []
-            
-            # Add system prompt
-            context_messages.append(f"System Instructions:\n{system_prompt}\n")
-            
-            # Add user context
-            if user_context:
-                context_messages.append(f"User Background:\n{user_context}\n")
-            
-            # Add recent conversation history (last 3 exchanges)
-            for msg in conversation_history[-6:]:
-                role_text = "User" if msg['role'] == 'user' else "Assistant"
-                context_messages.append(f"{role_text}: {msg['content']}")
-            
-            # Add current message
-            context_messages.append(f"User: {user_message}")
-            
-            # Combine all context
-            full_prompt = "\n".join(context_messages)
-            
-            # Call Gemini API
-            response = self.model.generate_content(
-                full_prompt,
-                generation_config=genai.types.GenerationConfig(
-                    max_output_tokens=2048,
-                    temperature=0.7,
+            return fn()
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+    
+    async def _offload(self, fn: Callable):
+        """Queue a blocking call on the thread pool and await its result"""
+        with self._lock:
+            self.queued += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, self._run_in_worker, fn, time.perf_counter()
+        )
+    
+    async def _call(self, prompt: str):
+        """Dispatch one Gemini call without blocking the event loop"""
+        if self.mode == "async":
+            self.in_flight += 1
+            try:
+                return await self.model.generate_content_async(
+                    prompt, generation_config=self._generation_config()
                 )
+            finally:
+                self.in_flight -= 1
+        
+        return await self._offload(
+            lambda: self.model.generate_content(prompt, generation_config=self._generation_config())
+        )
+    
+    @staticmethod
+    def _api_error(error: Exception) -> BackendError:
+        """Wrap an SDK exception, keeping its HTTP status so only transient ones are retried"""
+        status = getattr(error, 'code', None)
+        if isinstance(status, int):
+            return BackendError(
+                f"Gemini API Error: {str(error)}",
+                f"❌ Error: {str(error)}\n\nKripya baad mein try kijiye. Agar issue persist kare to API key check karo.",
+                status=status
             )
-            
-            return response.text if response.text else "Maaf kijiye, response generate nahi ho saka."
+        if isinstance(error, (google_exceptions.GoogleAPIError, OSError, asyncio.TimeoutError)):
+            # No status, but network trouble may well pass
+            return BackendError(
+                f"Gemini API Error: {str(error)}",
+                f"❌ Error: {str(error)}\n\nKripya baad mein try kijiye."
+            )
+        if isinstance(error, BLOCKED_ERRORS):
+            # response.text raises ValueError when the reply was blocked; asking again won't help
+            return BackendError(
+                f"Gemini reply blocked: {str(error)}",
+                "⚠️ Is sawaal ka jawab safety filters ki wajah se block ho gaya.\n\nKripya sawaal thoda badal kar poochiye.",
+                retryable=False
+            )
+        return BackendError(
+            f"Gemini Error: {str(error)}",
+            f"❌ Error: {str(error)}\n\nKripya baad mein try kijiye.",
+            retryable=False
+        )
+    
+    @staticmethod
+    def _status_label(error: BackendError) -> str:
+        """Metrics label: the HTTP status, or why there is none"""
+        if error.status is not None:
+            return str(error.status)
+        return 'error' if error.retryable is None else 'rejected'
+    
+    def _record_latency(self, started_at: float, status: str):
+        """Record one call and periodically log pool stats"""
+        elapsed = time.perf_counter() - started_at
+        self.latency.record(elapsed)
+        BACKEND_REQUEST_SECONDS.observe(elapsed, engine='gemini', status=status)
+        if self.latency.count % self.STATS_LOG_EVERY == 0:
+            logger.info(f"📈 Gemini pool stats: {self.stats()}")
+    
+    async def complete(
+        self,
+        user_message: str,
+        conversation_history: Sequence[MessageRecord],
+        user_context: str = "",
+        system_prompt: str = SYSTEM_PROMPT
+    ) -> str:
+        """Call Gemini and return the completion, raising BackendError on failure"""
+        prompt = self._build_prompt(user_message, conversation_history, user_context, system_prompt)
+        
+        started_at = time.perf_counter()
+        status = 'cancelled'
+        try:
+            response = await self._call(prompt)
+            text = response.text
+            status = '200'
+            return text if text else "Maaf kijiye, response generate nahi ho saka."
+        
+        except Exception as e:
+            error = self._api_error(e)
+            status = self._status_label(error)
+            raise error
+        
+        finally:
+            self._record_latency(started_at, status)
+    
+    async def stream_response(
+        self,
+        user_message: str,
+        conversation_history: Sequence[MessageRecord],
+        user_context: str = "",
+        system_prompt: str = SYSTEM_PROMPT
+    ) -> AsyncIterator[str]:
+        """Stream the completion as text deltas, raising BackendError on failure"""
+        prompt = self._build_prompt(user_message, conversation_history, user_context, system_prompt)
+        
+        started_at = time.perf_counter()
+        status = 'cancelled'
+        try:
+            if self.mode == "async":
+                self.in_flight += 1
+                try:
+                    response = await self.model.generate_content_async(
+                        prompt, generation_config=self._generation_config(), stream=True
+                    )
+                    async for chunk in response:
+                        yield chunk.text
+                finally:
+                    self.in_flight -= 1
+            else:
+                async for delta in self._stream_in_worker(prompt):
+                    yield delta
+            status = '200'
         
         except Exception as e:
-            logger.error(f"Gemini API Error: {str(e)}")
-            return f"❌ Error: {str(e)}\n\nKripya baad mein try kijiye. Agar issue persist kare to API key check karo."
+            error = self._api_error(e)
+            status = self._status_label(error)
+            raise error
+        
+        finally:
+            self._record_latency(started_at, status)
+    
+    async def _stream_in_worker(self, prompt: str) -> AsyncIterator[str]:
+        """Iterate the blocking SDK stream on a worker thread and hand chunks to the loop"""
+        loop = asyncio.get_running_loop()
+        chunks: asyncio.Queue = asyncio.Queue()
+        stopped = threading.Event()
+        done = object()
+        
+        def produce():
+            try:
+                stream = self.model.generate_content(
+                    prompt, generation_config=self._generation_config(), stream=True
+                )
+                for chunk in stream:
+                    if stopped.is_set():
+                        break
+                    loop.call_soon_threadsafe(chunks.put_nowait, chunk.text)
+            except Exception as e:
+                loop.call_soon_threadsafe(chunks.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(chunks.put_nowait, done)
+        
+        def on_worker_done(future: asyncio.Future):
+            # The pool itself failed (e.g. shut down) before produce() could run
+            if not future.cancelled() and future.exception() is not None:
+                chunks.put_nowait(future.exception())
+        
+        worker = asyncio.ensure_future(self._offload(produce))
+        worker.add_done_callback(on_worker_done)
+        try:
+            while True:
+                item = await chunks.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Let the worker thread stop early if the consumer goes away
+            stopped.set()
+    
+    async def generate_response(
+        self,
+        user_message: str,
+        conversation_history: Sequence[MessageRecord],
+        user_context: str = "",
+        system_prompt: str = SYSTEM_PROMPT
+    ) -> str:
+        """Generate response using Google Gemini"""
+        
+        try:
+            return await self.complete(user_message, conversation_history, user_context, system_prompt)
+        
+        except BackendError as e:
+            logger.error(str(e))
+            return e.user_message
+    
+    def stats(self) -> Dict:
+        """Queue depth and latency figures for sizing the worker pool"""
+        return {
+            'mode': self.mode,
+            'workers': self.workers,
+            'queued': self.queued,
+            'in_flight': self.in_flight,
+            'queue_wait': self.queue_wait.snapshot(),
+            'latency': self.latency.snapshot(),
+            'context': self.context_packer.stats()
+        }
+    
+    async def close(self):
+        """Stop the worker pool"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
 
 # ============================================================================
 # TELEGRAM BOT HANDLERS
@@ -242,12 +448,143 @@ class GeminiAIEngine:
 class AdvancedTelegramBot:
     """Advanced Telegram Bot with Gemini AI"""
     
-    def __init__(self, bot_token: str, gemini_key: str, channel_id: str = None):
+    def __init__(
+        self,
+        bot_token: str,
+        gemini_key: str,
+        channel_id: str = None,
+        gemini_workers: int = 8,
+        gemini_mode: str = "thread",
+        concurrent_updates: int = 256,
+        max_in_flight: int = 32,
+        coalesce_window: float = 0.0,
+        supersede_in_flight: bool = False,
+        stream_replies: bool = False,
+        stream_edit_interval: float = 1.0,
+        response_cache: Optional[ResponseCache] = None,
+        semantic_cache: Optional[SemanticCache] = None,
+        semantic_cache_path: Optional[str] = None,
+        memory_store: Optional[MemoryStore] = None,
+        memory_max_users: int = 0,
+        memory_max_bytes: int = 0,
+        context_packer: Optional[ContextPacker] = None,
+        summary_mode: str = "model",
+        summary_trigger_turns: int = 16,
+        summary_keep_recent: int = 6,
+        summary_max_tokens: int = 300,
+        retrieval_top_k: int = 3,
+        retrieval_max_tokens: int = 300,
+        retrieval_max_users: int = 200,
+        retrieval_max_messages: int = 1000,
+        extra_backends: Optional[List[Tuple[str, object]]] = None,
+        hedge_after: float = 0.0,
+        breaker_failures: int = 5,
+        breaker_reset: float = 30.0,
+        retry_attempts: int = 3,
+        retry_base_delay: float = 0.5,
+        retry_max_delay: float = 8.0,
+        reply_deadline: float = 90.0,
+        webhook_url: Optional[str] = None,
+        webhook_path: str = '/telegram',
+        webhook_secret: Optional[str] = None,
+        webhook_max_connections: int = 40,
+        port: int = 10000,
+        status_server: bool = False,
+        slow_callback: float = 0.25,
+        health_degraded_lag: float = 0.5,
+        health_unhealthy_lag: float = 5.0,
+        health_degraded_backlog: int = 100,
+        health_unhealthy_backlog: int = 1000,
+        send_global_rate: float = 30.0,
+        send_chat_rate: float = 1.0,
+        send_group_rate: float = 20 / 60,
+        traffic_recorder: Optional[TrafficRecorder] = None
+    ):
         self.bot_token = bot_token
         self.gemini_key = gemini_key
         self.channel_id = channel_id
-        self.memory = MemorySystem()
-        self.ai_engine = GeminiAIEngine(gemini_key)
+        self.concurrent_updates = concurrent_updates
+        self.scheduler = FairScheduler(max_in_flight)
+        self.coalescer = MessageCoalescer(coalesce_window)
+        self.supersede_in_flight = supersede_in_flight
+        self.stream_replies = stream_replies
+        self.stream_edit_interval = stream_edit_interval
+        self.response_cache = response_cache
+        self.semantic_cache = semantic_cache
+        self.semantic_cache_path = semantic_cache_path
+        retriever = None
+        if retrieval_top_k > 0:
+            retriever = HistoryRetriever(
+                store=memory_store,
+                top_k=retrieval_top_k,
+                max_tokens=retrieval_max_tokens,
+                exclude_recent=context_packer.max_turns if context_packer else 6,
+                max_users=retrieval_max_users,
+                max_messages=retrieval_max_messages
+            )
+        self.memory = MemorySystem(
+            store=memory_store,
+            content_limit=300,
+            max_users=memory_max_users,
+            max_bytes=memory_max_bytes,
+            retriever=retriever
+        )
+        self.ai_engine = GeminiAIEngine(
+            gemini_key,
+            workers=gemini_workers,
+            mode=gemini_mode,
+            context_packer=context_packer
+        )
+        if traffic_recorder is not None:
+            # Innermost, so every attempt is recorded as the backend saw it
+            self.ai_engine = RecordingEngine(self.ai_engine, traffic_recorder)
+        if extra_backends:
+            # Route over Gemini plus extra endpoints: failover, hedging, circuit breaking
+            self.ai_engine = BackendRouter(
+                [("gemini", self.ai_engine)] + list(extra_backends),
+                hedge_after=hedge_after,
+                failure_threshold=breaker_failures,
+                reset_timeout=breaker_reset
+            )
+        if retry_attempts > 1:
+            self.ai_engine = RetryingEngine(
+                self.ai_engine,
+                attempts=retry_attempts,
+                base_delay=retry_base_delay,
+                max_delay=retry_max_delay
+            )
+        self.reply_deadline = reply_deadline
+        self.webhook_url = webhook_url
+        self.webhook_path = webhook_path
+        self.webhook_secret = webhook_secret
+        self.webhook_max_connections = webhook_max_connections
+        self.port = port
+        self.status_server = status_server
+        register_bot_metrics(self.scheduler, self.memory, response_cache, semantic_cache)
+        self.loop_monitor = LoopMonitor(
+            slow_callback=slow_callback,
+            degraded_lag=health_degraded_lag,
+            unhealthy_lag=health_unhealthy_lag,
+            degraded_backlog=health_degraded_backlog,
+            unhealthy_backlog=health_unhealthy_backlog,
+            backlog=self.update_backlog
+        )
+        self.sender = OutboundSender(
+            global_rate=send_global_rate,
+            chat_rate=send_chat_rate,
+            group_rate=send_group_rate
+        )
+        self.webhook_server = None
+        self.summarizer = None
+        if summary_mode != "off":
+            self.summarizer = ConversationSummarizer(
+                self.memory,
+                summarize=self.summarize_turns if summary_mode == "model" else None,
+                trigger_turns=summary_trigger_turns,
+                keep_recent=summary_keep_recent,
+                max_tokens=summary_max_tokens
+            )
+        self.traffic_recorder = traffic_recorder
         self.application = None
     
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -282,7 +619,7 @@ class AdvancedTelegramBot:
 ╚════════════════════════════════════════════════╝
         """
         
-        await update.message.reply_text(welcome_message)
+        await self.reply(update, welcome_message)
         logger.info(f"New user: {user.first_name} (@{user.username or 'unknown'})")
     
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -336,21 +673,22 @@ class AdvancedTelegramBot:
 🔥 Ab pocho jo bhi chahiye! Mein sirf jawab dene ke liye hoon!
         """
         
-        await update.message.reply_text(help_text)
+        await self.reply(update, help_text)
     
     async def status_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Show user status"""
         user_id = update.effective_user.id
         
-        if user_id not in self.memory.user_memories:
-            await update.message.reply_text(
+        if not self.memory.has_user(user_id):
+            await self.reply(
+                update,
                 "❌ Pehle /start se start karo!\n"
                 "Phir kuch questions pocho aur meri memory develop hogi."
             )
             return
         
-        mem = self.memory.user_memories[user_id]
-        progress = self.memory.learning_progress.get(user_id, {})
+        mem = self.memory.get_user(user_id)
+        progress = self.memory.get_progress(user_id)
         
         status_text = f"""
 📊 **YOUR AI ASSISTANT STATUS**
@@ -372,16 +710,39 @@ class AdvancedTelegramBot:
 💡 Keep learning! Jab bhi pocho, detailed explanations dunga!
         """
         
-        await update.message.reply_text(status_text)
+        await self.reply(update, status_text)
     
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Main message handler"""
+        # The latency budget covers the whole update: waiting, retries and the reply
+        with deadline(self.reply_deadline):
+            # Rapid follow-up messages are merged into the first one's turn
+            texts = await self.coalescer.collect(
+                (update.effective_chat.id, update.effective_user.id), update.message.text
+            )
+            if texts is None:
+                return
+            
+            user_id = update.effective_user.id
+            if self.supersede_in_flight and self.scheduler.cancel(user_id):
+                logger.info(f"⏹️ Newer message from {user_id} superseded the pending reply")
+            
+            # One turn per user at a time, global slots shared round-robin
+            try:
+                async with self.scheduler.turn(user_id):
+                    await self.process_message(update, context, "\n".join(texts))
+            except asyncio.CancelledError:
+                if not self.scheduler.was_cancelled(asyncio.current_task()):
+                    raise
+                # Superseded, cleared or shutting down: the reply is outdated, send nothing
+    
+    async def process_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE, message_text: str):
+        """Reply to one (possibly merged) message; runs inside the user's scheduler turn"""
         user = update.effective_user
         user_id = user.id
-        message_text = update.message.text
         
         # Initialize if new user
-        if user_id not in self.memory.user_memories:
+        if not self.memory.has_user(user_id):
             self.memory.initialize_user(user_id, user)
         
         # Show typing indicator
@@ -393,46 +754,197 @@ class AdvancedTelegramBot:
             self.memory.update_after_response(user_id, message_text)
             
             # Get user context
-            user_context = self.memory.get_context(user_id)
+            user_context = self.memory.get_context(user_id, message_text)
             
             # Get conversation history
-            history = self.memory.conversation_history.get(user_id, [])
+            history = self.memory.get_history(user_id)
             
-            # Generate response using Gemini
-            response = self.ai_engine.generate_response(
-                user_message=message_text,
-                conversation_history=history,
-                user_context=user_context,
-                system_prompt=SYSTEM_PROMPT
-            )
+            # Serve repeated questions from the answer caches, unless the answer
+            # draws on the running summary or retrieved past messages
+            cacheable = not self.memory.has_conversation_context(user_context)
+            response = self.cached_answer(user_id, message_text, history) if cacheable else None
+            
+            if response is not None:
+                await self.send_reply(update, response)
+            else:
+                if self.stream_replies:
+                    # Stream tokens into a live-edited message
+                    response, completed = await self.stream_reply(
+                        update, context, message_text, history, user_context
+                    )
+                else:
+                    # Generate response using Gemini
+                    response, completed = await self.generate_reply(message_text, history, user_context)
+                    await self.send_reply(update, response)
+                
+                if completed and cacheable:
+                    self.store_answer(user_id, message_text, history, response)
             
             # Add to memory
             self.memory.add_to_history(user_id, 'assistant', response)
             
-            # Send response in chunks if too long (Telegram limit: 4096 chars)
-            if len(response) > 4000:
-                chunks = [response[i:i+4000] for i in range(0, len(response), 4000)]
-                for i, chunk in enumerate(chunks):
-                    if i > 0:
-                        import asyncio
-                        await asyncio.sleep(0.5)
-                    await update.message.reply_text(chunk, parse_mode='Markdown')
-            else:
-                await update.message.reply_text(response, parse_mode='Markdown')
+            # Fold older turns into the running summary in the background
+            if self.summarizer is not None:
+                self.summarizer.maybe_schedule(user_id)
             
             logger.info(f"Response sent to {user.first_name}")
         
         except Exception as e:
             error_msg = f"❌ Error: {str(e)}\n\nKripya baad mein try kijiye."
             logger.error(f"Message handling error: {traceback.format_exc()}")
-            await update.message.reply_text(error_msg)
+            await self.reply(update, error_msg)
+    
+    async def summarize_turns(self, previous: str, turns: Sequence[MessageRecord]) -> str:
+        """Ask the engine to fold older turns into the running summary"""
+        transcript = "\n".join(
+            f"{'User' if msg.role == 'user' else 'Assistant'}: {msg.content}" for msg in turns
+        )
+        prompt = f"Purani summary:\n{previous or 'Koi nahi'}\n\nNaye messages:\n{transcript}"
+        # Runs in the background after the reply, so the update's deadline doesn't apply
+        with deadline(None):
+            return await self.ai_engine.complete(prompt, (), "", SUMMARY_PROMPT)
+    
+    def cached_answer(self, user_id: int, message_text: str, history: Sequence[MessageRecord]) -> Optional[str]:
+        """Look the turn up in the exact, then the semantic answer cache"""
+        # History already ends with the current message; answers are personalized, so scoped per user
+        previous = history[:-1]
+        
+        if self.response_cache is not None and not self.response_cache.is_opted_out(user_id):
+            response = self.response_cache.get(self.response_cache.make_key(message_text, previous, user_id))
+            if response is not None:
+                return response
+        
+        if self.semantic_cache is not None and not self.semantic_cache.is_opted_out(user_id):
+            return self.semantic_cache.lookup(message_text, previous, user_id)
+        return None
+    
+    def store_answer(self, user_id: int, message_text: str, history: Sequence[MessageRecord], response: str):
+        """Remember a completed answer in every answer cache the user allows"""
+        previous = history[:-1]
+        
+        if self.response_cache is not None and not self.response_cache.is_opted_out(user_id):
+            self.response_cache.set(self.response_cache.make_key(message_text, previous, user_id), response)
+        
+        if self.semantic_cache is not None and not self.semantic_cache.is_opted_out(user_id):
+            self.semantic_cache.add(message_text, previous, response, user_id)
+    
+    async def generate_reply(
+        self,
+        message_text: str,
+        history: Sequence[MessageRecord],
+        user_context: str
+    ) -> Tuple[str, bool]:
+        """Ask Gemini for a full reply; returns (text, completed)"""
+        try:
+            response = await self.ai_engine.complete(
+                user_message=message_text,
+                conversation_history=history,
+                user_context=user_context,
+                system_prompt=SYSTEM_PROMPT
+            )
+            return response, True
+        except BackendError as e:
+            logger.error(str(e))
+            return e.user_message, False
+    
+    async def reply(self, update: Update, text: str):
+        """Answer in the update's chat through the outbound sender"""
+        await self.sender.run(update.effective_chat.id, functools.partial(update.message.reply_text, text))
+    
+    async def send_reply(self, update: Update, response: str):
+        """Send a Markdown reply split at paragraphs/code blocks; a chunk Telegram can't parse goes out as plain text"""
+        chat_id = update.effective_chat.id
+        for markdown, plain in split_markdown(response):
+            try:
+                await self.sender.run(
+                    chat_id,
+                    functools.partial(update.message.reply_text, markdown, parse_mode='Markdown')
+                )
+            except BadRequest as e:
+                # Only this chunk is resent; the ones before it went out fine
+                logger.warning(f"Markdown rejected, sending chunk as plain text: {e}")
+                await self.sender.run(chat_id, functools.partial(update.message.reply_text, plain))
+    
+    async def stream_reply(
+        self,
+        update: Update,
+        context: ContextTypes.DEFAULT_TYPE,
+        message_text: str,
+        history: Sequence[MessageRecord],
+        user_context: str
+    ) -> Tuple[str, bool]:
+        """Stream Gemini output into a progressively edited Telegram message; returns (text, completed)"""
+        reply = StreamingReply(
+            context.bot,
+            update.effective_chat.id,
+            edit_interval=self.stream_edit_interval,
+            sender=self.sender,
+            parse_mode='Markdown'
+        )
+        started_at = time.perf_counter()
+        completed = True
+        
+        try:
+            async for delta in self.ai_engine.stream_response(
+                user_message=message_text,
+                conversation_history=history,
+                user_context=user_context,
+                system_prompt=SYSTEM_PROMPT
+            ):
+                await reply.push(delta)
+        except BackendError as e:
+            logger.error(str(e))
+            completed = False
+            await reply.push(("\n\n" if reply.text else "") + e.user_message)
+        
+        if reply.first_token_at is not None:
+            logger.info(f"⚡ First token after {reply.first_token_at - started_at:.2f}s")
+        return await reply.finish(), completed
+    
+    async def cache_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Turn response caching on or off for this user"""
+        user_id = update.effective_user.id
+        caches = [c for c in (self.response_cache, self.semantic_cache) if c is not None]
+        
+        if not caches:
+            await self.reply(update, "ℹ️ Response cache is bot par enabled nahi hai.")
+            return
+        
+        if context.args and context.args[0].lower() == 'off':
+            for cache in caches:
+                cache.opt_out(user_id)
+            await self.reply(
+                update,
+                "🔒 Cache off! Ab har jawab fresh generate hoga."
+            )
+        elif context.args and context.args[0].lower() == 'on':
+            for cache in caches:
+                cache.opt_in(user_id)
+            await self.reply(
+                update,
+                "⚡ Cache on! Common questions ke jawab turant milenge."
+            )
+        else:
+            state = "off" if caches[0].is_opted_out(user_id) else "on"
+            await self.reply(
+                update,
+                f"💾 Response cache: {state}\n"
+                "Use: /cache on ya /cache off"
+            )
     
     async def clear_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Clear conversation history"""
         user_id = update.effective_user.id
-        self.memory.conversation_history[user_id] = []
         
-        await update.message.reply_text(
+        # Abort any reply still being generated for the old conversation,
+        # including messages still waiting in their coalescing window
+        self.coalescer.discard((update.effective_chat.id, user_id))
+        self.scheduler.cancel(user_id)
+        async with self.scheduler.turn(user_id):
+            self.memory.clear_history(user_id)
+        
+        await self.reply(
+            update,
             "✨ Chat history clear ho gayi!\n"
             "Ab se fresh start karenge! 🚀"
         )
@@ -447,6 +959,7 @@ class AdvancedTelegramBot:
         self.application.add_handler(CommandHandler("help", self.help_command))
         self.application.add_handler(CommandHandler("status", self.status_command))
         self.application.add_handler(CommandHandler("clear", self.clear_command))
+        self.application.add_handler(CommandHandler("cache", self.cache_command))
         
         # Message handler
         self.application.add_handler(MessageHandler(
@@ -457,9 +970,31 @@ class AdvancedTelegramBot:
         # Error handler
         self.application.add_error_handler(self.error_handler)
     
+    def update_backlog(self) -> int:
+        """Updates and messages received but not yet being handled"""
+        pending = 0
+        if self.application is not None and isinstance(self.application.update_queue, TimedUpdateQueue):
+            pending = self.application.update_queue.pending
+        return pending + self.scheduler.queued
+    
+    async def pre_stop(self, application: Application):
+        """Abort in-flight replies so shutdown doesn't wait on the backend"""
+        cancelled = self.scheduler.cancel_all()
+        if cancelled:
+            logger.info(f"⏹️ Cancelled {cancelled} in-flight replies for shutdown")
+    
     async def run(self):
-        """Start the bot"""
-        self.application = Application.builder().token(self.bot_token).build()
+        """Start the bot (webhook server if webhook_url is set, else polling) and run until SIGINT/SIGTERM"""
+        builder = (
+            Application.builder()
+            .token(self.bot_token)
+            .concurrent_updates(self.concurrent_updates)
+            .update_queue(TimedUpdateQueue(recorder=self.traffic_recorder))
+            .application_class(BotApplication, kwargs={'pre_stop': self.pre_stop})
+        )
+        if self.webhook_url:
+            builder = builder.updater(None)  # Updates arrive through WebhookServer
+        self.application = builder.build()
         
         self.setup_handlers()
         
@@ -467,19 +1002,55 @@ class AdvancedTelegramBot:
         
         await self.application.initialize()
         await self.application.start()
-        await self.application.updater.start_polling(
-            allowed_updates=None,
-            drop_pending_updates=True
-        )
+        await self.loop_monitor.start()
+        if self.webhook_url or self.status_server:
+            # Updates (in webhook mode), health checks and metrics share one aiohttp server on this loop
+            self.webhook_server = WebhookServer(
+                self.application,
+                path=self.webhook_path if self.webhook_url else None,
+                secret_token=self.webhook_secret,
+                port=self.port,
+                info={'bot': 'Advanced AI Telegram Bot', 'api': 'Google Gemini (FREE)'},
+                health=self.loop_monitor.check
+            )
+            await self.webhook_server.start()
+        if self.webhook_url:
+            await self.application.bot.set_webhook(
+                self.webhook_url.rstrip('/') + self.webhook_path,
+                secret_token=self.webhook_secret,
+                allowed_updates=Update.ALL_TYPES,
+                drop_pending_updates=True,
+                max_connections=self.webhook_max_connections
+            )
+        else:
+            await self.application.updater.start_polling(
+                allowed_updates=None,
+                drop_pending_updates=True
+            )
         
         logger.info("✅ Bot is running! Press Ctrl+C to stop.")
+        await wait_for_stop_signal()
     
     async def stop(self):
         """Stop bot gracefully"""
+        if self.webhook_server is not None:
+            await self.webhook_server.stop()
         if self.application:
-            await self.application.updater.stop()
-            await self.application.stop()
+            if self.application.updater and self.application.updater.running:
+                await self.application.updater.stop()
+            if self.application.running:
+                await self.application.stop()
             await self.application.shutdown()
+        await self.loop_monitor.stop()
+        await self.sender.close()
+        if self.summarizer is not None:
+            await self.summarizer.close()
+        await self.ai_engine.close()
+        self.memory.close()
+        if self.traffic_recorder is not None:
+            self.traffic_recorder.close()
+        if self.semantic_cache is not None and self.semantic_cache_path:
+            self.semantic_cache.save(self.semantic_cache_path)
 
 # ============================================================================
 # MAIN EXECUTION
@@ -492,6 +1063,60 @@ async def main():
     Environment Variables Required:
     - TELEGRAM_BOT_TOKEN: Your Telegram bot token
     - GOOGLE_GEMINI_API_KEY: Your Google Gemini API key (FREE!)
+    - GEMINI_WORKERS: (Optional) Thread pool size for Gemini calls (default: 8)
+    - GEMINI_EXECUTION_MODE: (Optional) "thread" or "async" SDK calls (default: thread)
+    - PORT: (Optional) Webhook / health check / metrics server port; when set, /health and /metrics are served in polling mode too (default: 10000)
+    - WEBHOOK_URL: (Optional) Public base URL (e.g. https://your-app.onrender.com); enables webhook mode instead of polling
+    - WEBHOOK_PATH: (Optional) Path Telegram posts updates to (default: /telegram)
+    - WEBHOOK_SECRET: (Optional) Secret token Telegram sends with every update (default: derived from the bot token)
+    - WEBHOOK_MAX_CONNECTIONS: (Optional) Parallel update deliveries Telegram may open, 1-100 (default: 40)
+    - MAX_CONCURRENT_UPDATES: (Optional) Updates processed concurrently (default: 256)
+    - MAX_IN_FLIGHT_REQUESTS: (Optional) Messages answered at once across all users, 0 = no cap (default: 32)
+    - COALESCE_WINDOW_MS: (Optional) Merge messages a user sends within this many ms into one reply, 0 = off (default: 0)
+    - SUPERSEDE_IN_FLIGHT: (Optional) "true" to cancel a pending reply when the user sends a newer message (default: false)
+    - STREAM_REPLIES: (Optional) "true" to stream tokens into a live-edited message (default: false)
+    - STREAM_EDIT_INTERVAL: (Optional) Seconds between streaming message edits (default: 1.0)
+    - RESPONSE_CACHE_SIZE: (Optional) Cached answers kept, 0 disables the cache (default: 0)
+    - RESPONSE_CACHE_TTL: (Optional) Seconds a cached answer stays valid (default: 3600)
+    - RESPONSE_CACHE_HISTORY_TURNS: (Optional) History entries included in the cache key (default: 2)
+    - SEMANTIC_CACHE_SIZE: (Optional) Similar-question cache capacity, 0 disables it (default: 0)
+    - SEMANTIC_CACHE_THRESHOLD: (Optional) Cosine similarity needed for a hit (default: 0.92)
+    - SEMANTIC_CACHE_PATH: (Optional) File the semantic cache is saved to and loaded from
+    - MEMORY_DB_PATH: (Optional) SQLite file for persistent user memory (default: in-memory only)
+    - MEMORY_FLUSH_INTERVAL: (Optional) Seconds between write-behind batches (default: 0.5)
+    - MEMORY_BATCH_SIZE: (Optional) Max writes per batch (default: 200)
+    - MEMORY_MAX_USERS: (Optional) Users kept in RAM, idle ones spill to disk (default: 0 = unbounded)
+    - MEMORY_MAX_MB: (Optional) Approximate RAM budget for user memory in MB (default: 0 = unbounded)
+    - CONTEXT_TOKEN_BUDGET: (Optional) Estimated input tokens per backend request (default: 2000)
+    - CONTEXT_MAX_TURNS: (Optional) Most history entries sent with a request (default: 6)
+    - SUMMARY_MODE: (Optional) "model", "extractive" or "off" rolling history summaries (default: model)
+    - SUMMARY_TRIGGER_TURNS: (Optional) Unsummarized history entries that trigger a summary (default: 16)
+    - SUMMARY_KEEP_RECENT: (Optional) Newest entries left out of the summary (default: 6)
+    - SUMMARY_MAX_TOKENS: (Optional) Size cap of the running summary (default: 300)
+    - RETRIEVAL_TOP_K: (Optional) Relevant past messages added to the prompt, 0 disables (default: 3)
+    - RETRIEVAL_MAX_TOKENS: (Optional) Size cap of the retrieved snippets (default: 300)
+    - RETRIEVAL_MAX_USERS: (Optional) Per-user search indexes kept in RAM (default: 200)
+    - RETRIEVAL_MAX_MESSAGES: (Optional) Newest history entries each search index covers (default: 1000)
+    - BACKEND_URLS: (Optional) Comma-separated custom chat endpoints to fail over / hedge to
+    - API_TIMEOUT: (Optional) Timeout for BACKEND_URLS requests in seconds (default: 60)
+    - HEDGE_AFTER_MS: (Optional) Send a slow request to the next backend too after this many ms, 0 = off (default: 0)
+    - BREAKER_FAILURES: (Optional) Consecutive failures that take a backend out of rotation (default: 5)
+    - BREAKER_RESET_SECONDS: (Optional) Seconds before a failed backend is probed again (default: 30)
+    - RETRY_ATTEMPTS: (Optional) Tries per backend call for 429/5xx/network errors, 1 = no retries (default: 3)
+    - RETRY_BASE_DELAY: (Optional) First retry backoff in seconds, doubled each retry, with jitter (default: 0.5)
+    - RETRY_MAX_DELAY: (Optional) Backoff cap in seconds (default: 8)
+    - REPLY_DEADLINE_SECONDS: (Optional) Latency budget per message incl. retries, 0 = none (default: 90)
+    - SLOW_CALLBACK_MS: (Optional) Log the stack of anything blocking the event loop this long, 0 = off (default: 250)
+    - HEALTH_LAG_DEGRADED_MS: (Optional) Event-loop lag that makes /health report "degraded", 0 = off (default: 500)
+    - HEALTH_LAG_UNHEALTHY_MS: (Optional) Event-loop lag that makes /health answer 503 "unhealthy", 0 = off (default: 5000)
+    - HEALTH_BACKLOG_DEGRADED: (Optional) Unhandled updates/messages that make /health "degraded", 0 = off (default: 100)
+    - HEALTH_BACKLOG_UNHEALTHY: (Optional) Unhandled updates/messages that make /health 503 "unhealthy", 0 = off (default: 1000)
+    - TELEGRAM_GLOBAL_RATE: (Optional) Messages per second sent across all chats (default: 30)
+    - TELEGRAM_CHAT_RATE: (Optional) Messages per second sent to one private chat (default: 1)
+    - TELEGRAM_GROUP_RATE: (Optional) Messages per minute sent to one group or channel (default: 20)
+    - TRAFFIC_RECORD_PATH: (Optional) Append anonymized updates and backend latencies here, for replay (default: off)
+    - TRAFFIC_RECORD_SALT: (Optional) Secret for the anonymizing hashes; set it to link users across restarts (default: random)
+    - TRAFFIC_RECORD_MAX_MB: (Optional) Stop recording once the file reaches this size, 0 = no cap (default: 100)
     
     Get Google Gemini API Key (FREE):
     1. Go to: https://makersuite.google.com/app/apikey
@@ -512,6 +1137,73 @@ async def main():
         raise ValueError("❌ GOOGLE_GEMINI_API_KEY environment variable not set!\n"
                         "Get FREE key at: https://makersuite.google.com/app/apikey")
     
+    # Persistent memory (survives restarts when MEMORY_DB_PATH is on a persistent disk)
+    memory_store = None
+    memory_db_path = os.getenv('MEMORY_DB_PATH')
+    memory_max_users = int(os.getenv('MEMORY_MAX_USERS', 0))
+    memory_max_bytes = int(float(os.getenv('MEMORY_MAX_MB', 0)) * 1024 * 1024)
+    if memory_db_path or memory_max_users or memory_max_bytes:
+        # Bounded memory without a database spills idle users to a scratch file
+        memory_store = MemoryStore(
+            memory_db_path or os.path.join(tempfile.gettempdir(), 'telegram_bot_memory_spill.db'),
+            batch_size=int(os.getenv('MEMORY_BATCH_SIZE', 200)),
+            flush_interval=float(os.getenv('MEMORY_FLUSH_INTERVAL', 0.5)),
+            reset=not memory_db_path
+        )
+    
+    # Response cache for repeated questions
+    response_cache = None
+    cache_size = int(os.getenv('RESPONSE_CACHE_SIZE', 0))
+    if cache_size > 0:
+        response_cache = ResponseCache(
+            max_entries=cache_size,
+            ttl=float(os.getenv('RESPONSE_CACHE_TTL', 3600)),
+            history_turns=int(os.getenv('RESPONSE_CACHE_HISTORY_TURNS', 2))
+        )
+    
+    # Semantic cache for similar (not identical) questions
+    semantic_cache = None
+    semantic_cache_path = os.getenv('SEMANTIC_CACHE_PATH')
+    semantic_size = int(os.getenv('SEMANTIC_CACHE_SIZE', 0))
+    if semantic_size > 0:
+        semantic_cache = SemanticCache(
+            capacity=semantic_size,
+            threshold=float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.92)),
+            history_turns=int(os.getenv('RESPONSE_CACHE_HISTORY_TURNS', 2))
+        )
+        if semantic_cache_path:
+            semantic_cache.load(semantic_cache_path)
+    
+    # Prompt context budget
+    context_packer = ContextPacker(
+        budget=int(os.getenv('CONTEXT_TOKEN_BUDGET', 2000)),
+        max_turns=int(os.getenv('CONTEXT_MAX_TURNS', 6))
+    )
+    
+    # Extra endpoints for the router (same protocol as bot.py's CUSTOM_API_URL)
+    extra_backends = []
+    backend_urls = [u.strip() for u in os.getenv('BACKEND_URLS', '').split(',') if u.strip()]
+    if backend_urls:
+        try:
+            from bot import CustomAPIEngine
+            http_pool = HTTPPool(timeout=float(os.getenv('API_TIMEOUT', 60)))
+            extra_backends = [
+                (url, CustomAPIEngine(url, http_pool=http_pool, context_packer=context_packer))
+                for url in backend_urls
+            ]
+        except ImportError as e:
+            logger.warning(f"⚠️ BACKEND_URLS ignored: {e}")
+    
+    # Opt-in traffic recording for offline replay (benchmarks/replay_traffic.py)
+    traffic_recorder = None
+    traffic_record_path = os.getenv('TRAFFIC_RECORD_PATH')
+    if traffic_record_path:
+        traffic_recorder = TrafficRecorder(
+            traffic_record_path,
+            salt=os.getenv('TRAFFIC_RECORD_SALT'),
+            max_bytes=int(float(os.getenv('TRAFFIC_RECORD_MAX_MB', 100)) * 1024 * 1024)
+        )
+    
     logger.info("🚀 Initializing Advanced AI Telegram Bot (Google Gemini FREE)...")
     logger.info("💰 No API costs, 100% FREE!") 
     
@@ -519,18 +1211,63 @@ async def main():
     bot = AdvancedTelegramBot(
         bot_token=bot_token,
         gemini_key=gemini_key,
-        channel_id=channel_id
+        channel_id=channel_id,
+        gemini_workers=int(os.getenv('GEMINI_WORKERS', 8)),
+        gemini_mode=os.getenv('GEMINI_EXECUTION_MODE', 'thread'),
+        concurrent_updates=int(os.getenv('MAX_CONCURRENT_UPDATES', 256)),
+        max_in_flight=int(os.getenv('MAX_IN_FLIGHT_REQUESTS', 32)),
+        coalesce_window=int(os.getenv('COALESCE_WINDOW_MS', 0)) / 1000,
+        supersede_in_flight=os.getenv('SUPERSEDE_IN_FLIGHT', 'false').lower() == 'true',
+        stream_replies=os.getenv('STREAM_REPLIES', 'false').lower() == 'true',
+        stream_edit_interval=float(os.getenv('STREAM_EDIT_INTERVAL', 1.0)),
+        response_cache=response_cache,
+        semantic_cache=semantic_cache,
+        semantic_cache_path=semantic_cache_path,
+        memory_store=memory_store,
+        memory_max_users=memory_max_users,
+        memory_max_bytes=memory_max_bytes,
+        context_packer=context_packer,
+        summary_mode=os.getenv('SUMMARY_MODE', 'model').lower(),
+        summary_trigger_turns=int(os.getenv('SUMMARY_TRIGGER_TURNS', 16)),
+        summary_keep_recent=int(os.getenv('SUMMARY_KEEP_RECENT', 6)),
+        summary_max_tokens=int(os.getenv('SUMMARY_MAX_TOKENS', 300)),
+        retrieval_top_k=int(os.getenv('RETRIEVAL_TOP_K', 3)),
+        retrieval_max_tokens=int(os.getenv('RETRIEVAL_MAX_TOKENS', 300)),
+        retrieval_max_users=int(os.getenv('RETRIEVAL_MAX_USERS', 200)),
+        retrieval_max_messages=int(os.getenv('RETRIEVAL_MAX_MESSAGES', 1000)),
+        extra_backends=extra_backends,
+        hedge_after=int(os.getenv('HEDGE_AFTER_MS', 0)) / 1000,
+        breaker_failures=int(os.getenv('BREAKER_FAILURES', 5)),
+        breaker_reset=float(os.getenv('BREAKER_RESET_SECONDS', 30)),
+        retry_attempts=int(os.getenv('RETRY_ATTEMPTS', 3)),
+        retry_base_delay=float(os.getenv('RETRY_BASE_DELAY', 0.5)),
+        retry_max_delay=float(os.getenv('RETRY_MAX_DELAY', 8)),
+        reply_deadline=float(os.getenv('REPLY_DEADLINE_SECONDS', 90)),
+        webhook_url=os.getenv('WEBHOOK_URL'),
+        webhook_path=os.getenv('WEBHOOK_PATH', '/telegram'),
+        webhook_secret=os.getenv('WEBHOOK_SECRET') or hashlib.sha256(bot_token.encode()).hexdigest()[:32],
+        webhook_max_connections=int(os.getenv('WEBHOOK_MAX_CONNECTIONS', 40)),
+        port=int(os.getenv('PORT', 10000)),
+        status_server=bool(os.getenv('PORT')),
+        slow_callback=int(os.getenv('SLOW_CALLBACK_MS', 250)) / 1000,
+        health_degraded_lag=int(os.getenv('HEALTH_LAG_DEGRADED_MS', 500)) / 1000,
+        health_unhealthy_lag=int(os.getenv('HEALTH_LAG_UNHEALTHY_MS', 5000)) / 1000,
+        health_degraded_backlog=int(os.getenv('HEALTH_BACKLOG_DEGRADED', 100)),
+        health_unhealthy_backlog=int(os.getenv('HEALTH_BACKLOG_UNHEALTHY', 1000)),
+        send_global_rate=float(os.getenv('TELEGRAM_GLOBAL_RATE', 30)),
+        send_chat_rate=float(os.getenv('TELEGRAM_CHAT_RATE', 1)),
+        send_group_rate=float(os.getenv('TELEGRAM_GROUP_RATE', 20)) / 60,
+        traffic_recorder=traffic_recorder
     )
     
     try:
         await bot.run()
-    except KeyboardInterrupt:
+    finally:
         logger.info("\n\n🛑 Shutting down gracefully...")
         await bot.stop()
         logger.info("✅ Bot stopped!")
 
 if __name__ == "__main__":
-    import asyncio
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
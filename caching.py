@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Answer caches that sit in front of the AI engines
+- ResponseCache: exact match on the normalized prompt plus recent history
+- SemanticCache: nearest-neighbour match on local hashed embeddings (NumPy)
+Prompts are personalized, so the bots scope entries to the user they were written for
+"""
+
+import os
+import re
+import abc
+import time
+import zlib
+import hashlib
+import logging
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Sequence, Set, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # Semantic cache is optional
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# ============================================================================
+# SHARED HELPERS
+# ============================================================================
+
+_WHITESPACE = re.compile(r'\s+')
+_TRAILING_PUNCTUATION = re.compile(r'[\s?!.,;:।]+$')
+
+
+def normalize_message(text: str) -> str:
+    """Canonical form of a message: NFKC, case-folded, single spaces, no trailing punctuation"""
+    text = unicodedata.normalize('NFKC', text).casefold()
+    text = _WHITESPACE.sub(' ', text).strip()
+    return _TRAILING_PUNCTUATION.sub('', text)
+
+
+def history_fingerprint(history: Sequence, turns: int, scope: Hashable = None) -> str:
+    """Normalized form of the last ``turns`` history entries (MessageRecord items), within ``scope``"""
+    prefix = f"{scope}\x1f" if scope is not None else ""
+    if not turns:
+        return prefix
+    return prefix + "\x1e".join(
+        f"{msg.role}:{normalize_message(msg.content)}" for msg in history[-turns:]
+    )
+
+
+class AnswerCache(abc.ABC):
+    """Base for answer caches: per-user opt-out and hit/miss counters"""
+
+    def __init__(self):
+        self.opted_out: Set[int] = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def opt_out(self, user_id: int):
+        """Stop caching answers for this user"""
+        self.opted_out.add(user_id)
+
+    def opt_in(self, user_id: int):
+        """Resume caching answers for this user"""
+        self.opted_out.discard(user_id)
+
+    def is_opted_out(self, user_id: int) -> bool:
+        """Whether this user's answers bypass the cache"""
+        return user_id in self.opted_out
+
+    def stats(self) -> Dict:
+        """Hit/miss counters for logs and status endpoints"""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'opted_out_users': len(self.opted_out)
+        }
+
+    @abc.abstractmethod
+    def __len__(self) -> int:
+        """Number of cached answers"""
+
+# ============================================================================
+# RESPONSE CACHE - Normalized prompt + context, LRU with TTL
+# ============================================================================
+
+class ResponseCache(AnswerCache):
+    """
+    Size-bounded LRU cache of completed answers with TTL expiry
+
+    Keys combine the normalized user message with the last ``history_turns``
+    history entries before it and a scope (the user id: answers are written
+    from that user's profile), so the same question asked at the same point
+    of a conversation is answered once. Users can opt out, in which case
+    their lookups always miss and their answers are never stored.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl: float = 3600.0, history_turns: int = 2):
+        super().__init__()
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.history_turns = history_turns
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self.expirations = 0
+
+    def make_key(self, message: str, history: Sequence, scope: Hashable = None) -> str:
+        """Build the cache key for a message and the history that precedes it"""
+        key = normalize_message(message) + "\x1d" + history_fingerprint(history, self.history_turns, scope)
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached answer, or None on a miss or expired entry"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        stored_at, value = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: str):
+        """Store an answer, evicting the least recently used entries past capacity"""
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """Drop every cached answer"""
+        self._entries.clear()
+
+    def stats(self) -> Dict:
+        """Hit/miss counters for logs and status endpoints"""
+        stats = super().stats()
+        stats['expirations'] = self.expirations
+        return stats
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+# ============================================================================
+# SEMANTIC CACHE - Hashed embeddings + vectorized cosine similarity
+# ============================================================================
+
+_WORDS = re.compile(r'\w+')
+
+
+class SemanticCache(AnswerCache):
+    """
+    Nearest-neighbour answer cache over local hashed text embeddings
+
+    Messages are embedded on the CPU with a signed hashing trick over words
+    and character trigrams (no model download, stable across restarts), and
+    stored as rows of a preallocated float32 matrix. A lookup is one
+    matrix-vector product; the best row at or above ``threshold`` cosine
+    similarity is a hit, provided it was stored for the same preceding
+    history and scope. When full, the least recently used row is overwritten.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 10000,
+        dim: int = 256,
+        threshold: float = 0.92,
+        history_turns: int = 2
+    ):
+        if np is None:
+            raise ImportError("SemanticCache requires numpy (pip install numpy)")
+        super().__init__()
+        self.capacity = capacity
+        self.dim = dim
+        self.threshold = threshold
+        self.history_turns = history_turns
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.context_ids = np.zeros(capacity, dtype=np.int64)
+        self.last_used = np.zeros(capacity, dtype=np.float64)
+        self.answers: List[Optional[str]] = [None] * capacity
+        self.size = 0
+
+    def embed(self, text: str) -> "np.ndarray":
+        """L2-normalized hashed bag of words and character trigrams"""
+        words = _WORDS.findall(normalize_message(text))
+        features = list(words)
+        for word in words:
+            padded = f"<{word}>"
+            features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+
+        vector = np.zeros(self.dim, dtype=np.float32)
+        if not features:
+            return vector
+        hashes = np.fromiter(
+            (zlib.crc32(f.encode('utf-8')) for f in features), dtype=np.uint32, count=len(features)
+        )
+        signs = np.where(hashes & 0x80000000, -1.0, 1.0)
+        vector += np.bincount(hashes % self.dim, weights=signs, minlength=self.dim).astype(np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def context_id(self, history: Sequence, scope: Hashable = None) -> int:
+        """Stable 63-bit id of the history that precedes a message, within ``scope``"""
+        digest = hashlib.blake2b(
+            history_fingerprint(history, self.history_turns, scope).encode('utf-8'), digest_size=8
+        ).digest()
+        return int.from_bytes(digest, 'big') >> 1
+
+    def lookup(self, message: str, history: Sequence, scope: Hashable = None) -> Optional[str]:
+        """Return the answer of the most similar cached message, or None"""
+        if self.size == 0:
+            self.misses += 1
+            return None
+
+        query = self.embed(message)
+        scores = self.vectors[:self.size] @ query
+        scores[self.context_ids[:self.size] != self.context_id(history, scope)] = -1.0
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            self.misses += 1
+            return None
+
+        self.last_used[best] = time.monotonic()
+        self.hits += 1
+        return self.answers[best]
+
+    def add(self, message: str, history: Sequence, answer: str, scope: Hashable = None):
+        """Store an answer, overwriting the least recently used row when full"""
+        if self.size < self.capacity:
+            slot = self.size
+            self.size += 1
+        else:
+            slot = int(np.argmin(self.last_used))
+            self.evictions += 1
+        self.vectors[slot] = self.embed(message)
+        self.context_ids[slot] = self.context_id(history, scope)
+        self.last_used[slot] = time.monotonic()
+        self.answers[slot] = answer
+
+    def save(self, path: str):
+        """Persist the index to a compressed .npz file, least recently used row first"""
+        # Slots are reused on eviction, so slot order is not recency order
+        order = np.argsort(self.last_used[:self.size], kind='stable')
+        encoded = [(self.answers[i] or "").encode('utf-8') for i in order]
+        offsets = np.cumsum([0] + [len(a) for a in encoded], dtype=np.int64)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            vectors=self.vectors[order],
+            context_ids=self.context_ids[order],
+            answers=np.frombuffer(b"".join(encoded), dtype=np.uint8),
+            offsets=offsets,
+            meta=np.array([self.dim, self.history_turns], dtype=np.int64)
+        )
+        os.replace(tmp_path, path)
+        logger.info(f"💾 Semantic cache saved ({self.size} entries) to {path}")
+
+    def load(self, path: str) -> bool:
+        """Reload a saved index; returns False if there is nothing usable at path"""
+        if not os.path.exists(path):
+            return False
+        with np.load(path) as data:
+            dim, history_turns = (int(x) for x in data['meta'])
+            if dim != self.dim or history_turns != self.history_turns:
+                logger.warning(f"⚠️ Semantic cache at {path} built with other settings, ignoring")
+                return False
+            total = len(data['vectors'])
+            count = min(total, self.capacity)
+            start = total - count  # Rows are saved oldest first: keep the most recently used
+            raw = data['answers'].tobytes()
+            offsets = data['offsets']
+            self.vectors[:count] = data['vectors'][start:]
+            self.context_ids[:count] = data['context_ids'][start:]
+        self.answers = [
+            raw[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(start, total)
+        ] + [None] * (self.capacity - count)
+        # File order is recency order: later rows were used more recently
+        self.last_used[:count] = np.arange(count, dtype=np.float64) - count
+        self.size = count
+        logger.info(f"💾 Semantic cache loaded ({count} entries) from {path}")
+        return True
+
+    def __len__(self) -> int:
+        return self.size
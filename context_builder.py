@@ -0,0 +1,599 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Prompt context assembly shared by both AI engines
+Packs system prompt, user profile and conversation turns into a token budget,
+folds older turns into a rolling per-user summary in the background and
+retrieves relevant snippets from each user's long-term history
+"""
+
+import re
+import math
+import heapq
+import asyncio
+import logging
+import functools
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from operator import itemgetter
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from metrics import FAST_BUCKETS, histogram, timed
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_BUILD_SECONDS = histogram(
+    'bot_context_build_seconds', 'Time to pack the prompt context into the token budget', buckets=FAST_BUCKETS
+).labels()
+
+# ============================================================================
+# TOKEN ESTIMATION
+# ============================================================================
+
+_TOKEN_PIECES = re.compile(r'\w+|[^\w\s]')
+
+# Role label and separators each turn adds around its text
+TURN_OVERHEAD_TOKENS = 4
+
+
+@lru_cache(maxsize=4096)
+def estimate_tokens(text: str) -> int:
+    """
+    Fast local token estimate, no tokenizer download
+
+    Takes the larger of word/punctuation pieces and characters / 4, which
+    tracks BPE tokenizers closely enough for budgeting English and Hinglish.
+    Cached because the system prompt and recent turns are re-estimated on
+    every message.
+    """
+    if not text:
+        return 0
+    return max(len(_TOKEN_PIECES.findall(text)), (len(text) + 3) // 4)
+
+
+def truncate_to_tokens(text: str, tokens: int) -> str:
+    """Cut text down to roughly the given token count"""
+    if estimate_tokens(text) <= tokens:
+        return text
+    cut = text[:max(0, tokens) * 4].rstrip()
+    while cut and estimate_tokens(cut + "…") > tokens:
+        cut = cut[:int(len(cut) * 0.9)].rstrip()
+    return cut + "…" if cut else ""
+
+# ============================================================================
+# CONTEXT PACKER
+# ============================================================================
+
+class PackedContext:
+    """Prompt parts chosen by ContextPacker for one request"""
+
+    __slots__ = ('system_prompt', 'user_context', 'turns', 'tokens', 'tokens_saved', 'dropped_turns')
+
+    def __init__(
+        self,
+        system_prompt: str,
+        user_context: str,
+        turns: List,
+        tokens: int,
+        tokens_saved: int,
+        dropped_turns: int
+    ):
+        self.system_prompt = system_prompt
+        self.user_context = user_context
+        self.turns = turns  # (role, content) pairs, oldest first
+        self.tokens = tokens
+        self.tokens_saved = tokens_saved
+        self.dropped_turns = dropped_turns
+
+
+class ContextPacker:
+    """
+    Fills an input token budget in priority order
+
+    1. system prompt and the current user message (always sent)
+    2. user profile context (truncated if it does not fit)
+    3. conversation turns, newest first, up to max_turns
+
+    The current message is already the last history entry when the engines
+    are called, so that copy is dropped from the window instead of being
+    sent twice. Every pack is compared with what the unpacked prompt
+    (system + profile + last max_turns entries + message) would have cost
+    and the difference is counted as saved.
+    """
+
+    STATS_LOG_EVERY = 1000
+    MIN_TURN_TOKENS = 16  # Smaller leftovers are not worth a truncated turn
+
+    def __init__(self, budget: int = 2000, max_turns: int = 6):
+        self.budget = budget
+        self.max_turns = max_turns
+        self.packs = 0
+        self.tokens_sent = 0
+        self.tokens_saved = 0
+        self.turns_dropped = 0
+
+    @timed(CONTEXT_BUILD_SECONDS)
+    def pack(
+        self,
+        user_message: str,
+        history: Sequence,
+        user_context: str,
+        system_prompt: str
+    ) -> PackedContext:
+        """Choose the prompt parts for one request"""
+        window = history[-self.max_turns:] if self.max_turns else ()
+        baseline = (
+            estimate_tokens(system_prompt)
+            + estimate_tokens(user_context)
+            + sum(estimate_tokens(msg.content) + TURN_OVERHEAD_TOKENS for msg in window)
+            + estimate_tokens(user_message)
+        )
+
+        candidates = list(window)
+        if candidates and candidates[-1].role == 'user' and user_message.startswith(candidates[-1].content):
+            candidates.pop()  # Current message, sent separately
+
+        used = estimate_tokens(system_prompt) + estimate_tokens(user_message)
+        remaining = self.budget - used
+
+        context_tokens = estimate_tokens(user_context)
+        if context_tokens > remaining:
+            user_context = truncate_to_tokens(user_context, remaining)
+            context_tokens = estimate_tokens(user_context)
+        remaining -= context_tokens
+
+        turns = []
+        for msg in reversed(candidates):
+            cost = estimate_tokens(msg.content) + TURN_OVERHEAD_TOKENS
+            if cost <= remaining:
+                turns.append((msg.role, msg.content))
+                remaining -= cost
+                continue
+            if remaining - TURN_OVERHEAD_TOKENS >= self.MIN_TURN_TOKENS:
+                content = truncate_to_tokens(msg.content, remaining - TURN_OVERHEAD_TOKENS)
+                turns.append((msg.role, content))
+                remaining -= estimate_tokens(content) + TURN_OVERHEAD_TOKENS
+            break
+        turns.reverse()
+
+        tokens = self.budget - remaining
+        packed = PackedContext(
+            system_prompt=system_prompt,
+            user_context=user_context,
+            turns=turns,
+            tokens=tokens,
+            tokens_saved=max(0, baseline - tokens),
+            dropped_turns=len(candidates) - len(turns)
+        )
+
+        self.packs += 1
+        self.tokens_sent += packed.tokens
+        self.tokens_saved += packed.tokens_saved
+        self.turns_dropped += packed.dropped_turns
+        if self.packs % self.STATS_LOG_EVERY == 0:
+            logger.info(f"🧮 Context packer stats: {self.stats()}")
+        return packed
+
+    def stats(self) -> Dict:
+        """Token budget figures for logs and status endpoints"""
+        return {
+            'budget': self.budget,
+            'packs': self.packs,
+            'tokens_sent': self.tokens_sent,
+            'tokens_saved': self.tokens_saved,
+            'avg_tokens': self.tokens_sent / self.packs if self.packs else 0.0,
+            'turns_dropped': self.turns_dropped
+        }
+
+# ============================================================================
+# ROLLING SUMMARIZATION
+# ============================================================================
+
+_SENTENCE_END = re.compile(r'(?<=[.!?।])\s')
+
+
+def extractive_summary(previous: str, turns: Sequence, max_tokens: int) -> str:
+    """
+    Model-free summary: the first sentence of each folded turn
+
+    Appended to the previous summary, dropping its oldest lines once the
+    result would pass max_tokens.
+    """
+    lines = [line for line in previous.splitlines() if line.strip()]
+    for msg in turns:
+        first = _SENTENCE_END.split(msg.content.strip(), 1)[0]
+        label = "User" if msg.role == 'user' else "Assistant"
+        lines.append(f"- {label}: {truncate_to_tokens(first, 40)}")
+    while len(lines) > 1 and estimate_tokens("\n".join(lines)) > max_tokens:
+        lines.pop(0)
+    return truncate_to_tokens("\n".join(lines), max_tokens)
+
+
+class ConversationSummarizer:
+    """
+    Folds older history into a running per-user summary off the reply path
+
+    After each reply, maybe_schedule() checks how many history entries the
+    user's summary does not cover yet. Past trigger_turns, a background task
+    folds everything except the keep_recent newest entries into the summary
+    with the summarize callback (usually a model call) and stores it in
+    MemorySystem, which adds it to the user context. If the callback fails,
+    a local extractive summary is used instead. Keep keep_recent at or above
+    the packer's max_turns so the turns sent to the model and the summary
+    do not overlap.
+    """
+
+    def __init__(
+        self,
+        memory,
+        summarize: Optional[Callable[[str, Sequence], Awaitable[str]]] = None,
+        trigger_turns: int = 16,
+        keep_recent: int = 6,
+        max_tokens: int = 300,
+        max_concurrent: int = 4
+    ):
+        self.memory = memory
+        self.summarize = summarize
+        self.trigger_turns = trigger_turns
+        self.keep_recent = keep_recent
+        self.max_tokens = max_tokens
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._running: Dict[int, asyncio.Task] = {}
+        self.runs = 0
+        self.turns_folded = 0
+        self.fallbacks = 0
+        self.discarded = 0
+
+    def maybe_schedule(self, user_id: int) -> Optional[asyncio.Task]:
+        """Start a background fold for the user if their history is long enough"""
+        if user_id in self._running:
+            return None
+        if len(self.memory.unsummarized(user_id)) <= self.trigger_turns:
+            return None
+        task = asyncio.create_task(self._fold(user_id))
+        self._running[user_id] = task
+        task.add_done_callback(lambda _: self._running.pop(user_id, None))
+        return task
+
+    async def _fold(self, user_id: int):
+        """Fold the user's older unsummarized turns into their summary"""
+        async with self._semaphore:
+            turns = self.memory.unsummarized(user_id)
+            fold = turns[:-self.keep_recent] if self.keep_recent else turns
+            if not fold:
+                return
+            previous, until = self.memory.get_summary(user_id)
+
+            summary = None
+            if self.summarize is not None:
+                try:
+                    summary = await self.summarize(previous, fold)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.warning(f"⚠️ Summarization failed for user {user_id}, using extractive fallback: {e}")
+            if not summary or not summary.strip():
+                if self.summarize is not None:
+                    self.fallbacks += 1
+                summary = extractive_summary(previous, fold, self.max_tokens)
+
+            if self.memory.get_summary(user_id)[1] != until:
+                # History was cleared (or re-summarized) meanwhile
+                self.discarded += 1
+                return
+            self.memory.set_summary(user_id, truncate_to_tokens(summary.strip(), self.max_tokens), fold[-1].ts)
+            self.runs += 1
+            self.turns_folded += len(fold)
+
+    async def close(self):
+        """Cancel summaries still in flight"""
+        tasks = list(self._running.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict:
+        """Summarization figures for logs and status endpoints"""
+        return {
+            'runs': self.runs,
+            'in_flight': len(self._running),
+            'turns_folded': self.turns_folded,
+            'fallbacks': self.fallbacks,
+            'discarded': self.discarded
+        }
+
+# ============================================================================
+# LONG-TERM RETRIEVAL - Per-user BM25 over past messages
+# ============================================================================
+
+_TERMS = re.compile(r'\w+')
+
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from how i if in is it me my of on or so
+that the this to was we what when which why will with you your
+aap aur bhi ek hai hain ho hota hoga hum ka kaise kar karo karna ke ki kis ko kya
+mai main me mein mera mujhe na nahi par se tha the tu tum vo woh ya ye yeh
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Case-folded index terms with stopwords and single characters removed"""
+    return [term for term in _TERMS.findall(text.casefold()) if len(term) > 1 and term not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    Incremental Okapi BM25 inverted index
+
+    Documents get sequential ids in insertion order, so "everything except
+    the newest n" is just an id limit at query time. Queries score terms
+    from rarest to most common; once the remaining common terms can no
+    longer lift a new document into the top k, they only update documents
+    already scored instead of walking their long posting lists.
+    """
+
+    NORM_REFRESH = 0.1  # Recompute length norms when the average drifts by 10%
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[int, int]] = defaultdict(dict)
+        self.doc_lengths: List[int] = []
+        self.total_length = 0
+        self._norms: List[float] = []  # k1 * (1 - b + b * length / avg_length)
+        self._norm_avg = 0.0
+
+    def add(self, text: str) -> int:
+        """Index one document and return its id"""
+        doc_id = len(self.doc_lengths)
+        terms = tokenize(text)
+        for term in terms:
+            postings = self.postings[term]
+            postings[doc_id] = postings.get(doc_id, 0) + 1
+        self.doc_lengths.append(len(terms))
+        self.total_length += len(terms)
+        self._norms.append(self._norm(len(terms), self._norm_avg or len(terms) or 1.0))
+        return doc_id
+
+    def _norm(self, length: int, avg_length: float) -> float:
+        return self.k1 * (1 - self.b + self.b * length / avg_length)
+
+    def _refresh_norms(self):
+        """Recompute length norms if the average document length moved"""
+        avg_length = (self.total_length / len(self.doc_lengths)) or 1.0
+        if abs(avg_length - self._norm_avg) > self.NORM_REFRESH * self._norm_avg:
+            self._norm_avg = avg_length
+            self._norms = [self._norm(length, avg_length) for length in self.doc_lengths]
+
+    def search(self, query: str, k: int, limit: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Top k (doc_id, score) pairs among documents with id below limit"""
+        count = len(self.doc_lengths)
+        limit = count if limit is None else min(limit, count)
+        if limit <= 0 or k <= 0:
+            return []
+        self._refresh_norms()
+
+        terms = []
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if postings:
+                df = len(postings)
+                terms.append((math.log(1 + (count - df + 0.5) / (df + 0.5)), postings))
+        terms.sort(key=itemgetter(0), reverse=True)
+
+        # Best possible contribution of all terms from position i onwards
+        k1_plus = self.k1 + 1
+        bounds = [0.0] * (len(terms) + 1)
+        for i in range(len(terms) - 1, -1, -1):
+            bounds[i] = bounds[i + 1] + terms[i][0] * k1_plus
+
+        norms = self._norms
+        scores: Dict[int, float] = {}
+        for i, (idf, postings) in enumerate(terms):
+            weight = idf * k1_plus
+            if len(scores) >= k and heapq.nlargest(k, scores.values())[-1] >= bounds[i]:
+                # Only documents already scored can still make the top k
+                for doc_id in scores:
+                    tf = postings.get(doc_id)
+                    if tf:
+                        scores[doc_id] += weight * tf / (tf + norms[doc_id])
+                continue
+            for doc_id, tf in postings.items():
+                if doc_id < limit:
+                    scores[doc_id] = scores.get(doc_id, 0.0) + weight * tf / (tf + norms[doc_id])
+        return heapq.nlargest(k, scores.items(), key=itemgetter(1))
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+
+class HistoryRetriever:
+    """
+    Finds past messages relevant to a new one, per user
+
+    MemorySystem feeds every history entry to add(), so indexes stay current
+    without rebuilding. With a MemoryStore, a user's index is built on first
+    query from their newest max_messages persisted entries (writes still
+    queued included) in a background thread; until it is ready, that user's
+    queries find nothing instead of stalling the event loop. Without a store,
+    indexes only cover this run. Either way at most max_users indexes stay in
+    RAM (least recently used are dropped; with a store they are rebuilt on
+    demand) and each keeps roughly the newest max_messages entries. The
+    newest exclude_recent entries are skipped at query time, since they are
+    already sent as recent turns.
+    """
+
+    STATS_LOG_EVERY = 1000
+    HEADER = "**Related Past Messages:**"
+
+    def __init__(
+        self,
+        store=None,
+        top_k: int = 3,
+        max_tokens: int = 300,
+        exclude_recent: int = 6,
+        max_users: int = 200,
+        max_messages: int = 1000
+    ):
+        self.store = store
+        self.top_k = top_k
+        self.max_tokens = max_tokens
+        self.exclude_recent = exclude_recent
+        self.max_users = max_users
+        self.max_messages = max_messages
+        # user_id -> (index, messages by doc id), least recently used first
+        self._indexes: "OrderedDict[int, Tuple[BM25Index, List]]" = OrderedDict()
+        # user_id -> entries added while their index is being built
+        self._building: Dict[int, List] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.queries = 0
+        self.builds = 0
+        self.hits = 0
+
+    def add(self, user_id: int, message):
+        """Index one new history entry"""
+        entry = self._indexes.get(user_id)
+        if entry is None:
+            if user_id in self._building:
+                self._building[user_id].append(message)
+                return
+            if self.store is not None:
+                return  # Built from the store (which has this message) on first query
+            entry = self._install(user_id, BM25Index(), [])
+        else:
+            self._indexes.move_to_end(user_id)
+        index, messages = entry
+        index.add(message.content)
+        messages.append(message)
+        if self.max_messages and len(messages) >= self.max_messages * 3 // 2:
+            self._trim(user_id)
+
+    def forget(self, user_id: int):
+        """Drop the user's index, e.g. after their history was cleared"""
+        self._indexes.pop(user_id, None)
+        self._building.pop(user_id, None)  # A build in progress is discarded when it finishes
+
+    @staticmethod
+    def _build_index(messages: List) -> BM25Index:
+        index = BM25Index()
+        for message in messages:
+            index.add(message.content)
+        return index
+
+    def _install(self, user_id: int, index: BM25Index, messages: List) -> Tuple[BM25Index, List]:
+        """Keep a user's index as most recently used, dropping the least recent over max_users"""
+        entry = self._indexes[user_id] = (index, messages)
+        self._indexes.move_to_end(user_id)
+        while self.max_users and len(self._indexes) > self.max_users:
+            self._indexes.popitem(last=False)
+        return entry
+
+    def _trim(self, user_id: int):
+        """Rebuild the user's index over only their newest max_messages entries"""
+        _, messages = self._indexes[user_id]
+        kept = messages[-self.max_messages:]
+        self._indexes[user_id] = (self._build_index(kept), kept)
+
+    def _load(self, user_id: int) -> Tuple[BM25Index, List]:
+        """Read the user's newest entries from the store and index them"""
+        messages = self.store.load_all_messages(user_id, limit=self.max_messages)
+        return self._build_index(messages), messages
+
+    def _finish_build(self, user_id: int, index: BM25Index, messages: List, added: List = ()):
+        """Install a built index, plus entries added while it was being built"""
+        already_loaded = messages[-len(added):] if added else []
+        for message in added:
+            if message not in already_loaded:
+                index.add(message.content)
+                messages.append(message)
+        self.builds += 1
+        entry = self._install(user_id, index, messages)
+        if self.max_messages and len(messages) > self.max_messages:
+            self._trim(user_id)
+            entry = self._indexes[user_id]
+        return entry
+
+    def _built(self, user_id: int, future: "asyncio.Future"):
+        """Done callback of a background build, run on the event loop"""
+        added = self._building.pop(user_id, None)
+        if added is None or future.cancelled():
+            return  # Forgotten (e.g. /clear) or shutting down
+        if future.exception() is not None:
+            logger.warning(f"⚠️ Retrieval index build failed for {user_id}: {future.exception()}")
+            return
+        index, messages = future.result()
+        self._finish_build(user_id, index, messages, added)
+
+    def _index_for(self, user_id: int) -> Optional[Tuple[BM25Index, List]]:
+        """Return the user's index, or start building it from the store and return None"""
+        entry = self._indexes.get(user_id)
+        if entry is not None:
+            self._indexes.move_to_end(user_id)
+            return entry
+        if self.store is None or user_id in self._building:
+            return None
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop to keep responsive (scripts, benchmarks): build inline
+            return self._finish_build(user_id, *self._load(user_id))
+
+        self._building[user_id] = []
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='retrieval-build')
+        future = asyncio.wrap_future(self._executor.submit(self._load, user_id), loop=loop)
+        future.add_done_callback(functools.partial(self._built, user_id))
+        return None
+
+    def search(self, user_id: int, query: str) -> List:
+        """Most relevant past messages for the query, best first"""
+        self.queries += 1
+        if self.queries % self.STATS_LOG_EVERY == 0:
+            logger.info(f"🔎 Retrieval stats: {self.stats()}")
+        entry = self._index_for(user_id)
+        if entry is None:
+            return []
+        index, messages = entry
+        results = index.search(query, self.top_k, limit=len(messages) - self.exclude_recent)
+        if results:
+            self.hits += 1
+        return [messages[doc_id] for doc_id, _ in results]
+
+    def context_for(self, user_id: int, query: str) -> str:
+        """Prompt section with the relevant past messages, within max_tokens"""
+        remaining = self.max_tokens
+        chosen = []
+        for message in self.search(user_id, query):
+            label = "User" if message.role == 'user' else "Assistant"
+            line = f"- {label}: {message.content}"
+            cost = estimate_tokens(line)
+            if cost > remaining:
+                if remaining < ContextPacker.MIN_TURN_TOKENS:
+                    break
+                line = truncate_to_tokens(line, remaining)
+                cost = estimate_tokens(line)
+            chosen.append((message.ts, line))
+            remaining -= cost
+        if not chosen:
+            return ""
+        chosen.sort(key=itemgetter(0))  # Chronological reads better than by score
+        return f"\n{self.HEADER}\n" + "\n".join(line for _, line in chosen) + "\n"
+
+    def stats(self) -> Dict:
+        """Index and query figures for logs and status endpoints"""
+        return {
+            'indexed_users': len(self._indexes),
+            'indexed_messages': sum(len(index) for index, _ in self._indexes.values()),
+            'queries': self.queries,
+            'hits': self.hits,
+            'builds': self.builds,
+            'building': len(self._building)
+        }
+
+    def close(self):
+        """Stop the build thread, waiting for a build that is reading the store"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Event-loop health shared by both bot versions
+Continuous scheduling-delay sampling, stack capture of callbacks that block
+the loop, and a /health verdict built from loop lag and update backlog
+"""
+
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import deque
+from datetime import datetime, timezone
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from metrics import counter, gauge, histogram
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG_SECONDS = histogram(
+    'bot_event_loop_lag_seconds', 'How late the event loop ran a timer it was asked to run',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+).labels()
+LOOP_STALLS = counter('bot_event_loop_stalls_total', 'Callbacks that blocked the event loop past the slow threshold').labels()
+
+HEALTHY = 'healthy'
+DEGRADED = 'degraded'
+UNHEALTHY = 'unhealthy'
+
+# ============================================================================
+# LOOP MONITOR
+# ============================================================================
+
+class LoopMonitor:
+    """
+    Measures event-loop responsiveness from inside and outside the loop
+
+    A task on the loop sleeps ``interval`` seconds at a time and records how
+    late each wake-up is; that delay is what every handler, timer and
+    Telegram request on the loop waits on top of its own work. A watchdog
+    thread notices when the sampler stops ticking for ``slow_callback``
+    seconds, grabs the loop thread's current stack and logs it, so the
+    blocking call shows up by name instead of as a mysterious pause.
+
+    check() is safe to call from any thread (e.g. Flask's). It reports the
+    worst lag of the last ``window`` seconds, including a stall that is
+    still going on, together with the backlog callback's figure, and rates
+    the pair against the degraded/unhealthy thresholds (0 disables one).
+    """
+
+    def __init__(
+        self,
+        interval: float = 0.1,
+        slow_callback: float = 0.25,
+        degraded_lag: float = 0.5,
+        unhealthy_lag: float = 5.0,
+        degraded_backlog: int = 100,
+        unhealthy_backlog: int = 1000,
+        backlog: Optional[Callable[[], int]] = None,
+        window: float = 10.0,
+        keep_stalls: int = 20
+    ):
+        self.interval = interval
+        self.slow_callback = slow_callback
+        self.degraded_lag = degraded_lag
+        self.unhealthy_lag = unhealthy_lag
+        self.degraded_backlog = degraded_backlog
+        self.unhealthy_backlog = unhealthy_backlog
+        self.backlog = backlog
+        self.window = window
+        self.stalls: Deque[Dict] = deque(maxlen=keep_stalls)
+        self.stall_count = 0
+        self.max_lag = 0.0
+        self._recent: Deque[Tuple[float, float]] = deque()  # (sampled at, lag)
+        self._last_tick: Optional[float] = None
+        self._loop_thread: Optional[int] = None
+        self._reported_tick: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        gauge('bot_event_loop_lag_current_seconds', 'Worst event-loop lag over the recent window',
+              fn=lambda: self.current_lag())
+        gauge('bot_update_backlog', 'Updates and messages received but not yet being handled',
+              fn=lambda: self._backlog())
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        """Start sampling the running loop and watching it from a thread"""
+        if self.running:
+            return
+        self._loop_thread = threading.get_ident()
+        self._last_tick = time.perf_counter()
+        self._stopping.clear()
+        self._task = asyncio.get_running_loop().create_task(self._sample())
+        if self.slow_callback > 0:
+            self._watchdog = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+            self._watchdog.start()
+        logger.info(f"🩺 Event loop monitor started (slow callback: {self.slow_callback * 1e3:.0f} ms)")
+
+    async def stop(self):
+        self._stopping.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=1)
+            self._watchdog = None
+
+    async def _sample(self):
+        """Sleep one interval at a time and record how late each wake-up is"""
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            lag = max(0.0, now - expected)
+            previous_tick, self._last_tick = self._last_tick, now
+            LOOP_LAG_SECONDS.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+            self._recent.append((now, lag))
+            while self._recent and self._recent[0][0] < now - self.window:
+                self._recent.popleft()
+            if self._reported_tick is not None and self._reported_tick == previous_tick and self.stalls:
+                self.stalls[-1]['blocked_ms'] = round(lag * 1e3)  # The stall is over: record its full length
+
+    def _watch(self):
+        """Watchdog thread: capture the loop thread's stack when the sampler stalls"""
+        while not self._stopping.wait(self.slow_callback / 2):
+            tick = self._last_tick
+            stalled = time.perf_counter() - tick - self.interval
+            if stalled < self.slow_callback or tick == self._reported_tick:
+                continue
+            self._reported_tick = tick
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = ''.join(traceback.format_stack(frame)) if frame is not None else ''
+            self.stall_count += 1
+            LOOP_STALLS.inc()
+            self.stalls.append({
+                'at': datetime.now(timezone.utc).isoformat(),
+                'blocked_ms': round(stalled * 1e3),
+                'stack': stack
+            })
+            logger.warning(f"🐢 Event loop blocked for {stalled * 1e3:.0f}+ ms, currently in:\n{stack}")
+
+    def current_lag(self) -> float:
+        """Worst lag in the window, counting a stall still in progress"""
+        if not self.running:
+            return 0.0
+        now = time.perf_counter()
+        lags = [lag for sampled_at, lag in list(self._recent) if sampled_at >= now - self.window]
+        stalled = now - self._last_tick - self.interval
+        return max(lags + [stalled, 0.0])
+
+    def _backlog(self) -> int:
+        return self.backlog() if self.backlog is not None else 0
+
+    def check(self) -> Dict:
+        """Health verdict with the figures behind it"""
+        lag = self.current_lag()
+        backlog = self._backlog()
+        reasons: List[str] = []
+        status = HEALTHY
+        for value, degraded, unhealthy, label in (
+            (lag, self.degraded_lag, self.unhealthy_lag, f"event loop lag {lag * 1e3:.0f} ms"),
+            (backlog, self.degraded_backlog, self.unhealthy_backlog, f"backlog {backlog}"),
+        ):
+            if unhealthy and value >= unhealthy:
+                status = UNHEALTHY
+                reasons.append(label)
+            elif degraded and value >= degraded:
+                if status == HEALTHY:
+                    status = DEGRADED
+                reasons.append(label)
+        return {
+            'status': status,
+            'loop_lag_ms': round(lag * 1e3, 1),
+            'backlog': backlog,
+            'reasons': reasons,
+            'monitoring': self.running,
+            'timestamp': datetime.now(timezone.utc).isoformat()
+        }
+
+    def stats(self) -> Dict:
+        """Lag and stall figures; the last stall's stack is included for debugging"""
+        return {
+            'current_lag_ms': round(self.current_lag() * 1e3, 1),
+            'max_lag_ms': round(self.max_lag * 1e3, 1),
+            'stalls': self.stall_count,
+            'last_stall': self.stalls[-1] if self.stalls else None
+        }
@@ -0,0 +1,718 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Memory System shared by both bot versions
+User context, conversation history and learning progress, optionally backed
+by a durable SQLite store so memories survive restarts and redeploys, with
+a bounded hot set of users kept in RAM
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+from typing import Deque, Dict, List, Optional, Tuple
+from collections import OrderedDict, defaultdict, deque
+from collections.abc import Iterable, Iterator, Sequence
+from itertools import islice
+
+from telegram import User
+
+from metrics import FAST_BUCKETS, histogram, timed
+
+logger = logging.getLogger(__name__)
+
+MEMORY_OP_SECONDS = histogram(
+    'bot_memory_operation_seconds', 'MemorySystem call duration by operation', ('op',), FAST_BUCKETS
+)
+
+# ============================================================================
+# PERSISTENT STORE - SQLite (WAL) with write-behind batching
+# ============================================================================
+
+class MemoryStore:
+    """
+    Durable SQLite backend for MemorySystem
+
+    Reads happen on the caller's connection (WAL lets them run alongside the
+    writer). Writes are queued and applied by a background thread in batched
+    transactions, so the bot's hot path never waits on disk. Reads merge in
+    the user's writes that are still queued instead of waiting for the queue
+    to drain. Anything still queued is written by flush() / close().
+    """
+
+    HISTORY_LOAD_LIMIT = 50  # Matches MemorySystem's ring buffer capacity
+
+    def __init__(
+        self,
+        path: str,
+        batch_size: int = 200,
+        flush_interval: float = 0.5,
+        reset: bool = False
+    ):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue[Optional[Tuple]]" = queue.Queue()
+        self._stop = object()
+
+        # Writes queued but not yet committed, per user in queue order
+        self._pending_lock = threading.Lock()
+        self._pending: Dict[int, Deque[Tuple]] = {}
+        # Held while a batch commits and leaves _pending, so a read sees each write exactly once
+        self._commit_lock = threading.Lock()
+
+        if reset:
+            # Scratch spill file: start empty every run
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+
+        # Write-behind metrics
+        self.batches_written = 0
+        self.rows_written = 0
+        self.last_flush_seconds = 0.0
+
+        self._reader = self._connect()
+        self._create_schema(self._reader)
+        self._writer = threading.Thread(target=self._write_loop, name='memory-writer', daemon=True)
+        self._writer.start()
+        logger.info(f"💾 Memory store ready at {path} (WAL, batch={batch_size}, every {flush_interval}s)")
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a connection tuned for one writer and concurrent readers"""
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    @staticmethod
+    def _create_schema(conn: sqlite3.Connection):
+        """Create tables on first use"""
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY,
+                profile TEXT NOT NULL,
+                progress TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                ts REAL NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                topic TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_messages_user ON messages (user_id, id);
+        """)
+        conn.commit()
+
+    # ---- Reads -------------------------------------------------------------
+
+    def load_user(self, user_id: int) -> Optional[Tuple[Dict, Dict, List["MessageRecord"]]]:
+        """Return (profile, progress, recent history) or None for unknown users"""
+        with self._commit_lock:
+            row = self._reader.execute(
+                "SELECT profile, progress FROM users WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            rows = self._reader.execute(
+                "SELECT ts, role, content, topic FROM messages WHERE user_id = ? "
+                "ORDER BY id DESC LIMIT ?",
+                (user_id, self.HISTORY_LOAD_LIMIT)
+            ).fetchall()
+            pending = self._pending_for(user_id)
+
+        history = [MessageRecord(ts, role, content, topic) for ts, role, content, topic in reversed(rows)]
+        queued_user = self._apply_pending(pending, history)
+        if queued_user is not None:
+            row = queued_user[2:4]
+        if row is None:
+            return None
+        return json.loads(row[0]), json.loads(row[1]), history[-self.HISTORY_LOAD_LIMIT:]
+
+    def load_all_messages(self, user_id: int, limit: int = 0) -> List["MessageRecord"]:
+        """The user's stored history entries (the newest ``limit`` of them, 0 = all), oldest first"""
+        with self._commit_lock:
+            rows = self._reader.execute(
+                "SELECT ts, role, content, topic FROM messages WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+                (user_id, limit or -1)
+            ).fetchall()
+            pending = self._pending_for(user_id)
+        messages = [MessageRecord(ts, role, content, topic) for ts, role, content, topic in reversed(rows)]
+        self._apply_pending(pending, messages)
+        return messages[-limit:] if limit else messages
+
+    @staticmethod
+    def _apply_pending(pending: List[Tuple], history: List["MessageRecord"]) -> Optional[Tuple]:
+        """Replay queued writes onto committed history; returns the newest queued profile write"""
+        queued_user = None
+        for item in pending:
+            if item[0] == 'message':
+                history.append(MessageRecord(*item[2:]))
+            elif item[0] == 'clear':
+                history.clear()
+            elif item[0] == 'user':
+                queued_user = item
+        return queued_user
+
+    # ---- Writes (queued) ---------------------------------------------------
+
+    def _enqueue(self, item: Tuple):
+        """Queue one write and remember it as pending for its user"""
+        with self._pending_lock:
+            self._pending.setdefault(item[1], deque()).append(item)
+        self._queue.put(item)
+
+    def has_pending(self, user_id: int) -> bool:
+        """Whether the user has writes that are not committed yet"""
+        with self._pending_lock:
+            return bool(self._pending.get(user_id))
+
+    def _pending_for(self, user_id: int) -> List[Tuple]:
+        """The user's uncommitted writes, oldest first"""
+        with self._pending_lock:
+            return list(self._pending.get(user_id, ()))
+
+    def save_user(self, user_id: int, profile: Dict, progress: Dict):
+        """Queue an upsert of the user's profile and learning progress"""
+        self._enqueue(('user', user_id, json.dumps(profile), json.dumps(progress), time.time()))
+
+    def append_message(self, user_id: int, message: "MessageRecord"):
+        """Queue one history entry"""
+        self._enqueue(('message', user_id, message.ts, message.role, message.content, message.topic))
+
+    def clear_history(self, user_id: int):
+        """Queue deletion of the user's stored history"""
+        self._enqueue(('clear', user_id))
+
+    @property
+    def pending_writes(self) -> int:
+        """Writes queued but not yet committed"""
+        return self._queue.qsize()
+
+    def flush(self):
+        """Block until every queued write is committed"""
+        self._queue.join()
+
+    def close(self):
+        """Write everything still queued and stop the writer thread"""
+        self._queue.put(self._stop)
+        self._writer.join()
+        self._reader.close()
+
+    # ---- Writer thread -----------------------------------------------------
+
+    def _write_loop(self):
+        """Collect queued writes into batches and commit each batch in one transaction"""
+        conn = self._connect()
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and batch[-1] is not self._stop:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            if batch[-1] is self._stop:
+                running = False
+            writes = [item for item in batch if item is not self._stop]
+            with self._commit_lock:
+                try:
+                    if writes:
+                        self._apply(conn, writes)
+                except Exception:
+                    logger.exception("Memory store batch write failed")
+                finally:
+                    with self._pending_lock:
+                        for item in writes:
+                            pending = self._pending.get(item[1])
+                            if pending:
+                                pending.popleft()
+                                if not pending:
+                                    del self._pending[item[1]]
+            for _ in batch:
+                self._queue.task_done()
+        conn.close()
+
+    def _apply(self, conn: sqlite3.Connection, writes: List[Tuple]):
+        """Apply one batch of queued writes atomically"""
+        started = time.perf_counter()
+
+        # Only the newest profile per user in a batch needs writing
+        latest_users = {}
+        for item in writes:
+            if item[0] == 'user':
+                latest_users[item[1]] = item
+
+        with conn:
+            for item in writes:
+                kind, user_id = item[0], item[1]
+                if kind == 'message':
+                    conn.execute(
+                        "INSERT INTO messages (user_id, ts, role, content, topic) VALUES (?, ?, ?, ?, ?)",
+                        item[1:]
+                    )
+                elif kind == 'clear':
+                    conn.execute("DELETE FROM messages WHERE user_id = ?", (user_id,))
+                elif kind == 'user' and latest_users.get(user_id) is item:
+                    conn.execute(
+                        "INSERT INTO users (user_id, profile, progress, updated_at) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT(user_id) DO UPDATE SET profile = excluded.profile, "
+                        "progress = excluded.progress, updated_at = excluded.updated_at",
+                        item[1:]
+                    )
+
+        self.batches_written += 1
+        self.rows_written += len(writes)
+        self.last_flush_seconds = time.perf_counter() - started
+
+    def stats(self) -> Dict:
+        """Write-behind queue and batch figures"""
+        return {
+            'pending_writes': self.pending_writes,
+            'batches_written': self.batches_written,
+            'rows_written': self.rows_written,
+            'avg_batch_size': self.rows_written / self.batches_written if self.batches_written else 0.0,
+            'last_flush_seconds': self.last_flush_seconds
+        }
+
+# ============================================================================
+# MESSAGE RECORDS - Compact history entries
+# ============================================================================
+
+class MessageRecord:
+    """
+    One conversation history entry
+
+    Slots instead of a per-message dict, a float epoch timestamp instead of
+    an ISO string, and interned role/topic values so the few distinct ones
+    are shared by every message that uses them.
+    """
+
+    __slots__ = ('ts', 'role', 'content', 'topic')
+
+    def __init__(self, ts: float, role: str, content: str, topic: Optional[str] = None):
+        self.ts = ts
+        self.role = sys.intern(role)
+        self.content = content
+        self.topic = sys.intern(topic) if topic else None
+
+    @property
+    def timestamp(self) -> str:
+        """ISO-format local time, as the old dict entries stored it"""
+        return datetime.fromtimestamp(self.ts).isoformat()
+
+    def to_dict(self) -> Dict:
+        """Plain dict form for export and debugging"""
+        return {'timestamp': self.timestamp, 'role': self.role, 'content': self.content, 'topic': self.topic}
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, MessageRecord):
+            return NotImplemented
+        return (self.ts, self.role, self.content, self.topic) == (other.ts, other.role, other.content, other.topic)
+
+    def __repr__(self) -> str:
+        return f"MessageRecord(ts={self.ts!r}, role={self.role!r}, content={self.content!r}, topic={self.topic!r})"
+
+# ============================================================================
+# RING BUFFER - Fixed-capacity conversation history
+# ============================================================================
+
+class RingBuffer(deque):
+    """
+    Fixed-capacity history with O(1) append
+
+    A bounded deque: once full, append() drops the oldest item in place
+    instead of rebuilding the list. Slicing returns a RingView over the same
+    storage rather than a copy.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, capacity: int = 50, items: Iterable = ()):
+        super().__init__(items, capacity)
+
+    @property
+    def capacity(self) -> int:
+        return self.maxlen
+
+    def last(self, n: int) -> "RingView":
+        """Zero-copy view of the newest n items"""
+        n = max(0, min(n, len(self)))
+        return RingView(self, len(self) - n, n)
+
+    def __getitem__(self, index):
+        if index.__class__ is slice:
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [deque.__getitem__(self, i) for i in range(start, stop, step)]
+            return RingView(self, start, max(0, stop - start))
+        return deque.__getitem__(self, index)
+
+    def __reduce__(self):
+        return (self.__class__, (self.maxlen, list(self)))
+
+
+class RingView(Sequence):
+    """
+    Read-only window onto a RingBuffer without copying
+
+    The view indexes into the live buffer, so consume it before the buffer
+    is appended to again (every reader in this bot does so synchronously).
+    """
+
+    __slots__ = ('_ring', '_start', '_len')
+
+    def __init__(self, ring: RingBuffer, start: int, length: int):
+        self._ring = ring
+        self._start = start
+        self._len = length
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._len)
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return RingView(self._ring, self._start + start, max(0, stop - start))
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("history index out of range")
+        return deque.__getitem__(self._ring, self._start + index)
+
+    def __iter__(self) -> Iterator:
+        return islice(self._ring, self._start, self._start + self._len)
+
+    def __repr__(self) -> str:
+        return f"RingView({list(self)!r})"
+
+# ============================================================================
+# MEMORY SYSTEM - User Context & Learning Tracking
+# ============================================================================
+
+HISTORY_LIMIT = 50
+SUMMARY_HEADER = "**Conversation So Far:**"
+
+
+def _deep_size(obj) -> int:
+    """Approximate resident bytes of a dict/list tree of plain values"""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, MessageRecord):
+        # role/topic are interned and shared, so only the own values count
+        size += sys.getsizeof(obj.ts) + sys.getsizeof(obj.content)
+    elif isinstance(obj, dict):
+        size += sum(_deep_size(k) + _deep_size(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, deque)):
+        size += sum(_deep_size(v) for v in obj)
+    return size
+
+
+class MemorySystem:
+    """
+    Advanced memory system for tracking user interactions and learning progress
+
+    With a MemoryStore attached, users are loaded lazily from disk on first
+    touch and every change is queued for write-behind persistence. An
+    optional retriever indexes every history entry as it is added. Setting
+    max_users and/or max_bytes turns RAM into a hot LRU tier: the least
+    recently active users are dropped from memory (their data is already in
+    the store) and faulted back in transparently on their next message.
+    """
+
+    STATS_LOG_EVERY = 1000
+
+    def __init__(
+        self,
+        store: Optional[MemoryStore] = None,
+        content_limit: int = 200,
+        max_users: int = 0,
+        max_bytes: int = 0,
+        retriever=None
+    ):
+        if (max_users or max_bytes) and store is None:
+            raise ValueError("Bounded memory needs a MemoryStore to spill idle users to")
+        self.user_memories: Dict[int, Dict] = {}
+        self.conversation_history: Dict[int, RingBuffer] = defaultdict(lambda: RingBuffer(HISTORY_LIMIT))
+        self.learning_progress: Dict[int, Dict] = {}
+        self.store = store
+        self.content_limit = content_limit
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+        self.retriever = retriever  # Optional HistoryRetriever over long-term history
+        self._loaded = set()
+
+        # Hot tier: user_id -> estimated resident bytes, least recent first
+        self._resident: "OrderedDict[int, int]" = OrderedDict()
+        self.resident_bytes = 0
+        self.history_bytes = 0  # Estimated size of every resident history entry
+        self.evictions = 0
+        self.faults = 0
+
+    def _ensure_loaded(self, user_id: int):
+        """Fault a user in from the store if needed and mark them most recent"""
+        if self.store is None:
+            return
+        if user_id in self._loaded:
+            self._resident.move_to_end(user_id)
+            return
+        self._loaded.add(user_id)
+
+        record = self.store.load_user(user_id)
+        if record is not None:
+            profile, progress, history = record
+            self.user_memories[user_id] = profile
+            self.learning_progress[user_id] = progress
+            self.conversation_history[user_id] = RingBuffer(HISTORY_LIMIT, history)
+            self.history_bytes += self._history_size(user_id)
+            self.faults += 1
+
+        self._resident[user_id] = 0
+        self._set_resident_size(user_id, self._user_size(user_id))
+        self._enforce_limits(keep=user_id)
+
+    def _user_size(self, user_id: int) -> int:
+        """Estimate the resident bytes of one user's memory"""
+        return (
+            _deep_size(self.user_memories.get(user_id, {}))
+            + _deep_size(self.learning_progress.get(user_id, {}))
+            + _deep_size(self.conversation_history.get(user_id, []))
+        )
+
+    def _history_size(self, user_id: int) -> int:
+        """Estimated bytes of one user's history entries"""
+        return sum(_deep_size(message) for message in self.conversation_history.get(user_id, ()))
+
+    def _set_resident_size(self, user_id: int, size: int):
+        """Update one user's byte estimate and the running total"""
+        if user_id in self._resident:
+            self.resident_bytes += size - self._resident[user_id]
+            self._resident[user_id] = size
+
+    def _enforce_limits(self, keep: int):
+        """Evict least recently active users until the caps are met"""
+        while self._resident:
+            over_users = self.max_users and len(self._resident) > self.max_users
+            over_bytes = self.max_bytes and self.resident_bytes > self.max_bytes
+            if not (over_users or over_bytes):
+                break
+            victim = next(iter(self._resident))
+            if victim == keep:
+                break
+            self._evict(victim)
+
+    def _evict(self, user_id: int):
+        """Drop an idle user from RAM; their data lives on in the store"""
+        self.resident_bytes -= self._resident.pop(user_id, 0)
+        self.history_bytes -= self._history_size(user_id)
+        self.user_memories.pop(user_id, None)
+        self.learning_progress.pop(user_id, None)
+        self.conversation_history.pop(user_id, None)
+        self._loaded.discard(user_id)
+        self.evictions += 1
+        if self.evictions % self.STATS_LOG_EVERY == 0:
+            logger.info(f"🧠 Memory tier stats: {self.stats()}")
+
+    def stats(self) -> Dict:
+        """Hot-tier size and eviction figures"""
+        return {
+            'resident_users': len(self.user_memories),
+            'resident_bytes': self.resident_bytes,
+            'history_bytes': self.history_bytes,
+            'evictions': self.evictions,
+            'faults': self.faults,
+            'max_users': self.max_users,
+            'max_bytes': self.max_bytes
+        }
+
+    def _persist_user(self, user_id: int):
+        """Queue the user's profile and progress for the store"""
+        if self.store is not None:
+            self.store.save_user(user_id, self.user_memories[user_id], self.learning_progress[user_id])
+
+    @timed(MEMORY_OP_SECONDS.labels(op='has_user'))
+    def has_user(self, user_id: int) -> bool:
+        """Whether the user has been initialized"""
+        self._ensure_loaded(user_id)
+        return user_id in self.user_memories
+
+    def get_user(self, user_id: int) -> Optional[Dict]:
+        """User profile, or None if the user is unknown"""
+        self._ensure_loaded(user_id)
+        return self.user_memories.get(user_id)
+
+    def get_progress(self, user_id: int) -> Dict:
+        """Learning progress percentages for the user"""
+        self._ensure_loaded(user_id)
+        return self.learning_progress.get(user_id, {})
+
+    @timed(MEMORY_OP_SECONDS.labels(op='get_history'))
+    def get_history(self, user_id: int) -> Sequence[MessageRecord]:
+        """Recent conversation history for the user (oldest first)"""
+        self._ensure_loaded(user_id)
+        return self.conversation_history.get(user_id, ())
+
+    @timed(MEMORY_OP_SECONDS.labels(op='initialize_user'))
+    def initialize_user(self, user_id: int, user: User):
+        """Initialize memory for a new user"""
+        self._ensure_loaded(user_id)
+        if user_id not in self.user_memories:
+            self.user_memories[user_id] = {
+                'user_name': user.first_name or 'Friend',
+                'created_at': datetime.now().isoformat(),
+                'total_interactions': 0,
+                'topics_explored': [],
+                'coding_skills': [],
+                'questions_asked': [],
+                'learning_pace': 'adaptive',
+                'preferences': {}
+            }
+            self.learning_progress[user_id] = {
+                'python': 0,
+                'javascript': 0,
+                'apis': 0,
+                'databases': 0,
+                'deployment': 0
+            }
+            self._persist_user(user_id)
+            self._set_resident_size(user_id, self._user_size(user_id))
+
+    @timed(MEMORY_OP_SECONDS.labels(op='add_to_history'))
+    def add_to_history(self, user_id: int, role: str, content: str, topic: str = None):
+        """Add message to conversation history"""
+        self._ensure_loaded(user_id)
+        message = MessageRecord(time.time(), role, content[:self.content_limit], topic)  # Store first N chars
+        # Ring buffer keeps the last 50 messages, O(1) per append
+        history = self.conversation_history[user_id]
+        added = _deep_size(message)
+        if len(history) == history.maxlen:
+            added -= _deep_size(history[0])
+        history.append(message)
+        self.history_bytes += added
+        if self.retriever is not None:
+            self.retriever.add(user_id, message)
+
+        if self.store is not None:
+            self.store.append_message(user_id, message)
+            self._set_resident_size(user_id, self._resident.get(user_id, 0) + added)
+
+    @timed(MEMORY_OP_SECONDS.labels(op='clear_history'))
+    def clear_history(self, user_id: int):
+        """Forget the user's conversation history"""
+        self._ensure_loaded(user_id)
+        self.history_bytes -= self._history_size(user_id)
+        self.conversation_history[user_id] = RingBuffer(HISTORY_LIMIT)
+        if self.retriever is not None:
+            self.retriever.forget(user_id)
+        if user_id in self.user_memories:
+            # Drop the running summary too; in-flight summaries are discarded
+            self.user_memories[user_id]['conversation_summary'] = ''
+            self.user_memories[user_id]['summary_until'] = time.time()
+            self._persist_user(user_id)
+        if self.store is not None:
+            self.store.clear_history(user_id)
+            self._set_resident_size(user_id, self._user_size(user_id))
+
+    def get_summary(self, user_id: int) -> Tuple[str, float]:
+        """Running summary of folded history and the timestamp it covers up to"""
+        self._ensure_loaded(user_id)
+        mem = self.user_memories.get(user_id, {})
+        return mem.get('conversation_summary', ''), mem.get('summary_until', 0.0)
+
+    @timed(MEMORY_OP_SECONDS.labels(op='set_summary'))
+    def set_summary(self, user_id: int, summary: str, until: float):
+        """Store a new running summary covering history up to ``until``"""
+        self._ensure_loaded(user_id)
+        if user_id not in self.user_memories:
+            return
+        mem = self.user_memories[user_id]
+        mem['conversation_summary'] = summary
+        mem['summary_until'] = until
+        self._persist_user(user_id)
+        self._set_resident_size(user_id, self._user_size(user_id))
+
+    def unsummarized(self, user_id: int) -> List[MessageRecord]:
+        """History entries newer than the running summary (oldest first)"""
+        _, until = self.get_summary(user_id)
+        return [msg for msg in self.conversation_history.get(user_id, ()) if msg.ts > until]
+
+    @timed(MEMORY_OP_SECONDS.labels(op='get_context'))
+    def get_context(self, user_id: int, query: str = "") -> str:
+        """Get user context for better responses, plus past messages relevant to query"""
+        self._ensure_loaded(user_id)
+        if user_id not in self.user_memories:
+            return ""
+
+        mem = self.user_memories[user_id]
+
+        context = f"""
+**User Context:**
+- Name: {mem['user_name']}
+- Total Interactions: {mem['total_interactions']}
+- Topics: {', '.join(mem['topics_explored'][-5:]) if mem['topics_explored'] else 'New user'}
+- Recent Questions: {mem['questions_asked'][-2:] if mem['questions_asked'] else 'None'}
+- Learning Pace: {mem['learning_pace']}
+        """
+        if mem.get('conversation_summary'):
+            context += f"\n{SUMMARY_HEADER}\n{mem['conversation_summary']}\n"
+        if query and self.retriever is not None:
+            context += self.retriever.context_for(user_id, query)
+        return context
+
+    def has_conversation_context(self, context: str) -> bool:
+        """Whether a get_context() result carries the running summary or retrieved past messages"""
+        return SUMMARY_HEADER in context or (self.retriever is not None and self.retriever.HEADER in context)
+
+    @timed(MEMORY_OP_SECONDS.labels(op='update_after_response'))
+    def update_after_response(self, user_id: int, question: str, topic: str = None):
+        """Update memory after each response"""
+        self._ensure_loaded(user_id)
+        if user_id not in self.user_memories:
+            return
+
+        mem = self.user_memories[user_id]
+        mem['total_interactions'] += 1
+        mem['questions_asked'].append(question[:50])
+
+        if topic and topic not in mem['topics_explored']:
+            mem['topics_explored'].append(topic)
+
+        # Keep last 10 questions
+        mem['questions_asked'] = mem['questions_asked'][-10:]
+        self._persist_user(user_id)
+
+    def get_conversation_summary(self, user_id: int) -> str:
+        """Get summary of recent conversation"""
+        history = self.get_history(user_id)
+        if not history:
+            return "No previous conversation"
+
+        # Get last 5 exchanges
+        recent = history[-10:]
+        summary = "Recent conversation:\n"
+        for msg in recent:
+            role = "You" if msg.role == 'user' else "Assistant"
+            summary += f"{role}: {msg.content}...\n"
+
+        return summary
+
+    def close(self):
+        """Flush pending writes and close the store"""
+        if self.retriever is not None:
+            self.retriever.close()
+        if self.store is not None:
+            self.store.close()
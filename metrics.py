@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Prometheus-style metrics shared by both bot versions
+Counters, gauges and fixed-bucket histograms in one process-wide registry,
+rendered in the Prometheus text exposition format for the /metrics endpoint
+"""
+
+import abc
+import time
+import functools
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; network calls and Telegram sends
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Seconds; in-process work such as memory operations and prompt building
+FAST_BUCKETS = (0.00001, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05, 0.1)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+# ============================================================================
+# METRIC TYPES
+# ============================================================================
+
+class _Metric(abc.ABC):
+    """
+    Base for one metric family, optionally split by labels
+
+    Hot paths should bind their labels once with labels() and keep the
+    child. A family built with fn= has no children of its own: fn is called
+    at scrape time and returns either one number or a dict of label-value
+    tuples to numbers, which suits figures other objects already track.
+    """
+
+    TYPE = 'untyped'
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        fn: Optional[Callable[[], object]] = None
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if not self.labelnames and fn is None:
+            self._children[()] = self._new_child()
+
+    @abc.abstractmethod
+    def _new_child(self):
+        """A fresh value holder for one combination of label values"""
+
+    def labels(self, **labels):
+        """The child for one combination of label values"""
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _samples(self) -> List[Tuple[str, Sequence[str], Sequence[str], float]]:
+        """(suffix, label names, label values, value) rows"""
+        if self.fn is not None:
+            values = self.fn()
+            if not isinstance(values, dict):
+                values = {(): values}
+            return [('', self.labelnames, key, value) for key, value in values.items()]
+        return [('', self.labelnames, key, child.value) for key, child in list(self._children.items())]
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.TYPE}']
+        for suffix, names, values, value in self._samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(names, values)} {_format_value(value)}')
+        return lines
+
+
+class _Value:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+
+    TYPE = 'counter'
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1.0, **labels):
+        self.labels(**labels).inc(amount)
+
+
+class Gauge(_Metric):
+    """Value that goes up and down"""
+
+    TYPE = 'gauge'
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def set(self, value: float, **labels):
+        self.labels(**labels).set(value)
+
+
+class _HistogramValue:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at)
+
+
+class Histogram(_Metric):
+    """Distribution of observations over fixed buckets"""
+
+    TYPE = 'histogram'
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS
+    ):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames)
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float, **labels):
+        self.labels(**labels).observe(value)
+
+    def time(self, **labels):
+        """Context manager observing the block's duration"""
+        return self.labels(**labels).time()
+
+    def _samples(self):
+        rows = []
+        bucket_names = self.labelnames + ('le',)
+        bounds = [_format_value(bound) for bound in self.buckets] + ['+Inf']
+        for key, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(bounds, list(child.counts)):
+                cumulative += count
+                rows.append(('_bucket', bucket_names, key + (bound,), cumulative))
+            rows.append(('_sum', self.labelnames, key, child.sum))
+            rows.append(('_count', self.labelnames, key, child.count))
+        return rows
+
+
+def timed(child: _HistogramValue):
+    """Decorator observing each call's duration into a histogram child"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started_at = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - started_at)
+        return wrapper
+    return decorator
+
+# ============================================================================
+# REGISTRY
+# ============================================================================
+
+class MetricsRegistry:
+    """Named metric families, rendered together for a scrape"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        """Add a family; one registered under the same name is replaced"""
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Prometheus text exposition of every family"""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+
+def counter(name: str, help: str, labelnames: Sequence[str] = (), fn=None) -> Counter:
+    return REGISTRY.register(Counter(name, help, labelnames, fn))
+
+
+def gauge(name: str, help: str, labelnames: Sequence[str] = (), fn=None) -> Gauge:
+    return REGISTRY.register(Gauge(name, help, labelnames, fn))
+
+
+def histogram(
+    name: str,
+    help: str,
+    labelnames: Sequence[str] = (),
+    buckets: Sequence[float] = LATENCY_BUCKETS
+) -> Histogram:
+    return REGISTRY.register(Histogram(name, help, labelnames, buckets))
+
+
+def register_bot_metrics(scheduler, memory, response_cache=None, semantic_cache=None):
+    """Scrape-time gauges and counters read from a bot's own components"""
+    gauge('bot_in_flight_requests', 'Messages being answered right now', fn=lambda: scheduler.in_flight)
+    gauge('bot_queued_requests', 'Messages waiting for a scheduler slot', fn=lambda: scheduler.queued)
+    gauge('bot_active_users', 'Users with a message being answered or waiting', fn=lambda: scheduler.active_users)
+    gauge('bot_users_in_memory', 'Users whose memory is resident in RAM', fn=lambda: len(memory.user_memories))
+    gauge('bot_history_memory_bytes', 'Estimated bytes of resident conversation history', fn=lambda: memory.history_bytes)
+    counter('bot_memory_evictions_total', 'Idle users spilled from RAM to the store', fn=lambda: memory.evictions)
+
+    caches = {'exact': response_cache, 'semantic': semantic_cache}
+
+    def cache_lookups():
+        values = {}
+        for name, cache in caches.items():
+            if cache is not None:
+                values[(name, 'hit')] = cache.hits
+                values[(name, 'miss')] = cache.misses
+        return values
+
+    counter('bot_cache_lookups_total', 'Answer cache lookups by cache and result', ('cache', 'result'), fn=cache_lookups)
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Update scheduling shared by both bot versions
+Per-user FIFO ordering with a global in-flight cap and round-robin fairness,
+and coalescing of rapid message bursts into one turn
+"""
+
+import time
+import asyncio
+import logging
+import weakref
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Hashable, List, Optional, Tuple
+
+from backend import LatencyStats
+from metrics import histogram
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_WAIT_SECONDS = histogram(
+    'bot_scheduler_wait_seconds', 'Time a message waited for its turn (per-user order and global cap)'
+).labels()
+
+# ============================================================================
+# FAIR SCHEDULER
+# ============================================================================
+
+class FairScheduler:
+    """
+    Grants message-handling turns: one per user at a time, max_in_flight overall
+
+    Each user has a FIFO of waiting turns, so their messages are handled
+    strictly in arrival order and never interleave. Users with waiting turns
+    queue round-robin for the global slots: after a user's turn ends they go
+    to the back of the line, so one chatty user can't starve everyone else.
+    max_in_flight=0 means no global cap (per-user ordering still applies).
+
+    cancel() aborts a user's running and waiting turns by cancelling the
+    tasks that hold them; the running turn's slot is freed as soon as its
+    task unwinds, and any awaited HTTP request or stream is closed with it.
+    """
+
+    STATS_LOG_EVERY = 1000
+
+    def __init__(self, max_in_flight: int = 32):
+        self.max_in_flight = max_in_flight
+        self._waiting: Dict[int, Deque[Tuple[asyncio.Future, asyncio.Task]]] = {}
+        self._ready: Deque[int] = deque()  # Users with waiting turns and none running
+        self._active: Dict[int, asyncio.Task] = {}
+        self._cancelled: "weakref.WeakSet[asyncio.Task]" = weakref.WeakSet()
+        self.in_flight = 0
+        self.queued = 0
+        self.completed = 0
+        self.cancellations = 0
+        self.wait_time = LatencyStats()
+
+    @asynccontextmanager
+    async def turn(self, user_id: int) -> AsyncIterator[None]:
+        """Wait for the user's next turn and hold it for the block"""
+        grant = asyncio.get_running_loop().create_future()
+        waiters = self._waiting.get(user_id)
+        if waiters is None:
+            waiters = self._waiting[user_id] = deque()
+            if user_id not in self._active:
+                self._ready.append(user_id)
+        waiters.append((grant, asyncio.current_task()))
+        self.queued += 1
+        enqueued_at = time.perf_counter()
+        self._dispatch()
+
+        try:
+            await grant
+        except asyncio.CancelledError:
+            if grant.done() and not grant.cancelled():
+                self._release(user_id)  # Granted just as we were cancelled
+            else:
+                grant.cancel()
+                self.queued -= 1
+            raise
+        waited = time.perf_counter() - enqueued_at
+        self.wait_time.record(waited)
+        SCHEDULER_WAIT_SECONDS.observe(waited)
+
+        try:
+            yield
+        finally:
+            self._release(user_id)
+
+    @property
+    def active_users(self) -> int:
+        """Users with a turn running or waiting"""
+        return len(self._active.keys() | self._waiting.keys())
+
+    def _has_slot(self) -> bool:
+        return not self.max_in_flight or self.in_flight < self.max_in_flight
+
+    def _dispatch(self):
+        """Grant turns round-robin while global slots are free"""
+        while self._ready and self._has_slot():
+            user_id = self._ready.popleft()
+            waiters = self._waiting[user_id]
+            while waiters and waiters[0][0].done():
+                waiters.popleft()  # Cancelled while waiting
+            if not waiters:
+                del self._waiting[user_id]
+                continue
+            grant, task = waiters.popleft()
+            if not waiters:
+                del self._waiting[user_id]
+            self._active[user_id] = task
+            self.in_flight += 1
+            self.queued -= 1
+            grant.set_result(None)
+
+    def _release(self, user_id: int):
+        """End the user's turn and hand the slot to the next user in line"""
+        self._active.pop(user_id, None)
+        self.in_flight -= 1
+        self.completed += 1
+        if user_id in self._waiting:
+            self._ready.append(user_id)  # Back of the line
+        if self.completed % self.STATS_LOG_EVERY == 0:
+            logger.info(f"🚦 Scheduler stats: {self.stats()}")
+        self._dispatch()
+
+    def cancel(self, user_id: int) -> int:
+        """Cancel the user's running and waiting turns; returns how many"""
+        tasks = [task for grant, task in self._waiting.get(user_id, ()) if not grant.done()]
+        if user_id in self._active:
+            tasks.append(self._active[user_id])
+        current = asyncio.current_task()
+        count = 0
+        for task in tasks:
+            if task is not current and not task.done():
+                self._cancelled.add(task)
+                task.cancel()
+                count += 1
+        self.cancellations += count
+        return count
+
+    def cancel_all(self) -> int:
+        """Cancel every running and waiting turn, e.g. on shutdown"""
+        return sum(self.cancel(user_id) for user_id in set(self._active) | set(self._waiting))
+
+    def was_cancelled(self, task: asyncio.Task) -> bool:
+        """Whether the task's CancelledError came from cancel()/cancel_all()"""
+        if task in self._cancelled:
+            self._cancelled.discard(task)
+            return True
+        return False
+
+    def stats(self) -> Dict:
+        """Queue depth and wait-time figures for logs and status endpoints"""
+        return {
+            'in_flight': self.in_flight,
+            'max_in_flight': self.max_in_flight,
+            'queued': self.queued,
+            'waiting_users': len(self._waiting),
+            'completed': self.completed,
+            'cancelled': self.cancellations,
+            'wait': self.wait_time.snapshot()
+        }
+
+# ============================================================================
+# BURST COALESCING
+# ============================================================================
+
+class _Burst:
+    """Messages collected for one key while its window is open"""
+
+    __slots__ = ('texts', 'started_at', 'last_at', 'discarded', 'closed')
+
+    def __init__(self, text: str, now: float):
+        self.texts = [text]
+        self.started_at = now
+        self.last_at = now
+        self.discarded = False
+        self.closed = asyncio.Event()  # Full or discarded: stop waiting
+
+
+class MessageCoalescer:
+    """
+    Debounces rapid messages from the same sender into a single turn
+
+    The first message of a burst waits until no new message has arrived for
+    ``window`` seconds (at most ``max_wait`` after the first one, or until
+    max_messages have piled up) and then gets every text of the burst; the
+    later messages of the burst get None and need no reply of their own.
+    window=0 disables coalescing: every message is its own burst.
+
+    discard() drops a key's open burst, e.g. on /clear: its first message
+    then gets None as well, and the next message starts a new burst.
+    """
+
+    def __init__(self, window: float = 0.0, max_wait: Optional[float] = None, max_messages: int = 10):
+        self.window = window
+        self.max_wait = max_wait if max_wait is not None else window * 4
+        self.max_messages = max_messages
+        self._bursts: Dict[Hashable, _Burst] = {}
+        self.bursts = 0
+        self.merged = 0
+        self.discarded = 0
+
+    async def collect(self, key: Hashable, text: str) -> Optional[List[str]]:
+        """Add a message; returns the burst's texts to its first message, None to the rest"""
+        if self.window <= 0:
+            return [text]
+
+        now = time.monotonic()
+        burst = self._bursts.get(key)
+        if burst is not None:
+            burst.texts.append(text)
+            burst.last_at = now
+            self.merged += 1
+            if len(burst.texts) >= self.max_messages:
+                del self._bursts[key]  # The next message starts a new burst
+                burst.closed.set()
+            return None
+
+        burst = self._bursts[key] = _Burst(text, now)
+        self.bursts += 1
+        try:
+            while len(burst.texts) < self.max_messages and not burst.closed.is_set():
+                flush_at = min(burst.last_at + self.window, burst.started_at + self.max_wait)
+                delay = flush_at - time.monotonic()
+                if delay <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(burst.closed.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if self._bursts.get(key) is burst:
+                del self._bursts[key]
+        return None if burst.discarded else burst.texts
+
+    def discard(self, key: Hashable) -> int:
+        """Drop the key's open burst; returns how many messages it held"""
+        burst = self._bursts.pop(key, None)
+        if burst is None:
+            return 0
+        burst.discarded = True
+        burst.closed.set()
+        self.discarded += len(burst.texts)
+        return len(burst.texts)
+
+    def stats(self) -> Dict:
+        """Burst figures: merged messages are backend calls saved"""
+        return {
+            'window': self.window,
+            'bursts': self.bursts,
+            'merged': self.merged,
+            'discarded': self.discarded,
+            'open': len(self._bursts)
+        }
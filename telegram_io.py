@@ -0,0 +1,924 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Telegram helpers shared by both bot versions
+Progressive (streaming) replies that edit a message in place as tokens arrive,
+an Application with a hook that runs before pending updates are awaited and
+that times each update's wait for a handler, a rate-limit-aware outbound
+sender, and an async web server for webhook updates, health checks and
+metrics
+"""
+
+import re
+import time
+import signal
+import asyncio
+import logging
+import functools
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple, TypeVar, Union
+
+from aiohttp import web
+from telegram import Bot, Message, Update
+from telegram.error import BadRequest, RetryAfter
+from telegram.ext import Application
+
+from metrics import CONTENT_TYPE, REGISTRY, counter, gauge, histogram
+from traffic import TrafficRecorder
+
+logger = logging.getLogger(__name__)
+
+UPDATE_WAIT_SECONDS = histogram(
+    'bot_update_wait_seconds', 'Time from receiving an update to its handler starting'
+).labels()
+TELEGRAM_SEND_SECONDS = histogram(
+    'bot_telegram_send_seconds', 'Telegram API call duration per sent or edited message', ('method',)
+)
+TELEGRAM_QUEUE_SECONDS = histogram(
+    'bot_telegram_queue_seconds', 'Time an outgoing message waited for its chat and global send budget'
+).labels()
+TELEGRAM_RATE_LIMITED = counter(
+    'bot_telegram_rate_limited_total', 'Telegram 429 (retry_after) responses to outgoing messages'
+).labels()
+TELEGRAM_DROPPED = counter(
+    'bot_telegram_dropped_total', 'Background messages dropped because their chat queue was full'
+).labels()
+CHANNEL_EVENTS = counter(
+    'bot_channel_events_total', 'Channel activity events by outcome (posted in a digest or dropped)', ('result',)
+)
+
+T = TypeVar('T')
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# ============================================================================
+# APPLICATION
+# ============================================================================
+
+class TimedUpdateQueue(asyncio.Queue):
+    """
+    Update queue that remembers when each update arrived
+
+    Pass it to Application.builder().update_queue() so both the polling
+    Updater and WebhookServer stamp updates as they are queued. With a
+    recorder, every queued update is also written to the traffic recording.
+    """
+
+    def __init__(self, maxsize: int = 0, recorder: Optional[TrafficRecorder] = None):
+        super().__init__(maxsize)
+        self.recorder = recorder
+        self._received_at: Dict[int, float] = {}
+
+    def _put(self, item):
+        if isinstance(item, Update):  # Not PTB's stop sentinel, which is never processed
+            self._received_at[id(item)] = time.perf_counter()
+        if self.recorder is not None:
+            self.recorder.record_update(item)
+        super()._put(item)
+
+    def pop_received_at(self, item) -> Optional[float]:
+        return self._received_at.pop(id(item), None)
+
+    @property
+    def pending(self) -> int:
+        """Updates received whose handling hasn't started yet (queued or waiting for a slot)"""
+        return len(self._received_at)
+
+
+class BotApplication(Application):
+    """
+    Application that calls pre_stop before waiting for in-flight updates
+
+    Application.stop() waits for every running handler, so a long backend
+    call would hold up shutdown; pre_stop gets the chance to cancel them
+    first. Build it with Application.builder().application_class(
+    BotApplication, kwargs={'pre_stop': callback}).
+    """
+
+    def __init__(self, *, pre_stop: Optional[Callable[[Application], Awaitable[None]]] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.pre_stop = pre_stop
+
+    async def process_update(self, update: object) -> None:
+        # Runs once a concurrent-update slot is free, right before the handlers
+        if isinstance(self.update_queue, TimedUpdateQueue):
+            received_at = self.update_queue.pop_received_at(update)
+            if received_at is not None:
+                UPDATE_WAIT_SECONDS.observe(time.perf_counter() - received_at)
+        await super().process_update(update)
+
+    async def stop(self) -> None:
+        if self.pre_stop is not None and self.running:
+            await self.pre_stop(self)
+        await super().stop()
+
+# ============================================================================
+# WEBHOOK SERVER
+# ============================================================================
+
+class WebhookServer:
+    """
+    aiohttp server on the bot's own event loop
+
+    Telegram POSTs updates to ``path``; each one is checked against the
+    secret token header, decoded and put on the application's update queue,
+    and acknowledged right away so Telegram can send the next one. The same
+    server answers ``/`` and ``/health`` for the hosting platform and
+    ``/metrics`` for Prometheus, so no separate thread is needed. With
+    path=None it serves only those (e.g. next to polling). More GET
+    endpoints can be registered with add_get() before start().
+
+    ``health`` returns the /health body (see LoopMonitor.check()); an
+    "unhealthy" status is answered with 503 so the platform restarts the
+    instance. Without it /health always reports healthy.
+    """
+
+    SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+    def __init__(
+        self,
+        application: Application,
+        path: Optional[str] = '/telegram',
+        secret_token: Optional[str] = None,
+        host: str = '0.0.0.0',
+        port: int = 10000,
+        info: Optional[Dict] = None,
+        health: Optional[Callable[[], Dict]] = None
+    ):
+        self.application = application
+        self.path = path
+        self.secret_token = secret_token
+        self.host = host
+        self.port = port
+        self.info = info or {}
+        self.health = health
+        self.updates = 0
+        self.rejected = 0
+        self._runner: Optional[web.AppRunner] = None
+        self.app = web.Application()
+        if path:
+            self.app.router.add_post(path, self.handle_update)
+        self.app.router.add_get('/', self.handle_home)
+        self.app.router.add_get('/health', self.handle_health)
+        self.app.router.add_get('/metrics', self.handle_metrics)
+
+    def add_get(self, path: str, handler: Callable[[web.Request], Awaitable[web.StreamResponse]]):
+        """Serve an extra GET endpoint (call before start())"""
+        self.app.router.add_get(path, handler)
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        """Queue one Telegram update"""
+        if self.secret_token and request.headers.get(self.SECRET_HEADER) != self.secret_token:
+            self.rejected += 1
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+        except ValueError:
+            self.rejected += 1
+            return web.Response(status=400)
+        await self.application.update_queue.put(Update.de_json(data, self.application.bot))
+        self.updates += 1
+        return web.Response()
+
+    async def handle_home(self, request: web.Request) -> web.Response:
+        """Health check endpoint"""
+        return web.json_response({
+            'status': 'running',
+            **self.info,
+            'timestamp': datetime.now(timezone.utc).isoformat()
+        })
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        """Health check for monitoring"""
+        if self.health is None:
+            return web.json_response({'status': 'healthy', 'timestamp': datetime.now(timezone.utc).isoformat()})
+        report = self.health()
+        return web.json_response(report, status=503 if report['status'] == 'unhealthy' else 200)
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        """Prometheus scrape endpoint"""
+        return web.Response(body=REGISTRY.render().encode(), headers={'Content-Type': CONTENT_TYPE})
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"🌍 Web server listening on {self.host}:{self.port} (webhook: {self.path or 'off'})")
+
+    async def stop(self):
+        """Stop accepting requests; queued updates are still processed"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def wait_for_stop_signal():
+    """Block until SIGINT or SIGTERM (e.g. Ctrl+C or a platform restart)"""
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    signals = (signal.SIGINT, signal.SIGTERM)
+    for sig in signals:
+        try:
+            loop.add_signal_handler(sig, stopped.set)
+        except NotImplementedError:
+            pass  # Windows: Ctrl+C still raises KeyboardInterrupt
+    try:
+        await stopped.wait()
+    finally:
+        for sig in signals:
+            try:
+                loop.remove_signal_handler(sig)
+            except NotImplementedError:
+                pass
+
+# ============================================================================
+# OUTBOUND SENDS
+# ============================================================================
+
+class TokenBucket:
+    """
+    Sends per second with a burst allowance, handed out in arrival order
+
+    reserve() takes a token even when none is left and returns how long the
+    caller has to wait for it, so concurrent callers line up 1/rate apart
+    instead of polling. pause() holds the bucket back, e.g. for a retry_after.
+    """
+
+    def __init__(self, rate: float, burst: float = 1.0):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()  # Ahead of now while paused
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def reserve(self) -> float:
+        """Take one token; returns the seconds to wait before using it"""
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+        return max(0.0, self.updated - now) + max(0.0, -self.tokens) / self.rate
+
+    def pause(self, seconds: float):
+        """Hand out nothing for the next ``seconds``, then resume without a burst"""
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens = min(self.tokens, 0.0)
+        self.updated = max(self.updated, now + seconds)
+
+
+class _ChatQueue:
+    """Send budget and ordering for one chat"""
+
+    __slots__ = ('bucket', 'lock', 'waiters')
+
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self.lock = asyncio.Lock()
+        self.waiters = 0
+
+
+class OutboundSender:
+    """
+    Central gate for outgoing Telegram messages and edits
+
+    Telegram allows about 30 messages per second overall, about one per
+    second in a private chat (short bursts are tolerated) and 20 per minute
+    in a group or channel. Each send waits for a token from its chat's
+    bucket and then from the global bucket, so reply chunks go out as fast
+    as those budgets allow instead of at a fixed pace. Sends to one chat
+    keep their order. A 429 pauses the chat's bucket for retry_after and
+    the send is retried up to max_retries times (retry=False re-raises
+    RetryAfter instead, for sends that are better skipped).
+
+    post() is fire-and-forget for notifications that shouldn't hold up a
+    reply; they are dropped once their chat has max_queue sends waiting.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = 30.0,
+        chat_rate: float = 1.0,
+        group_rate: float = 20 / 60,
+        chat_burst: float = 3.0,
+        group_burst: float = 3.0,
+        max_retries: int = 3,
+        max_chats: int = 10000
+    ):
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self.group_burst = group_burst
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self.global_bucket = TokenBucket(global_rate, burst=global_rate)
+        self._chats: "OrderedDict[Union[int, str], _ChatQueue]" = OrderedDict()
+        self._tasks: Set[asyncio.Task] = set()
+        self.queued = 0
+        self.sent = 0
+        self.rate_limited = 0
+        self.dropped = 0
+        gauge('bot_telegram_send_queued', 'Outgoing messages waiting for their send budget', fn=lambda: self.queued)
+
+    @staticmethod
+    def _is_group(chat_id: Union[int, str]) -> bool:
+        """Groups and channels have negative ids (or an @username)"""
+        return str(chat_id).startswith(('-', '@'))
+
+    def _chat(self, chat_id: Union[int, str]) -> _ChatQueue:
+        chat = self._chats.get(chat_id)
+        if chat is not None:
+            self._chats.move_to_end(chat_id)
+            return chat
+        if self._is_group(chat_id):
+            chat = _ChatQueue(TokenBucket(self.group_rate, self.group_burst))
+        else:
+            chat = _ChatQueue(TokenBucket(self.chat_rate, self.chat_burst))
+        self._chats[chat_id] = chat
+        if len(self._chats) > self.max_chats:
+            # Forget the least recently used idle chat
+            for old_id, old in self._chats.items():
+                if not old.waiters:
+                    del self._chats[old_id]
+                    break
+        return chat
+
+    async def run(
+        self,
+        chat_id: Union[int, str],
+        call: Callable[[], Awaitable[T]],
+        method: str = 'send',
+        retry: bool = True
+    ) -> T:
+        """Make one Telegram call for the chat once its budget allows"""
+        chat = self._chat(chat_id)
+        chat.waiters += 1
+        self.queued += 1
+        waiting = True
+        enqueued_at = time.perf_counter()
+        try:
+            async with chat.lock:
+                attempt = 0
+                while True:
+                    for bucket in (chat.bucket, self.global_bucket):
+                        delay = bucket.reserve()
+                        if delay > 0:
+                            await asyncio.sleep(delay)
+                    if waiting:
+                        waiting = False
+                        self.queued -= 1
+                        TELEGRAM_QUEUE_SECONDS.observe(time.perf_counter() - enqueued_at)
+                    try:
+                        with TELEGRAM_SEND_SECONDS.time(method=method):
+                            result = await call()
+                        self.sent += 1
+                        return result
+                    except RetryAfter as e:
+                        retry_after = float(e.retry_after)
+                        chat.bucket.pause(retry_after)
+                        self.rate_limited += 1
+                        TELEGRAM_RATE_LIMITED.inc()
+                        attempt += 1
+                        if not retry or attempt > self.max_retries:
+                            raise
+                        logger.warning(f"⏳ Telegram flood limit for chat {chat_id}, retrying in {retry_after:.0f}s")
+        finally:
+            chat.waiters -= 1
+            if waiting:
+                self.queued -= 1
+
+    def post(
+        self,
+        chat_id: Union[int, str],
+        call: Callable[[], Awaitable[object]],
+        method: str = 'send',
+        max_queue: int = 20
+    ) -> bool:
+        """Send in the background; returns False if dropped because the chat is backed up"""
+        if self._chat(chat_id).waiters >= max_queue:
+            self.dropped += 1
+            TELEGRAM_DROPPED.inc()
+            return False
+        task = asyncio.get_running_loop().create_task(self._post(chat_id, call, method))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _post(self, chat_id: Union[int, str], call: Callable[[], Awaitable[object]], method: str):
+        try:
+            await self.run(chat_id, call, method)
+        except Exception as e:
+            logger.error(f"Background send to {chat_id} failed: {e}")
+
+    async def close(self):
+        """Cancel background sends still waiting for their turn"""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict:
+        return {
+            'queued': self.queued,
+            'sent': self.sent,
+            'rate_limited': self.rate_limited,
+            'dropped': self.dropped,
+            'chats': len(self._chats)
+        }
+
+# ============================================================================
+# REPLY SPLITTING
+# ============================================================================
+
+_FENCE_LINE = re.compile(r'^\s*```')
+_MARKDOWN_TOKEN = re.compile(
+    r'(`[^`\n]+`)'                          # Inline code: kept as code
+    r'|\*\*(?=\S)([^*\n]+?)(?<=\S)\*\*'     # **bold**: sent as Telegram's *bold*
+    r'|(\[[^\]\n]+\]\([^)\s]+\))'           # [text](url): kept as a link
+    r'|([_*`\[])'                           # Any other entity character: escaped
+)
+_WORD = re.compile(r'\S+\s*|\s+')
+
+Chunk = Tuple[str, str]  # (text to send, plain-text fallback)
+
+
+def _markdown_token(match: re.Match) -> str:
+    code, bold, link, special = match.groups()
+    if code or link:
+        return code or link
+    if bold is not None:
+        return f'*{bold}*'
+    return '\\' + special
+
+
+def escape_markdown(line: str) -> str:
+    """
+    Make one line of model output safe for Telegram's legacy Markdown
+
+    Inline code, **bold** (sent as *bold*) and links stay formatted; every
+    other _ * ` [ is escaped, so snake_case names or "* " bullets can't open
+    an entity Telegram then refuses to parse. One regex pass per line, and
+    no entity it leaves spans a line break, so lines can be split freely.
+    """
+    return _MARKDOWN_TOKEN.sub(_markdown_token, line)
+
+
+def _parse_blocks(text: str, fence: Optional[str] = None) -> List[Tuple[Optional[str], List[str], bool]]:
+    """
+    Paragraphs as (None, lines, True) and code blocks as (fence, lines, closed)
+
+    ``fence`` is the opening line of a code block the text starts inside of.
+    """
+    blocks = []
+    lines: List[str] = []
+    for line in text.split('\n'):
+        if fence is not None:
+            if _FENCE_LINE.match(line):
+                blocks.append((fence, lines, True))
+                fence, lines = None, []
+            else:
+                lines.append(line)
+        elif _FENCE_LINE.match(line) and not (len(line.strip()) > 3 and line.rstrip().endswith('```')):
+            if lines:
+                blocks.append((None, lines, True))
+            fence, lines = line.strip(), []
+        elif line.strip():
+            lines.append(line)
+        elif lines:
+            blocks.append((None, lines, True))
+            lines = []
+    if fence is not None:
+        blocks.append((fence, lines, False))
+    elif lines:
+        blocks.append((None, lines, True))
+    return blocks
+
+
+def _code_block(fence: str, lines: List[str]) -> str:
+    return f"{fence}\n" + "".join(line + "\n" for line in lines) + "```"
+
+
+def _size(text: str, plain: str) -> int:
+    """Length a piece counts for: either half may be the one sent"""
+    return max(len(text), len(plain))
+
+
+class _Packer:
+    """Greedy packing of rendered pieces into messages of at most ``limit`` chars, in both halves"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.chunks: List[Chunk] = []
+        self.text = ""
+        self.plain = ""
+
+    def room(self, sep: str) -> int:
+        return self.limit - _size(self.text, self.plain) - (len(sep) if self.text else 0)
+
+    def add(self, text: str, plain: str, sep: str):
+        if self.text and self.room(sep) < _size(text, plain):
+            self.flush()
+        if self.text:
+            self.text += sep
+            self.plain += sep
+        self.text += text
+        self.plain += plain
+
+    def flush(self):
+        if self.text:
+            self.chunks.append((self.text, self.plain))
+            self.text = self.plain = ""
+
+
+def _split_line(line: str, limit: int, escape: Callable[[str], str]) -> List[Chunk]:
+    """Pieces of an over-long line, cut between words where there are any"""
+    pieces = []
+    text = plain = ""
+    for word in _WORD.findall(line):
+        # Escaping at most doubles a word, so half-limit slices always fit
+        parts = [word] if _size(escape(word), word) <= limit else [word[i:i + limit // 2] for i in range(0, len(word), limit // 2)]
+        for part in parts:
+            part_text = escape(part)
+            if text and _size(text + part_text, plain + part) > limit:
+                pieces.append((text, plain))
+                text = plain = ""
+            text += part_text
+            plain += part
+    if text:
+        pieces.append((text, plain))
+    return pieces
+
+
+def _add_paragraph(packer: _Packer, lines: List[str], escape: Callable[[str], str]):
+    rendered = [escape(line) for line in lines]
+    text, plain = "\n".join(rendered), "\n".join(lines)
+    if _size(text, plain) <= packer.limit:
+        packer.add(text, plain, "\n\n")
+        return
+    # Too long for any message: fill line by line, words as a last resort
+    sep = "\n\n"
+    for line, line_text in zip(lines, rendered):
+        if _size(line_text, line) <= packer.limit:
+            packer.add(line_text, line, sep)
+        else:
+            for i, (piece_text, piece) in enumerate(_split_line(line, packer.limit, escape)):
+                packer.add(piece_text, piece, sep if i == 0 else "")
+        sep = "\n"
+
+
+def _add_code(packer: _Packer, fence: str, lines: List[str]):
+    block = _code_block(fence, lines)
+    if len(block) <= packer.limit:
+        packer.add(block, block, "\n\n")
+        return
+    # Too long for any message: close the fence at each cut and re-open it in the next message
+    overhead = len(_code_block(fence, []))
+    width = packer.limit - overhead - 1
+    sep = "\n\n"
+    room = packer.room(sep)
+    group: List[str] = []
+    size = 0
+    for line in lines:
+        for part in [line[i:i + width] for i in range(0, len(line), width)] or [""]:
+            if size + len(part) + 1 > room - overhead:
+                if group:
+                    block = _code_block(fence, group)
+                    packer.add(block, block, sep)
+                packer.flush()
+                room = packer.limit
+                group, size = [], 0
+            group.append(part)
+            size += len(part) + 1
+    if group:
+        block = _code_block(fence, group)
+        packer.add(block, block, sep)
+
+
+def _split(text: str, limit: int, escape: Callable[[str], str]) -> List[Chunk]:
+    packer = _Packer(limit)
+    for fence, lines, _ in _parse_blocks(text):
+        if fence is None:
+            _add_paragraph(packer, lines, escape)
+        else:
+            _add_code(packer, fence, lines)
+    packer.flush()
+    return packer.chunks
+
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """
+    Split a reply into as few messages as fit, cutting at structure
+
+    Paragraphs and fenced code blocks are packed greedily whole; only a
+    block longer than a message is cut, between lines (and between words,
+    or mid-word as a last resort, for a single over-long line). A code
+    block cut across messages is closed at the cut and re-opened, with its
+    language, in the next message.
+    """
+    return [plain for _, plain in _split(text, limit, lambda line: line)] or [text]
+
+
+def split_markdown(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[Chunk]:
+    """
+    split_message() for parse_mode='Markdown': (markdown, plain) per message
+
+    Each line is escaped once with escape_markdown(). The plain half is the
+    same span unescaped, to send without parse_mode if Telegram still
+    rejects the Markdown; the limit applies to both halves, since escaping
+    lengthens a line but **bold** shortens it.
+    """
+    return _split(text, limit, escape_markdown) or [(text, text)]
+
+
+def render_markdown(text: str, fence: Optional[str] = None) -> str:
+    """One message's text as legacy Markdown; ``fence`` re-opens a code block cut off by the previous message"""
+    parts = []
+    for header, lines, closed in _parse_blocks(text, fence):
+        if header is None:
+            parts.append("\n".join(escape_markdown(line) for line in lines))
+        else:
+            while not closed and lines and not lines[-1].strip():
+                lines = lines[:-1]  # Blank tail left by the cut
+            parts.append(_code_block(header, lines))
+    return "\n\n".join(parts)
+
+
+def open_fence(text: str, fence: Optional[str] = None) -> Optional[str]:
+    """Opening line of the code block still open at the end of text, if any"""
+    blocks = _parse_blocks(text, fence)
+    if blocks and not blocks[-1][2]:
+        return blocks[-1][0]
+    return None
+
+# ============================================================================
+# CHANNEL DIGEST
+# ============================================================================
+
+class ChannelDigest:
+    """
+    Collects channel activity and posts it as one digest message
+
+    add() only appends to a buffer, so replies never wait on the channel.
+    A background task posts whatever is buffered every ``interval``
+    seconds, or as soon as ``max_events`` are waiting, through the
+    OutboundSender, so digests respect the channel's 20/min limit and share
+    the global send budget. Each kind lists at most max_events entries per
+    digest and counts the rest. While posts are slow at most max_buffer
+    events are kept; the oldest are dropped and only counted.
+    """
+
+    TITLES = {'join': "🆕 New users", 'query': "💬 Queries"}
+
+    def __init__(
+        self,
+        sender: OutboundSender,
+        chat_id: Union[int, str],
+        interval: float = 60.0,
+        max_events: int = 50,
+        max_buffer: int = 2000
+    ):
+        self.sender = sender
+        self.chat_id = chat_id
+        self.interval = interval
+        self.max_events = max_events
+        self.max_buffer = max_buffer
+        self._events: Deque[Tuple[str, str]] = deque()
+        self._dropped = 0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._bot: Optional[Bot] = None
+        self.digests = 0
+        self.posted = 0
+        self.dropped = 0
+
+    def add(self, kind: str, text: str):
+        """Buffer one event ('join', 'query', ...) for the next digest"""
+        if len(self._events) >= self.max_buffer:
+            self._events.popleft()
+            self._dropped += 1
+            self.dropped += 1
+            CHANNEL_EVENTS.inc(result='dropped')
+        self._events.append((kind, text))
+        if len(self._events) >= self.max_events:
+            self._wakeup.set()
+
+    async def start(self, bot: Bot):
+        self._bot = bot
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def render(self, events: List[Tuple[str, str]], dropped: int = 0) -> str:
+        """Digest text: events grouped by kind, newest last"""
+        by_kind: Dict[str, List[str]] = {}
+        for kind, text in events:
+            by_kind.setdefault(kind, []).append(text)
+        sections = [f"📊 Activity digest ({len(events) + dropped} events)"]
+        for kind, texts in by_kind.items():
+            lines = [f"{self.TITLES.get(kind, kind)}: {len(texts)}"]
+            lines.extend(f"• {text}" for text in texts[-self.max_events:])
+            if len(texts) > self.max_events:
+                lines.append(f"• ...aur {len(texts) - self.max_events} purane")
+            sections.append("\n".join(lines))
+        if dropped:
+            sections.append(f"⚠️ {dropped} events skip hue (channel busy tha)")
+        return "\n\n".join(sections)
+
+    async def flush(self):
+        """Post everything buffered so far as one digest"""
+        if self._bot is None or not (self._events or self._dropped):
+            return
+        events, dropped = list(self._events), self._dropped
+        self._events.clear()
+        self._dropped = 0
+        try:
+            for text in split_message(self.render(events, dropped)):
+                await self.sender.run(
+                    self.chat_id,
+                    functools.partial(self._bot.send_message, chat_id=self.chat_id, text=text)
+                )
+        except asyncio.CancelledError:
+            # Stopped while waiting for the channel's budget: keep the events for the final flush
+            self._events.extendleft(reversed(events))
+            self._dropped += dropped
+            raise
+        except Exception as e:
+            logger.error(f"Channel digest error: {e}")
+            return
+        self.digests += 1
+        self.posted += len(events)
+        CHANNEL_EVENTS.inc(len(events), result='posted')
+
+    async def stop(self, timeout: float = 5.0):
+        """Stop the background task and post what is left (call while the bot can still send)"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await asyncio.wait_for(self.flush(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Channel digest not posted before shutdown")
+
+    def stats(self) -> Dict:
+        return {
+            'buffered': len(self._events),
+            'digests': self.digests,
+            'posted': self.posted,
+            'dropped': self.dropped
+        }
+
+# ============================================================================
+# STREAMING REPLIES
+# ============================================================================
+
+class StreamingReply:
+    """
+    Streams a growing reply into Telegram by editing one message in place
+
+    The first token is sent immediately, later edits are throttled to one per
+    edit_interval seconds, and the text rolls over into a new message once it
+    would pass the Telegram message limit. parse_mode is only applied on the
+    final edit of each message (partial Markdown is usually invalid) and falls
+    back to plain text if Telegram rejects it. With parse_mode='Markdown' the
+    final text is escaped with render_markdown(), and a code block cut by a
+    rollover is closed and re-opened in the next message. With a sender,
+    sends and edits share the chat's budget with everything else going out.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        chat_id: int,
+        edit_interval: float = 1.0,
+        limit: int = TELEGRAM_MESSAGE_LIMIT,
+        parse_mode: Optional[str] = None,
+        sender: Optional[OutboundSender] = None
+    ):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.edit_interval = edit_interval
+        self.limit = limit
+        self.parse_mode = parse_mode
+        self.sender = sender
+        self._fence: Optional[str] = None  # Code block the current message starts inside of
+        # Leave room for escapes and re-opened fences when the final text is rendered
+        self._rollover_at = int(limit * 0.9) if parse_mode == 'Markdown' else limit
+        self.messages: List[Optional[Message]] = []
+        self.parts: List[str] = []
+        self._buffer = ""
+        self._sent_text = ""
+        self._next_edit_at = 0.0
+        self.first_token_at: Optional[float] = None
+
+    @property
+    def text(self) -> str:
+        """Full reply text received so far"""
+        return "".join(self.parts) + self._buffer
+
+    async def push(self, delta: str):
+        """Append streamed text and update Telegram if the throttle allows"""
+        if not delta:
+            return
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self._buffer += delta
+
+        # Roll over into new messages while the current one is over the limit
+        while len(self._buffer) > self._rollover_at:
+            cut = self._split_point(self._buffer)
+            head, self._buffer = self._buffer[:cut], self._buffer[cut:]
+            await self._flush(head, final=True)
+            self._fence = open_fence(head, self._fence)
+            self.parts.append(head)
+            self.messages.append(None)  # Next flush starts a new message
+            self._sent_text = ""
+
+        if time.monotonic() >= self._next_edit_at:
+            await self._flush(self._buffer)
+
+    async def finish(self) -> str:
+        """Send the final state of the reply and return the full text"""
+        if self._buffer:
+            await self._flush(self._buffer, final=True)
+            self.parts.append(self._buffer)
+            self._buffer = ""
+        return "".join(self.parts)
+
+    def _split_point(self, text: str) -> int:
+        """Pick a rollover point at a paragraph, line or word boundary within the limit"""
+        for sep in ("\n\n", "\n", " "):
+            cut = text.rfind(sep, self._rollover_at // 2, self._rollover_at)
+            if cut > 0:
+                return cut + len(sep)
+        return self._rollover_at
+
+    async def _flush(self, text: str, final: bool = False):
+        """Send or edit the current message with the given text"""
+        if not text.strip() or (text == self._sent_text and not (final and self.parse_mode)):
+            return
+        parse_mode = self.parse_mode if final else None
+        formatted = text
+        if parse_mode == 'Markdown':
+            formatted = render_markdown(text, self._fence)
+            if len(formatted) > self.limit:
+                parse_mode, formatted = None, text  # Escaping made it too long: plain text
+        try:
+            await self._send_or_edit(formatted, parse_mode, final)
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                pass
+            elif parse_mode:
+                logger.warning(f"Streaming edit rejected with {parse_mode}, sending plain text: {e}")
+                await self._send_or_edit(text, None, final)
+            else:
+                raise
+        except RetryAfter as e:
+            if not final:
+                # Skip this edit, the next push after the cooldown catches up
+                self._next_edit_at = time.monotonic() + float(e.retry_after)
+                return
+            await asyncio.sleep(float(e.retry_after))
+            await self._send_or_edit(formatted, parse_mode, final)
+        self._sent_text = text
+        self._next_edit_at = time.monotonic() + self.edit_interval
+
+    async def _call(self, method: str, call: Callable[[], Awaitable[T]], final: bool) -> T:
+        if self.sender is not None:
+            # Intermediate edits are skipped rather than retried on a flood limit
+            return await self.sender.run(self.chat_id, call, method=method, retry=final)
+        with TELEGRAM_SEND_SECONDS.time(method=method):
+            return await call()
+
+    async def _send_or_edit(self, text: str, parse_mode: Optional[str], final: bool = False):
+        """Edit the live message, or start a new one if there is none"""
+        current = self.messages[-1] if self.messages else None
+        if current is None:
+            message = await self._call('send', lambda: self.bot.send_message(
+                chat_id=self.chat_id, text=text, parse_mode=parse_mode
+            ), final)
+            if self.messages:
+                self.messages[-1] = message
+            else:
+                self.messages.append(message)
+        else:
+            await self._call('edit', lambda: self.bot.edit_message_text(
+                chat_id=self.chat_id,
+                message_id=current.message_id,
+                text=text,
+                parse_mode=parse_mode
+            ), final)
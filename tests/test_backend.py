@@ -0,0 +1,229 @@
+import asyncio
+
+import pytest
+
+from backend import (
+    BackendError,
+    BackendRouter,
+    CircuitBreaker,
+    DeadlineExceeded,
+    HTTPPool,
+    RetryingEngine,
+    deadline,
+    is_retryable,
+    parse_retry_after,
+    time_left
+)
+
+
+class FakeEngine:
+    def __init__(self, name: str, latency: float = 0.0, status=None):
+        self.name = name
+        self.latency = latency
+        self.status = status
+        self.calls = 0
+
+    async def complete(self, user_message, conversation_history, user_context="", system_prompt=""):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if self.status is not None:
+            raise BackendError(f"{self.name} failed", "failed", status=self.status)
+        return self.name
+
+    async def close(self):
+        pass
+
+
+def test_breaker_opens_after_threshold(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('backend.time.monotonic', lambda: now[0])
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED  # Success reset the count
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.available()
+    assert breaker.trips == 1
+
+
+def test_breaker_half_open_probe(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('backend.time.monotonic', lambda: now[0])
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    breaker.record_failure()
+    now[0] += 10
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.available()
+
+    # Only one probe at a time; a cancelled probe frees the slot
+    breaker.begin()
+    assert not breaker.available()
+    breaker.release()
+    assert breaker.available()
+
+    # A failed probe opens it again for a full timeout
+    breaker.begin()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.trips == 2
+    now[0] += 10
+
+    breaker.begin()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.available()
+
+
+@pytest.mark.asyncio
+async def test_unmeasured_backends_rank_after_the_primary():
+    primary, fallback = FakeEngine('primary', latency=0.01), FakeEngine('fallback')
+    router = BackendRouter([('primary', primary), ('fallback', fallback)])
+    for _ in range(5):
+        assert await router.complete("hi", []) == 'primary'
+    assert fallback.calls == 0
+    assert [b.name for b in router.rank()] == ['primary', 'fallback']
+
+
+@pytest.mark.asyncio
+async def test_measured_backends_rank_by_latency():
+    slow, fast = FakeEngine('slow', latency=0.02), FakeEngine('fast')
+    router = BackendRouter([('slow', slow), ('fast', fast)])
+    for backend in router.backends:
+        for _ in range(backend.MIN_SAMPLES):
+            await router._call(backend, ("hi", [], "", ""))
+    assert [b.name for b in router.rank()] == ['fast', 'slow']
+
+
+@pytest.mark.asyncio
+async def test_failover_and_breaker_skip():
+    broken, backup = FakeEngine('broken', status=503), FakeEngine('backup')
+    router = BackendRouter([('broken', broken), ('backup', backup)], failure_threshold=2)
+    assert await router.complete("hi", []) == 'backup'
+    assert await router.complete("hi", []) == 'backup'
+    assert router.backends[0].breaker.state == CircuitBreaker.OPEN
+    assert await router.complete("hi", []) == 'backup'
+    assert broken.calls == 2
+    assert router.failovers == 2
+
+
+@pytest.mark.asyncio
+async def test_client_errors_are_not_failed_over():
+    rejecting, backup = FakeEngine('rejecting', status=400), FakeEngine('backup')
+    router = BackendRouter([('rejecting', rejecting), ('backup', backup)], failure_threshold=1)
+    with pytest.raises(BackendError):
+        await router.complete("hi", [])
+    assert backup.calls == 0
+    assert router.backends[0].breaker.state == CircuitBreaker.CLOSED
+
+
+def test_retryable_flag_overrides_status():
+    assert not is_retryable(BackendError("blocked", "blocked", retryable=False))
+    assert is_retryable(BackendError("network", "network"))
+    assert is_retryable(BackendError("busy", "busy", status=503))
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after("-1") == 0.0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0  # In the past
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after(None) is None
+
+
+@pytest.mark.asyncio
+async def test_http_pool_shares_one_session_until_closed():
+    pool = HTTPPool(limit=4, limit_per_host=2)
+    session = pool.session
+    assert pool.session is session
+    assert session.connector.limit == 4 and session.connector.limit_per_host == 2
+    await pool.close()
+    assert session.closed
+    assert pool.session is not session
+    await pool.close()
+
+
+class FlakyEngine:
+    """Raises the queued errors in order, then answers"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def complete(self, user_message, conversation_history, user_context="", system_prompt=""):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+    async def stream_response(self, user_message, conversation_history, user_context="", system_prompt=""):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        yield "o"
+        yield "k"
+
+    async def close(self):
+        pass
+
+
+def busy(retry_after=None):
+    return BackendError("busy", "busy", status=503, retry_after=retry_after)
+
+
+@pytest.mark.asyncio
+async def test_retrying_engine_recovers_from_transient_errors():
+    engine = RetryingEngine(FlakyEngine(busy(), BackendError("reset", "reset")), base_delay=0.001)
+    assert await engine.complete("hi", []) == "ok"
+    stats = engine.stats()
+    assert stats['attempts'] == 3 and stats['recovered'] == 1
+    assert stats['errors'] == {'503': 1, 'BackendError': 1}
+
+
+@pytest.mark.asyncio
+async def test_retrying_engine_does_not_retry_rejections():
+    for error in (BackendError("bad", "bad", status=400), BackendError("blocked", "blocked", retryable=False)):
+        flaky = FlakyEngine(error)
+        engine = RetryingEngine(flaky, base_delay=0.001)
+        with pytest.raises(BackendError):
+            await engine.complete("hi", [])
+        assert flaky.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_retrying_engine_gives_up_after_attempts():
+    flaky = FlakyEngine(busy(), busy(), busy())
+    engine = RetryingEngine(flaky, attempts=2, base_delay=0.001)
+    with pytest.raises(BackendError):
+        await engine.complete("hi", [])
+    assert flaky.calls == 2 and engine.stats()['failed'] == 1
+
+
+@pytest.mark.asyncio
+async def test_retry_that_would_pass_the_deadline_is_not_started():
+    flaky = FlakyEngine(busy(retry_after=5))
+    engine = RetryingEngine(flaky)
+    with deadline(0.5):
+        with pytest.raises(BackendError) as info:
+            await engine.complete("hi", [])
+    assert info.value.status == 503  # The real failure, not a timeout
+    assert flaky.calls == 1 and engine.stats()['deadline_exceeded'] == 1
+
+
+@pytest.mark.asyncio
+async def test_attempts_are_cut_off_at_the_deadline():
+    engine = RetryingEngine(FakeEngine("slow", latency=1))
+    with deadline(0.05):
+        assert time_left() <= 0.05
+        with pytest.raises(DeadlineExceeded):
+            await engine.complete("hi", [])
+    assert time_left() is None
+
+
+@pytest.mark.asyncio
+async def test_streams_retry_before_the_first_delta():
+    engine = RetryingEngine(FlakyEngine(busy()), base_delay=0.001)
+    assert [delta async for delta in engine.stream_response("hi", [])] == ["o", "k"]
+    assert engine.stats()['retries'] == 1
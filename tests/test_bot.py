@@ -0,0 +1,129 @@
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import pytest
+from aiohttp import web
+
+from backend import BackendError, HTTPPool
+from bot import CustomAPIEngine
+
+
+async def serve(handler):
+    app = web.Application()
+    app.router.add_post('/chat', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/chat"
+
+
+@pytest.mark.asyncio
+async def test_complete_reuses_pooled_connections():
+    seen = SimpleNamespace()
+    runner, url = await serve(json_reply(seen, content="namaste"))
+    pool = HTTPPool()
+    try:
+        engine = CustomAPIEngine(url, http_pool=pool)
+        for _ in range(3):
+            assert await engine.complete("hi", []) == "namaste"
+        assert len(seen.payloads) == 3
+        assert seen.payloads[0]['messages'][-1] == {'role': 'user', 'content': "hi"}
+        assert len(seen.peers) == 1  # One keep-alive connection served every call
+    finally:
+        await pool.close()
+        await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_complete_reports_status_and_retry_after():
+    runner, url = await serve(json_reply(SimpleNamespace(), status=429, headers={'Retry-After': '7'}))
+    pool = HTTPPool()
+    try:
+        engine = CustomAPIEngine(url, http_pool=pool)
+        with pytest.raises(BackendError) as raised:
+            await engine.complete("hi", [])
+        assert raised.value.status == 429
+        assert raised.value.retry_after == 7.0
+    finally:
+        await pool.close()
+        await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_unreachable_backend_is_a_connection_error():
+    pool = HTTPPool(timeout=2)
+    try:
+        engine = CustomAPIEngine("http://127.0.0.1:9/chat", http_pool=pool)
+        with pytest.raises(BackendError) as raised:
+            await engine.complete("hi", [])
+        assert raised.value.status is None
+    finally:
+        await pool.close()
+
+
+def json_reply(seen: SimpleNamespace, status: int = 200, content: str = "hello", headers=None):
+    seen.payloads, seen.peers = [], set()
+
+    async def handler(request: web.Request) -> web.Response:
+        seen.payloads.append(await request.json())
+        seen.peers.add(request.transport.get_extra_info('peername'))
+        return web.json_response({'content': content}, status=status, headers=headers)
+    return handler
+
+
+def slow_stream(chunks: int, gap: float):
+    async def handler(request: web.Request) -> web.StreamResponse:
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        for i in range(chunks):
+            await asyncio.sleep(gap)
+            await response.write(f'data: {{"content": "part{i} "}}\n\n'.encode())
+        await response.write(b"data: [DONE]\n\n")
+        return response
+    return handler
+
+
+@pytest.mark.asyncio
+async def test_stream_may_outlast_the_request_timeout():
+    runner, url = await serve(slow_stream(chunks=6, gap=0.1))
+    pool = HTTPPool(timeout=0.3)
+    try:
+        engine = CustomAPIEngine(url, http_pool=pool)
+        deltas = [delta async for delta in engine.stream_response("hi", [])]
+        assert "".join(deltas) == "".join(f"part{i} " for i in range(6))
+    finally:
+        await pool.close()
+        await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_stalled_stream_still_times_out():
+    runner, url = await serve(slow_stream(chunks=2, gap=0.5))
+    pool = HTTPPool(timeout=0.2)
+    try:
+        engine = CustomAPIEngine(url, http_pool=pool)
+        with pytest.raises(BackendError, match="Timeout"):
+            async for _ in engine.stream_response("hi", []):
+                pass
+    finally:
+        await pool.close()
+        await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_command_replies_go_through_the_sender():
+    from bot import AdvancedTelegramBot
+    bot = AdvancedTelegramBot(bot_token='1:test', api_url='http://127.0.0.1:9/chat')
+    message = SimpleNamespace(reply_text=AsyncMock())
+    update = SimpleNamespace(effective_chat=SimpleNamespace(id=5), effective_user=SimpleNamespace(id=5), message=message)
+    try:
+        await bot.help_command(update, SimpleNamespace(args=[]))
+        await bot.status_command(update, SimpleNamespace(args=[]))
+        assert message.reply_text.await_count == 2
+        assert bot.sender.stats()['sent'] == 2
+    finally:
+        await bot.sender.close()
+        bot.memory.close()
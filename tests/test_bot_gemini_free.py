@@ -0,0 +1,89 @@
+import time
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('google.generativeai')
+
+from google.api_core import exceptions as google_exceptions
+
+from backend import is_retryable
+from bot_gemini_free import GeminiAIEngine
+
+
+def test_api_errors_keep_their_status():
+    error = GeminiAIEngine._api_error(google_exceptions.TooManyRequests("slow down"))
+    assert error.status == 429
+    assert is_retryable(error)
+
+    error = GeminiAIEngine._api_error(google_exceptions.InvalidArgument("bad key"))
+    assert error.status == 400
+    assert not is_retryable(error)
+
+
+def test_network_errors_are_retried():
+    for exc in (ConnectionResetError("reset"), asyncio.TimeoutError(), google_exceptions.RetryError("gave up", None)):
+        assert is_retryable(GeminiAIEngine._api_error(exc))
+
+
+def test_blocked_reply_is_not_retried():
+    # What response.text raises when the candidate was blocked by safety filters
+    error = GeminiAIEngine._api_error(ValueError("The `response.text` quick accessor only works when ..."))
+    assert error.status is None
+    assert not is_retryable(error)
+    assert GeminiAIEngine._status_label(error) == 'rejected'
+    assert "API key" not in error.user_message
+
+
+def test_network_errors_keep_the_generic_label():
+    assert GeminiAIEngine._status_label(GeminiAIEngine._api_error(ConnectionResetError("reset"))) == 'error'
+
+
+class BlockingModel:
+    """Stands in for genai.GenerativeModel: every call blocks its thread"""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        time.sleep(self.delay)
+        if stream:
+            return iter([SimpleNamespace(text="Namaste "), SimpleNamespace(text="dost")])
+        return SimpleNamespace(text=f"reply to {prompt.splitlines()[-1]}")
+
+
+@pytest.fixture
+def engine():
+    engine = GeminiAIEngine(api_key='test', workers=4)
+    engine.model = BlockingModel(delay=0.2)
+    yield engine
+    asyncio.run(engine.close())
+
+
+@pytest.mark.asyncio
+async def test_blocking_calls_run_off_the_loop(engine):
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    task = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    replies = await asyncio.gather(*(engine.complete(f"q{i}", []) for i in range(4)))
+    elapsed = time.perf_counter() - started
+    task.cancel()
+
+    assert replies == [f"reply to User: q{i}" for i in range(4)]
+    assert elapsed < 0.6  # The four calls overlapped on the pool
+    assert ticks >= 10  # and the loop kept running meanwhile
+    stats = engine.stats()
+    assert (stats['queued'], stats['in_flight'], stats['latency']['count']) == (0, 0, 4)
+
+
+@pytest.mark.asyncio
+async def test_stream_in_worker_yields_chunks(engine):
+    assert [delta async for delta in engine.stream_response("hi", [])] == ["Namaste ", "dost"]
@@ -0,0 +1,114 @@
+import pytest
+
+from caching import AnswerCache, ResponseCache, SemanticCache, np
+from memory import MemorySystem, MessageRecord
+
+needs_numpy = pytest.mark.skipif(np is None, reason="SemanticCache requires numpy")
+
+
+class FakeUser:
+    def __init__(self, first_name: str):
+        self.first_name = first_name
+
+
+def test_response_cache_is_scoped_per_user():
+    cache = ResponseCache()
+    cache.set(cache.make_key("Hi!", (), scope=1), "Namaste Rahul")
+    assert cache.get(cache.make_key("hi", (), scope=1)) == "Namaste Rahul"
+    assert cache.get(cache.make_key("hi", (), scope=2)) is None
+
+
+def test_response_cache_key_includes_recent_history():
+    cache = ResponseCache(history_turns=1)
+    earlier = [MessageRecord(1.0, 'user', "python?")]
+    cache.set(cache.make_key("aur batao", earlier, scope=1), "python answer")
+    assert cache.get(cache.make_key("aur batao", [MessageRecord(1.0, 'user', "docker?")], scope=1)) is None
+
+
+def test_response_cache_evicts_least_recently_used():
+    cache = ResponseCache(max_entries=2)
+    for name in ("a", "b"):
+        cache.set(name, f"answer {name}")
+    assert cache.get("a") == "answer a"  # b is now the oldest
+    cache.set("c", "answer c")
+    assert cache.get("b") is None
+    assert cache.get("a") == "answer a"
+    assert cache.stats()['evictions'] == 1
+
+
+def test_response_cache_entries_expire(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('caching.time.monotonic', lambda: now[0])
+    cache = ResponseCache(ttl=10)
+    key = cache.make_key("  What is   Python?? ", ())
+    cache.set(key, "a language")
+    assert cache.get(cache.make_key("what is python", ())) == "a language"
+    now[0] += 11
+    assert cache.get(key) is None
+    assert len(cache) == 0
+    assert cache.stats()['expirations'] == 1
+
+
+def test_summary_and_retrieval_mark_context_as_conversation_specific():
+    memory = MemorySystem()
+    memory.initialize_user(1, FakeUser("Rahul"))
+    assert not memory.has_conversation_context(memory.get_context(1, "hi"))
+    memory.set_summary(1, "Rahul asked about Python decorators", 1.0)
+    assert memory.has_conversation_context(memory.get_context(1, "hi"))
+
+
+@needs_numpy
+def test_semantic_cache_is_scoped_per_user():
+    cache = SemanticCache(capacity=4, dim=64)
+    cache.add("mera naam kya hai", (), "Aapka naam Rahul hai", scope=1)
+    assert cache.lookup("mera naam kya hai?", (), scope=1) == "Aapka naam Rahul hai"
+    assert cache.lookup("mera naam kya hai?", (), scope=2) is None
+
+
+@needs_numpy
+def test_semantic_cache_reload_keeps_most_recently_used(tmp_path):
+    cache = SemanticCache(capacity=3, dim=64)
+    for i in range(3):
+        cache.add(f"question number {i} about python", (), f"answer {i}")
+    cache.lookup("question number 0 about python", ())  # 0 is now the newest
+    cache.add("completely different docker topic", (), "answer 3")  # Reuses 1's slot
+
+    path = str(tmp_path / "semantic.npz")
+    cache.save(path)
+
+    smaller = SemanticCache(capacity=1, dim=64)
+    assert smaller.load(path)
+    assert smaller.answers[:smaller.size] == ["answer 3"]
+
+
+@needs_numpy
+def test_semantic_cache_reload_preserves_lru_order(tmp_path):
+    cache = SemanticCache(capacity=3, dim=64)
+    for i in range(3):
+        cache.add(f"question number {i} about python", (), f"answer {i}")
+    cache.lookup("question number 0 about python", ())
+    path = str(tmp_path / "semantic.npz")
+    cache.save(path)
+
+    reloaded = SemanticCache(capacity=3, dim=64)
+    reloaded.load(path)
+    reloaded.add("completely different docker topic", (), "answer 3")
+    assert "answer 1" not in reloaded.answers  # Oldest before the save is evicted first
+    assert "answer 0" in reloaded.answers
+
+
+def test_answer_cache_subclass_must_define_len():
+    class Incomplete(AnswerCache):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+@needs_numpy
+def test_semantic_cache_matches_similar_questions_only():
+    cache = SemanticCache(capacity=8, dim=256, threshold=0.8)
+    cache.add("python mein list comprehension kaise likhte hain", (), "comprehension answer")
+    assert cache.lookup("Python mein list comprehension kaise likhte hain?", ()) == "comprehension answer"
+    assert cache.lookup("docker image ka size kaise kam karu", ()) is None
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
@@ -0,0 +1,193 @@
+import asyncio
+import time
+
+import pytest
+
+from context_builder import ContextPacker, ConversationSummarizer, HistoryRetriever, estimate_tokens, extractive_summary, truncate_to_tokens
+from memory import MemoryStore, MemorySystem, MessageRecord
+
+
+def record(i: int, text: str) -> MessageRecord:
+    return MessageRecord(float(i), 'user', text)
+
+
+async def wait_for_builds(retriever: HistoryRetriever, count: int):
+    for _ in range(200):
+        if retriever.builds >= count and not retriever._building:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("index build did not finish")
+
+
+def test_retriever_without_store_keeps_max_users_indexes():
+    retriever = HistoryRetriever(max_users=2, exclude_recent=0)
+    for user_id in (1, 2, 3):
+        retriever.add(user_id, record(0, f"docker question from user {user_id}"))
+    assert retriever.stats()['indexed_users'] == 2
+    assert retriever.search(1, "docker") == []  # Least recently used, dropped
+    assert retriever.search(3, "docker")
+
+
+def test_retriever_without_store_keeps_newest_messages():
+    retriever = HistoryRetriever(max_messages=10, exclude_recent=0)
+    for i in range(100):
+        retriever.add(1, record(i, f"message number{i} about kubernetes"))
+        assert retriever.stats()['indexed_messages'] <= 15
+    assert retriever.search(1, "number99")[0].content == "message number99 about kubernetes"
+    assert retriever.search(1, "number5") == []
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = MemoryStore(str(tmp_path / "memory.db"), batch_size=10000, flush_interval=30)
+    yield store
+    store.close()
+
+
+@pytest.mark.asyncio
+async def test_retriever_builds_in_background_from_committed_and_queued(store, tmp_path):
+    store.append_message(1, record(0, "how do I configure nginx reverse proxy"))
+    store.append_message(1, record(1, "python list comprehension question"))
+    retriever = HistoryRetriever(store=store, exclude_recent=0)
+
+    started = time.perf_counter()
+    assert retriever.search(1, "nginx proxy") == []  # Not built yet; nothing blocks
+    assert time.perf_counter() - started < 0.1
+    retriever.add(1, record(2, "nginx returns 502 bad gateway"))  # Arrives mid-build
+
+    await wait_for_builds(retriever, 1)
+    found = [m.content for m in retriever.search(1, "nginx")]
+    assert sorted(found) == ["how do I configure nginx reverse proxy", "nginx returns 502 bad gateway"]
+    assert retriever.stats()['indexed_messages'] == 3
+    retriever.close()
+
+
+@pytest.mark.asyncio
+async def test_retriever_build_skips_entries_already_queued(store):
+    retriever = HistoryRetriever(store=store, exclude_recent=0)
+    retriever.search(1, "anything")
+    message = record(5, "terraform state lock error")
+    retriever.add(1, message)
+    store.append_message(1, message)  # As MemorySystem does right after add()
+    await wait_for_builds(retriever, 1)
+    assert retriever.stats()['indexed_messages'] == 1
+    retriever.close()
+
+
+@pytest.mark.asyncio
+async def test_retriever_build_caps_loaded_rows(store):
+    for i in range(50):
+        store.append_message(1, record(i, f"entry number{i}"))
+    retriever = HistoryRetriever(store=store, max_messages=10, exclude_recent=0)
+    retriever.search(1, "entry")
+    await wait_for_builds(retriever, 1)
+    assert retriever.stats()['indexed_messages'] == 10
+    assert retriever.search(1, "number49")
+    assert retriever.search(1, "number10") == []
+    retriever.close()
+
+
+@pytest.mark.asyncio
+async def test_retriever_forget_discards_build_in_progress(store):
+    store.append_message(1, record(0, "old secret topic"))
+    retriever = HistoryRetriever(store=store, exclude_recent=0)
+    retriever.search(1, "secret")
+    retriever.forget(1)
+    await asyncio.sleep(0.2)
+    assert retriever.stats()['indexed_users'] == 0
+    retriever.close()
+
+
+def test_estimate_and_truncate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("hello, world") == 3
+    assert estimate_tokens("x" * 40) == 10
+    cut = truncate_to_tokens("word " * 100, 10)
+    assert cut.endswith("…") and estimate_tokens(cut) <= 10
+    assert truncate_to_tokens("short", 10) == "short"
+
+
+def test_packer_keeps_newest_turns_within_budget():
+    packer = ContextPacker(budget=120, max_turns=6)
+    history = [record(i, f"message {i} " + "padding " * 10) for i in range(6)] + [record(6, "current question")]
+    packed = packer.pack("current question", history, "", "system")
+    assert packed.tokens <= 120
+    contents = [content for _, content in packed.turns]
+    assert "current question" not in contents  # Sent separately, not twice
+    assert contents[-1].startswith("message 5")  # Newest kept first
+    assert packed.dropped_turns > 0 and packed.tokens_saved > 0
+
+
+def test_packer_truncates_a_long_profile():
+    packed = ContextPacker(budget=60).pack("hi", [], "profile " * 200, "system")
+    assert packed.tokens <= 60
+    assert packed.user_context.endswith("…")
+
+
+class FakeUser:
+    def __init__(self, first_name: str):
+        self.first_name = first_name
+
+
+def chatty_memory(turns: int) -> MemorySystem:
+    memory = MemorySystem()
+    memory.initialize_user(1, FakeUser("Rahul"))
+    for i in range(turns):
+        memory.add_to_history(1, 'user' if i % 2 == 0 else 'assistant', f"Turn {i}. More detail here")
+    return memory
+
+
+def test_extractive_summary_keeps_first_sentences():
+    summary = extractive_summary("", [record(0, "Python kya hai? Batao")], 100)
+    assert summary == "- User: Python kya hai?"
+
+
+@pytest.mark.asyncio
+async def test_summarizer_folds_older_turns():
+    memory = chatty_memory(10)
+    seen = []
+
+    async def summarize(previous, turns):
+        seen.append(len(turns))
+        return "Rahul is chatting"
+
+    summarizer = ConversationSummarizer(memory, summarize, trigger_turns=8, keep_recent=4)
+    task = summarizer.maybe_schedule(1)
+    assert summarizer.maybe_schedule(1) is None  # One fold per user at a time
+    await task
+    assert seen == [6]
+    assert memory.get_summary(1)[0] == "Rahul is chatting"
+    assert len(memory.unsummarized(1)) == 4
+    assert summarizer.maybe_schedule(1) is None  # Below the trigger again
+
+
+@pytest.mark.asyncio
+async def test_summarizer_falls_back_when_the_model_fails():
+    memory = chatty_memory(10)
+
+    async def summarize(previous, turns):
+        raise RuntimeError("model down")
+
+    summarizer = ConversationSummarizer(memory, summarize, trigger_turns=8, keep_recent=4)
+    await summarizer.maybe_schedule(1)
+    assert summarizer.stats()['fallbacks'] == 1
+    assert memory.get_summary(1)[0].startswith("- User: Turn 0.")
+
+
+@pytest.mark.asyncio
+async def test_summarizer_discards_a_fold_after_clear():
+    memory = chatty_memory(10)
+    started = asyncio.Event()
+
+    async def summarize(previous, turns):
+        started.set()
+        await asyncio.sleep(0.05)
+        return "stale summary"
+
+    summarizer = ConversationSummarizer(memory, summarize, trigger_turns=8, keep_recent=4)
+    task = summarizer.maybe_schedule(1)
+    await started.wait()
+    memory.clear_history(1)
+    await task
+    assert memory.get_summary(1)[0] == ""
+    assert summarizer.stats()['discarded'] == 1
@@ -0,0 +1,36 @@
+import time
+import asyncio
+
+import pytest
+
+from health import DEGRADED, HEALTHY, UNHEALTHY, LoopMonitor
+
+
+def test_backlog_thresholds_without_sampling():
+    backlog = [0]
+    monitor = LoopMonitor(degraded_backlog=10, unhealthy_backlog=100, backlog=lambda: backlog[0])
+    assert monitor.check()['status'] == HEALTHY
+    backlog[0] = 10
+    assert monitor.check()['status'] == DEGRADED
+    backlog[0] = 100
+    report = monitor.check()
+    assert report['status'] == UNHEALTHY and report['reasons'] == ["backlog 100"]
+    assert not report['monitoring']
+
+
+@pytest.mark.asyncio
+async def test_blocking_call_is_caught_with_its_stack():
+    monitor = LoopMonitor(interval=0.01, slow_callback=0.05, degraded_lag=0.05, unhealthy_lag=0)
+    await monitor.start()
+    try:
+        await asyncio.sleep(0.03)
+        assert monitor.check()['status'] == HEALTHY
+        time.sleep(0.2)  # Block the loop
+        assert monitor.check()['status'] == DEGRADED
+        await asyncio.sleep(0.03)
+        stats = monitor.stats()
+        assert stats['stalls'] == 1 and stats['max_lag_ms'] >= 150
+        assert "test_blocking_call_is_caught_with_its_stack" in stats['last_stall']['stack']
+    finally:
+        await monitor.stop()
+    assert not monitor.running
@@ -0,0 +1,174 @@
+import time
+import pickle
+
+import pytest
+
+from memory import HISTORY_LIMIT, MemoryStore, MemorySystem, MessageRecord, RingBuffer, RingView
+
+
+class FakeUser:
+    def __init__(self, first_name: str):
+        self.first_name = first_name
+
+
+@pytest.fixture
+def slow_store(tmp_path):
+    """Store whose writer holds writes for a long time, so they stay queued"""
+    store = MemoryStore(str(tmp_path / "memory.db"), batch_size=10000, flush_interval=30)
+    yield store
+    store.close()
+
+
+def test_store_round_trip_after_flush(tmp_path):
+    path = str(tmp_path / "memory.db")
+    store = MemoryStore(path, flush_interval=0.01)
+    store.save_user(1, {'user_name': 'A'}, {'python': 5})
+    for i in range(3):
+        store.append_message(1, MessageRecord(float(i), 'user', f"message {i}"))
+    store.flush()
+    assert not store.has_pending(1)
+    store.close()
+
+    reopened = MemoryStore(path)
+    profile, progress, history = reopened.load_user(1)
+    assert profile == {'user_name': 'A'}
+    assert progress == {'python': 5}
+    assert [m.content for m in history] == ["message 0", "message 1", "message 2"]
+    assert reopened.load_user(2) is None
+    reopened.close()
+
+
+def test_store_reads_merge_queued_writes_without_flushing(slow_store):
+    slow_store.save_user(1, {'user_name': 'A'}, {})
+    slow_store.append_message(1, MessageRecord(1.0, 'user', "before clear"))
+    slow_store.clear_history(1)
+    slow_store.append_message(1, MessageRecord(2.0, 'user', "after clear"))
+    slow_store.save_user(1, {'user_name': 'B'}, {})
+
+    started = time.perf_counter()
+    profile, _, history = slow_store.load_user(1)
+    assert time.perf_counter() - started < 1.0  # Did not wait for the writer
+    assert slow_store.has_pending(1)
+    assert profile == {'user_name': 'B'}
+    assert [m.content for m in history] == ["after clear"]
+    assert [m.content for m in slow_store.load_all_messages(1)] == ["after clear"]
+
+
+def test_store_reads_see_each_write_once_across_commits(tmp_path):
+    store = MemoryStore(str(tmp_path / "memory.db"), batch_size=1, flush_interval=0.001)
+    store.save_user(1, {}, {})
+    for i in range(200):
+        store.append_message(1, MessageRecord(float(i), 'user', str(i)))
+        assert [m.content for m in store.load_all_messages(1)] == [str(j) for j in range(i + 1)]
+    store.close()
+
+
+def test_evicted_user_faults_back_in_with_queued_history(slow_store):
+    memory = MemorySystem(store=slow_store, max_users=1)
+    memory.initialize_user(1, FakeUser("A"))
+    memory.add_to_history(1, 'user', "hello")
+    memory.add_to_history(1, 'assistant', "hi there")
+
+    memory.initialize_user(2, FakeUser("B"))  # Evicts user 1 with its writes still queued
+    assert 1 not in memory.user_memories
+    assert memory.evictions == 1
+
+    started = time.perf_counter()
+    history = memory.get_history(1)
+    assert time.perf_counter() - started < 1.0
+    assert [m.content for m in history] == ["hello", "hi there"]
+    assert memory.get_user(1)['user_name'] == "A"
+    assert memory.faults == 1
+    assert 2 not in memory.user_memories
+
+
+def test_unbounded_memory_needs_no_store():
+    with pytest.raises(ValueError):
+        MemorySystem(max_users=10)
+
+
+def test_memory_survives_a_restart(tmp_path):
+    path = str(tmp_path / "memory.db")
+    memory = MemorySystem(store=MemoryStore(path))
+    memory.initialize_user(1, FakeUser("Rahul"))
+    memory.add_to_history(1, 'user', "decorators kya hote hain")
+    memory.update_after_response(1, "decorators kya hote hain")
+    memory.close()
+
+    restarted = MemorySystem(store=MemoryStore(path))
+    assert restarted.has_user(1)
+    assert restarted.get_user(1)['user_name'] == "Rahul"
+    assert restarted.get_user(1)['total_interactions'] == 1
+    assert [m.content for m in restarted.get_history(1)] == ["decorators kya hote hain"]
+    restarted.close()
+
+
+def test_store_batches_writes(tmp_path):
+    store = MemoryStore(str(tmp_path / "memory.db"), batch_size=500, flush_interval=0.05)
+    for i in range(300):
+        store.append_message(1, MessageRecord(float(i), 'user', str(i)))
+    store.flush()
+    assert store.rows_written == 300
+    assert store.batches_written < 10
+    store.close()
+
+
+def test_reset_starts_from_an_empty_file(tmp_path):
+    path = str(tmp_path / "memory.db")
+    store = MemoryStore(path)
+    store.save_user(1, {}, {})
+    store.close()
+    store = MemoryStore(path, reset=True)
+    assert store.load_user(1) is None
+    store.close()
+
+
+def test_bounded_by_bytes_keeps_the_most_recent_user(slow_store):
+    memory = MemorySystem(store=slow_store, max_bytes=1)
+    memory.initialize_user(1, FakeUser("A"))
+    memory.initialize_user(2, FakeUser("B"))
+    assert list(memory.user_memories) == [2]  # The active user always stays resident
+    assert memory.get_user(1)['user_name'] == "A"  # Faulted back in from the store
+    assert list(memory.user_memories) == [1]
+
+
+def test_ring_buffer_drops_oldest_and_slices_without_copying():
+    ring = RingBuffer(3)
+    for i in range(5):
+        ring.append(i)
+    assert list(ring) == [2, 3, 4]
+    assert ring.capacity == 3
+
+    view = ring[-2:]
+    assert isinstance(view, RingView)
+    assert list(view) == [3, 4] and view[-1] == 4 and len(view) == 2
+    assert list(ring.last(10)) == [2, 3, 4]
+    assert list(view[1:]) == [4]
+    assert ring[::2] == [2, 4]
+    with pytest.raises(IndexError):
+        view[2]
+
+
+def test_ring_buffer_pickles_with_its_capacity():
+    ring = pickle.loads(pickle.dumps(RingBuffer(4, [1, 2])))
+    assert ring.capacity == 4 and list(ring) == [1, 2]
+
+
+def test_history_keeps_the_newest_messages():
+    memory = MemorySystem()
+    memory.initialize_user(1, FakeUser("A"))
+    for i in range(HISTORY_LIMIT + 5):
+        memory.add_to_history(1, 'user', str(i))
+    history = memory.get_history(1)
+    assert len(history) == HISTORY_LIMIT
+    assert history[0].content == "5" and history[-1].content == str(HISTORY_LIMIT + 4)
+
+
+def test_message_record_is_compact_and_shares_roles():
+    a = MessageRecord(1700000000.0, ''.join(['assis', 'tant']), "hi", 'python')
+    b = MessageRecord(1700000001.0, 'assistant', "hello", ''.join(['pyt', 'hon']))
+    assert not hasattr(a, '__dict__')
+    assert a.role is b.role and a.topic is b.topic
+    assert a.to_dict() == {'timestamp': a.timestamp, 'role': 'assistant', 'content': "hi", 'topic': 'python'}
+    assert a == MessageRecord(1700000000.0, 'assistant', "hi", 'python')
+    assert a != b
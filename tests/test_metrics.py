@@ -0,0 +1,35 @@
+import pytest
+
+from metrics import Counter, Gauge, Histogram, MetricsRegistry, _Metric
+
+
+def test_metric_subclass_must_define_new_child():
+    class Incomplete(_Metric):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete('incomplete', 'Missing _new_child')
+
+
+def test_counter_and_gauge_render():
+    registry = MetricsRegistry()
+    requests = registry.register(Counter('requests_total', 'Requests', ('status',)))
+    requests.inc(status=200)
+    requests.inc(2, status=500)
+    registry.register(Gauge('queued', 'Queued', fn=lambda: 3))
+    lines = registry.render().splitlines()
+    assert '# TYPE requests_total counter' in lines
+    assert 'requests_total{status="200"} 1' in lines
+    assert 'requests_total{status="500"} 2' in lines
+    assert 'queued 3' in lines
+
+
+def test_histogram_buckets_are_cumulative():
+    latency = Histogram('latency_seconds', 'Latency', buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        latency.observe(value)
+    lines = '\n'.join(latency.render())
+    assert 'latency_seconds_bucket{le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{le="1"} 2' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 3' in lines
+    assert 'latency_seconds_count 3' in lines
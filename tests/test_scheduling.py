@@ -0,0 +1,153 @@
+import asyncio
+
+import pytest
+
+from scheduling import FairScheduler, MessageCoalescer
+
+
+async def hold_turn(scheduler: FairScheduler, user_id: int, started: asyncio.Event, release: asyncio.Event):
+    async with scheduler.turn(user_id):
+        started.set()
+        await release.wait()
+
+
+@pytest.mark.asyncio
+async def test_cancel_frees_running_and_waiting_turns():
+    scheduler = FairScheduler(max_in_flight=1)
+    release = asyncio.Event()
+    running_started, waiting_started, other_started = asyncio.Event(), asyncio.Event(), asyncio.Event()
+    running = asyncio.create_task(hold_turn(scheduler, 1, running_started, release))
+    await running_started.wait()
+    waiting = asyncio.create_task(hold_turn(scheduler, 1, waiting_started, release))
+    other = asyncio.create_task(hold_turn(scheduler, 2, other_started, release))
+    await asyncio.sleep(0)
+    assert scheduler.stats()['in_flight'] == 1
+    assert scheduler.stats()['queued'] == 2
+
+    assert scheduler.cancel(1) == 2
+    await asyncio.gather(running, waiting, return_exceptions=True)
+    assert scheduler.was_cancelled(running) and scheduler.was_cancelled(waiting)
+    assert not scheduler.was_cancelled(running)  # Reported once
+
+    # The freed slot goes to the other user, and no turn is left behind
+    await asyncio.wait_for(other_started.wait(), 1)
+    assert not waiting_started.is_set()
+    release.set()
+    await other
+    stats = scheduler.stats()
+    assert (stats['in_flight'], stats['queued'], stats['waiting_users'], stats['cancelled']) == (0, 0, 0, 2)
+    assert scheduler.active_users == 0
+
+
+@pytest.mark.asyncio
+async def test_cancel_while_granted_releases_the_slot():
+    scheduler = FairScheduler(max_in_flight=1)
+    release = asyncio.Event()
+    first_started, second_started = asyncio.Event(), asyncio.Event()
+    first = asyncio.create_task(hold_turn(scheduler, 1, first_started, release))
+    await first_started.wait()
+    second = asyncio.create_task(hold_turn(scheduler, 2, second_started, release))
+    await asyncio.sleep(0)
+
+    # The turn is granted to user 2 and cancelled before it gets to run
+    release.set()
+    await asyncio.sleep(0)
+    assert first.done()
+    second.cancel()
+    await asyncio.gather(second, return_exceptions=True)
+    assert not second_started.is_set()
+    assert not scheduler.was_cancelled(second)  # Not cancelled through the scheduler
+    stats = scheduler.stats()
+    assert (stats['in_flight'], stats['queued'], stats['waiting_users']) == (0, 0, 0)
+
+
+@pytest.mark.asyncio
+async def test_coalescer_merges_a_burst():
+    coalescer = MessageCoalescer(window=0.05)
+    first = asyncio.create_task(coalescer.collect('k', "one"))
+    await asyncio.sleep(0)
+    assert await coalescer.collect('k', "two") is None
+    assert await first == ["one", "two"]
+    assert coalescer.stats()['open'] == 0
+
+
+@pytest.mark.asyncio
+async def test_coalescer_is_off_with_a_zero_window():
+    coalescer = MessageCoalescer()
+    assert await coalescer.collect('k', "one") == ["one"]
+    assert await coalescer.collect('k', "two") == ["two"]
+    assert coalescer.stats()['bursts'] == 0
+
+
+@pytest.mark.asyncio
+async def test_coalescer_flushes_at_max_messages_and_per_key():
+    coalescer = MessageCoalescer(window=10, max_messages=2)
+    first = asyncio.create_task(coalescer.collect('a', "one"))
+    other = asyncio.create_task(coalescer.collect('b', "other"))
+    await asyncio.sleep(0)
+    assert await coalescer.collect('a', "two") is None
+    assert await asyncio.wait_for(first, 1) == ["one", "two"]
+    assert not other.done()  # A different sender's burst stays open
+    coalescer.discard('b')
+    assert await asyncio.wait_for(other, 1) is None
+
+
+@pytest.mark.asyncio
+async def test_coalescer_max_wait_bounds_a_steady_stream():
+    coalescer = MessageCoalescer(window=0.05, max_wait=0.1)
+    first = asyncio.create_task(coalescer.collect('k', "0"))
+    for i in range(1, 8):
+        await asyncio.sleep(0.03)  # Each message reopens the window
+        if first.done():
+            break
+        assert await coalescer.collect('k', str(i)) is None
+    texts = await first
+    assert 2 <= len(texts) <= 5
+    assert coalescer.stats()['merged'] == len(texts) - 1
+
+
+@pytest.mark.asyncio
+async def test_coalescer_discard_drops_the_open_burst():
+    coalescer = MessageCoalescer(window=0.05)
+    first = asyncio.create_task(coalescer.collect('k', "old"))
+    await asyncio.sleep(0)
+    assert await coalescer.collect('k', "older") is None
+    assert coalescer.discard('k') == 2
+    assert coalescer.discard('k') == 0
+
+    # A message after the discard starts a burst of its own
+    fresh = asyncio.create_task(coalescer.collect('k', "new"))
+    assert await first is None
+    assert await fresh == ["new"]
+    assert coalescer.stats()['discarded'] == 2
+    assert coalescer.stats()['open'] == 0
+
+
+async def record_turn(scheduler: FairScheduler, user_id: int, label, log: list):
+    async with scheduler.turn(user_id):
+        log.append(('start', label))
+        await asyncio.sleep(0.01)
+        log.append(('end', label))
+
+
+@pytest.mark.asyncio
+async def test_one_users_turns_run_in_order_and_never_overlap():
+    scheduler = FairScheduler(max_in_flight=0)
+    log = []
+    await asyncio.gather(*(record_turn(scheduler, 1, i, log) for i in range(3)))
+    assert log == [('start', 0), ('end', 0), ('start', 1), ('end', 1), ('start', 2), ('end', 2)]
+    assert scheduler.stats()['completed'] == 3
+
+
+@pytest.mark.asyncio
+async def test_global_cap_and_round_robin_between_users():
+    scheduler = FairScheduler(max_in_flight=1)
+    log = []
+    chatty = [record_turn(scheduler, 1, ('chatty', i), log) for i in range(3)]
+    quiet = [record_turn(scheduler, 2, ('quiet', 0), log)]
+    await asyncio.gather(*chatty, *quiet)
+    starts = [label for event, label in log if event == 'start']
+    assert starts == [('chatty', 0), ('quiet', 0), ('chatty', 1), ('chatty', 2)]
+    # Only one turn at a time with max_in_flight=1
+    assert all(log[i][0] == 'start' and log[i + 1][0] == 'end' for i in range(0, len(log), 2))
+    assert scheduler.stats()['wait']['count'] == 4
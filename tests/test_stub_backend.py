@@ -0,0 +1,61 @@
+import os
+import sys
+import time
+import asyncio
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from backend import BackendError, HTTPPool
+from bot import CustomAPIEngine
+from stub_backend import StubBackend, start_stub
+
+
+async def stub_engine(stub: StubBackend):
+    runner, url = await start_stub(stub)
+    pool = HTTPPool()
+    return runner, pool, CustomAPIEngine(url, http_pool=pool)
+
+
+@pytest.mark.asyncio
+async def test_stub_answers_plain_and_streamed_requests():
+    runner, pool, engine = await stub_engine(StubBackend(latency=0.01, chunks=4))
+    try:
+        assert await engine.complete("namaste", []) == "stub reply to: namaste"
+        deltas = [delta async for delta in engine.stream_response("namaste", [])]
+        assert len(deltas) > 1 and "".join(deltas) == "stub reply to: namaste"
+    finally:
+        await pool.close()
+        await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_stub_fails_first_requests_with_retry_after():
+    stub = StubBackend(latency=0, fail_first=2, retry_after=1.5)
+    runner, pool, engine = await stub_engine(stub)
+    try:
+        for _ in range(2):
+            with pytest.raises(BackendError) as info:
+                await engine.complete("hi", [])
+            assert info.value.status == 503 and info.value.retry_after == 1.5
+        assert await engine.complete("hi", []) == "stub reply to: hi"
+        assert stub.requests == 3 and stub.errors == 2
+    finally:
+        await pool.close()
+        await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_stub_cold_start_holds_every_early_request():
+    runner, pool, engine = await stub_engine(StubBackend(latency=0, cold_start=0.2))
+    try:
+        started = time.monotonic()
+        await asyncio.gather(*(engine.complete(str(i), []) for i in range(3)))
+        assert time.monotonic() - started >= 0.2
+        started = time.monotonic()
+        await engine.complete("warm", [])
+        assert time.monotonic() - started < 0.2
+    finally:
+        await pool.close()
+        await runner.cleanup()
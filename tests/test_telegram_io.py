@@ -0,0 +1,272 @@
+import time
+import random
+import asyncio
+import functools
+from types import SimpleNamespace
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from telegram import Update
+from telegram.error import BadRequest, RetryAfter
+
+from telegram_io import (
+    TELEGRAM_MESSAGE_LIMIT,
+    ChannelDigest,
+    OutboundSender,
+    StreamingReply,
+    TimedUpdateQueue,
+    TokenBucket,
+    WebhookServer,
+    escape_markdown,
+    split_markdown,
+    split_message
+)
+
+
+def assert_within(chunks, limit):
+    for markdown, plain in chunks:
+        assert len(markdown) <= limit
+        assert len(plain) <= limit
+
+
+def test_bold_paragraph_plain_half_within_limit():
+    # Sending **bold** as *bold* makes the markdown half shorter than the plain one
+    text = "**bold** " * 455 + "x" * 4
+    assert len(escape_markdown(text)) <= TELEGRAM_MESSAGE_LIMIT < len(text)
+    chunks = split_markdown(text)
+    assert_within(chunks, TELEGRAM_MESSAGE_LIMIT)
+    assert "".join(plain for _, plain in chunks).replace(" ", "") == text.replace(" ", "")
+
+
+def test_bold_lines_plain_half_within_limit():
+    text = "\n".join(["**word** **word** **word** **word**"] * 300)
+    assert_within(split_markdown(text), TELEGRAM_MESSAGE_LIMIT)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_random_replies_stay_within_limit(seed):
+    rng = random.Random(seed)
+    words = ["**bold**", "snake_case", "`code`", "[link](https://t.me)", "*", "plain", "x" * 300, "__init__"]
+    paragraphs = []
+    for _ in range(rng.randint(1, 40)):
+        if rng.random() < 0.2:
+            paragraphs.append("```python\n" + "\n".join("print(1)" * rng.randint(1, 60) for _ in range(rng.randint(1, 30))) + "\n```")
+        else:
+            lines = [" ".join(rng.choice(words) for _ in range(rng.randint(1, 200))) for _ in range(rng.randint(1, 5))]
+            paragraphs.append("\n".join(lines))
+    text = "\n\n".join(paragraphs)
+    limit = rng.choice([200, 1000, TELEGRAM_MESSAGE_LIMIT])
+    assert_within(split_markdown(text, limit), limit)
+    assert all(len(chunk) <= limit for chunk in split_message(text, limit))
+
+
+def test_short_reply_is_one_message():
+    assert split_message("hello\n\nworld") == ["hello\n\nworld"]
+    assert split_markdown("**hi** snake_case") == [("*hi* snake\\_case", "**hi** snake_case")]
+
+
+def test_long_code_block_is_reopened():
+    text = "```python\n" + "\n".join(f"line_{i} = {i}" for i in range(600)) + "\n```"
+    chunks = split_message(text)
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert len(chunk) <= TELEGRAM_MESSAGE_LIMIT
+        assert chunk.startswith("```python\n") and chunk.endswith("```")
+
+
+def test_update_queue_only_counts_updates():
+    queue = TimedUpdateQueue()
+    update = Update(1)
+    queue.put_nowait(update)
+    queue.put_nowait(object())  # Like the Application's stop sentinel
+    assert queue.pending == 1
+    assert queue.pop_received_at(update) is not None
+    assert queue.pending == 0
+
+
+class FakeBot:
+    def __init__(self, reject_markdown: bool = False):
+        self.reject_markdown = reject_markdown
+        self.calls = []
+        self.texts = {}
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        return await self._record('send', len(self.texts) + 1, text, parse_mode)
+
+    async def edit_message_text(self, chat_id, message_id, text, parse_mode=None):
+        return await self._record('edit', message_id, text, parse_mode)
+
+    async def _record(self, method, message_id, text, parse_mode):
+        if parse_mode and self.reject_markdown:
+            raise BadRequest("Can't parse entities")
+        self.calls.append((method, message_id, parse_mode))
+        self.texts[message_id] = text
+        return SimpleNamespace(message_id=message_id)
+
+
+@pytest.mark.asyncio
+async def test_first_token_is_sent_and_edits_are_throttled():
+    bot = FakeBot()
+    reply = StreamingReply(bot, chat_id=1, edit_interval=60)
+    for word in ("Namaste ", "dost, ", "kaise ", "ho?"):
+        await reply.push(word)
+    assert bot.calls == [('send', 1, None)]
+    assert bot.texts[1] == "Namaste "
+
+    assert await reply.finish() == "Namaste dost, kaise ho?"
+    assert bot.calls[-1] == ('edit', 1, None)
+    assert bot.texts[1] == "Namaste dost, kaise ho?"
+
+
+@pytest.mark.asyncio
+async def test_long_reply_rolls_over_into_new_messages():
+    bot = FakeBot()
+    reply = StreamingReply(bot, chat_id=1, edit_interval=0, limit=50)
+    text = " ".join(f"word{i}" for i in range(40))
+    for i in range(0, len(text), 7):
+        await reply.push(text[i:i + 7])
+    assert await reply.finish() == text
+    assert len(bot.texts) > 1
+    assert all(len(part) <= 50 for part in bot.texts.values())
+    assert "".join(bot.texts[i] for i in sorted(bot.texts)) == text
+
+
+@pytest.mark.asyncio
+async def test_rejected_markdown_falls_back_to_plain_text():
+    bot = FakeBot(reject_markdown=True)
+    reply = StreamingReply(bot, chat_id=1, edit_interval=60, parse_mode='Markdown')
+    await reply.push("use **snake_case** names")
+    await reply.finish()
+    assert bot.calls[-1] == ('edit', 1, None)
+    assert bot.texts[1] == "use **snake_case** names"
+
+
+async def webhook():
+    application = SimpleNamespace(update_queue=asyncio.Queue(), bot=None)
+    health = SimpleNamespace(report={'status': 'healthy'})
+    server = WebhookServer(application, secret_token="s3cret", health=lambda: health.report)
+    client = TestClient(TestServer(server.app))
+    await client.start_server()
+    return SimpleNamespace(server=server, client=client, queue=application.update_queue, health=health)
+
+
+@pytest.mark.asyncio
+async def test_webhook_queues_updates_with_the_secret():
+    hook = await webhook()
+    headers = {WebhookServer.SECRET_HEADER: "s3cret"}
+    response = await hook.client.post('/telegram', json={'update_id': 7}, headers=headers)
+    assert response.status == 200
+    update = hook.queue.get_nowait()
+    assert isinstance(update, Update) and update.update_id == 7
+    await hook.client.close()
+
+
+@pytest.mark.asyncio
+async def test_webhook_rejects_bad_requests():
+    hook = await webhook()
+    assert (await hook.client.post('/telegram', json={'update_id': 7})).status == 403
+    headers = {WebhookServer.SECRET_HEADER: "s3cret"}
+    assert (await hook.client.post('/telegram', data="not json", headers=headers)).status == 400
+    assert hook.queue.empty()
+    assert hook.server.rejected == 2 and hook.server.updates == 0
+    await hook.client.close()
+
+
+@pytest.mark.asyncio
+async def test_webhook_health_reports_unhealthy_with_503():
+    hook = await webhook()
+    assert (await hook.client.get('/health')).status == 200
+    hook.health.report = {'status': 'unhealthy'}
+    response = await hook.client.get('/health')
+    assert response.status == 503 and (await response.json())['status'] == 'unhealthy'
+    assert (await hook.client.get('/metrics')).status == 200
+    await hook.client.close()
+
+
+def test_token_bucket_spaces_calls_after_the_burst():
+    bucket = TokenBucket(rate=10, burst=2)
+    assert bucket.reserve() == 0 and bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    assert bucket.reserve() == pytest.approx(0.2, abs=0.01)
+    bucket.pause(1)
+    assert bucket.reserve() >= 1
+
+
+@pytest.mark.asyncio
+async def test_sender_keeps_order_within_a_chat():
+    sender = OutboundSender(chat_rate=1000, chat_burst=1000)
+    sent = []
+
+    async def send(text, delay):
+        await asyncio.sleep(delay)
+        sent.append(text)
+
+    await asyncio.gather(*(sender.run(1, functools.partial(send, i, 0.01 * (3 - i))) for i in range(3)))
+    assert sent == [0, 1, 2]
+    assert sender.stats()['sent'] == 3 and sender.stats()['queued'] == 0
+
+
+@pytest.mark.asyncio
+async def test_sender_retries_after_a_flood_limit():
+    sender = OutboundSender(chat_rate=1000, chat_burst=1000)
+    attempts = []
+
+    async def send():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise RetryAfter(0.1)
+        return "ok"
+
+    assert await sender.run(1, send) == "ok"
+    assert attempts[1] - attempts[0] >= 0.09
+    assert sender.stats()['rate_limited'] == 1
+
+    async def flooded():
+        raise RetryAfter(0)
+
+    with pytest.raises(RetryAfter):
+        await sender.run(2, flooded, retry=False)
+
+
+@pytest.mark.asyncio
+async def test_sender_drops_posts_for_a_backed_up_chat():
+    sender = OutboundSender(chat_rate=1000, chat_burst=1000)
+    gate = asyncio.Event()
+    assert sender.post(1, gate.wait, max_queue=1)
+    await asyncio.sleep(0)
+    assert not sender.post(1, gate.wait, max_queue=1)
+    assert sender.stats()['dropped'] == 1
+    gate.set()
+    await sender.close()
+
+
+@pytest.mark.asyncio
+async def test_channel_digest_posts_buffered_events_as_one_message():
+    bot = FakeBot()
+    digest = ChannelDigest(OutboundSender(group_rate=1000, group_burst=1000), -100, interval=60, max_events=3)
+    await digest.start(bot)
+    digest.add('join', "Rahul")
+    digest.add('query', "Python kya hai?")
+    await asyncio.sleep(0.01)
+    assert bot.calls == []  # Waits for the interval or max_events
+    digest.add('query', "Docker?")
+    await asyncio.sleep(0.01)
+    assert len(bot.calls) == 1
+    text = bot.texts[1]
+    assert "3 events" in text and "• Rahul" in text and "• Docker?" in text
+    await digest.stop()
+    assert digest.stats() == {'buffered': 0, 'digests': 1, 'posted': 3, 'dropped': 0}
+
+
+@pytest.mark.asyncio
+async def test_channel_digest_caps_listed_and_buffered_events():
+    bot = FakeBot()
+    digest = ChannelDigest(OutboundSender(), -100, max_events=2, max_buffer=3)
+    digest._bot = bot  # No background task: flush by hand
+    for i in range(5):
+        digest.add('query', f"q{i}")
+    await digest.flush()
+    text = bot.texts[1]
+    assert "q0" not in text and "q1" not in text and "q2" not in text
+    assert "• q4" in text and "...aur 1 purane" in text and "2 events skip hue" in text
+    assert digest.stats()['dropped'] == 2
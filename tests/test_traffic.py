@@ -0,0 +1,115 @@
+import os
+import sys
+import json
+
+import pytest
+from telegram import Update
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from backend import BackendError
+from replay_traffic import load_recording, replay_text
+from traffic import RecordingEngine, TrafficRecorder
+
+
+def make_update(text: str, user_id: int = 7) -> Update:
+    return Update.de_json({
+        'update_id': 1,
+        'message': {
+            'message_id': 1,
+            'date': 0,
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': "Rahul"},
+            'text': text
+        }
+    }, None)
+
+
+class FakeEngine:
+    def __init__(self, error=None):
+        self.error = error
+
+    async def complete(self, user_message, conversation_history, user_context="", system_prompt=""):
+        if self.error is not None:
+            raise self.error
+        return "jawab"
+
+    async def stream_response(self, user_message, conversation_history, user_context="", system_prompt=""):
+        yield "ja"
+        yield "wab"
+
+    async def close(self):
+        pass
+
+
+def read(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_updates_are_recorded_without_identifying_data(tmp_path):
+    path = str(tmp_path / "traffic.jsonl")
+    recorder = TrafficRecorder(path, salt="salt")
+    recorder.record_update(make_update("Python kya hai?"))
+    recorder.record_update(make_update("Python kya hai?", user_id=8))
+    recorder.record_update(make_update("/start@MyBot"))
+    recorder.record_update(make_update("/secret stuff"))
+    recorder.close()
+
+    raw = open(path, encoding='utf-8').read()
+    assert "Python" not in raw and "Rahul" not in raw and "secret" not in raw
+    start, first, second, command, other = read(path)
+    assert start['e'] == 'start'
+    assert first['n'] == len("Python kya hai?") and first['h'] == second['h']
+    assert first['u'] != second['u']
+    assert (command['k'], command['cmd']) == ('cmd', 'start')
+    assert other['cmd'] == 'other'
+    assert TrafficRecorder(str(tmp_path / "again.jsonl"), salt="salt").anonymize('user', 7) == first['u']
+
+
+def test_recording_stops_at_max_bytes(tmp_path):
+    recorder = TrafficRecorder(str(tmp_path / "traffic.jsonl"), salt="salt", max_bytes=300)
+    for _ in range(10):
+        recorder.record_update(make_update("hello"))
+    recorder.close()
+    assert recorder.full and recorder.stats()['bytes'] <= 300
+    assert os.path.getsize(recorder.path) <= 300
+
+
+@pytest.mark.asyncio
+async def test_recording_engine_records_outcomes(tmp_path):
+    path = str(tmp_path / "traffic.jsonl")
+    recorder = TrafficRecorder(path, salt="salt")
+    assert await RecordingEngine(FakeEngine(), recorder).complete("hi", []) == "jawab"
+    assert [delta async for delta in RecordingEngine(FakeEngine(), recorder).stream_response("hi", [])] == ["ja", "wab"]
+    for error in (
+        BackendError("busy", "busy", status=503),
+        BackendError("reset", "reset"),
+        BackendError("blocked", "blocked", retryable=False)
+    ):
+        with pytest.raises(BackendError):
+            await RecordingEngine(FakeEngine(error), recorder).complete("hi", [])
+    recorder.close()
+
+    calls = [record for record in read(path) if record['e'] == 'b']
+    assert [(call['m'], call['r'], call['o']) for call in calls] == [
+        ('complete', 'ok', 5), ('stream', 'ok', 5),
+        ('complete', '503', 0), ('complete', 'error', 0), ('complete', 'rejected', 0)
+    ]
+
+
+def test_replay_reads_back_a_recording(tmp_path):
+    path = str(tmp_path / "traffic.jsonl")
+    recorder = TrafficRecorder(path, salt="salt")
+    recorder.record_update(make_update("Python kya hai?"))
+    recorder.record_backend("Python kya hai?", 'complete', 0.5, 'ok', 120)
+    recorder.close()
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"e":"u","t":')  # Cut off by a crash
+
+    updates, calls, skipped = load_recording(path)
+    assert len(updates) == 1 and skipped == 1
+    text_hash = updates[0]['h']
+    assert list(calls[text_hash]) == [(0.5, 'ok', 120)]
+    text = replay_text(text_hash, updates[0]['n'])
+    assert text == replay_text(text_hash, updates[0]['n']) and text.endswith(f"#{text_hash}")
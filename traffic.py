@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Traffic recording shared by both bot versions
+Opt-in, append-only log of anonymized inbound updates and backend call
+latencies, so production load can be replayed offline against the stub
+backend (see benchmarks/replay_traffic.py)
+"""
+
+import os
+import hmac
+import json
+import time
+import hashlib
+import logging
+import secrets
+from typing import AsyncIterator, Dict, Optional, Sequence
+
+from telegram import Update
+
+from backend import BackendError
+from metrics import counter
+
+logger = logging.getLogger(__name__)
+
+TRAFFIC_RECORDED = counter('bot_traffic_recorded_total', 'Events written to the traffic recording', ('event',))
+
+FORMAT_VERSION = 1
+
+# ============================================================================
+# RECORDER
+# ============================================================================
+
+class TrafficRecorder:
+    """
+    Appends one compact JSON line per inbound update and backend call
+
+    Nothing identifying is written: user and chat ids and message texts are
+    replaced by keyed hashes (HMAC with ``salt``), and a text is kept only
+    as its length. Equal texts hash equally, so repeated questions still
+    replay as repeats. Commands keep their name if it is in ``commands``.
+    Without a salt a random one is used, which makes ids unlinkable across
+    restarts; set one to follow users over several recordings.
+
+    Records (``t`` is the Unix time in seconds):
+      {"e":"start","t":..,"v":1}                                  recorder opened
+      {"e":"u","t":..,"u":user,"c":chat,"ct":"private","k":"text","n":42,"h":text}
+      {"e":"u","t":..,"u":user,"c":chat,"ct":"private","k":"cmd","cmd":"start"}
+      {"e":"b","t":..,"h":text,"m":"complete","s":0.83,"r":"ok","o":950}
+
+    A backend record is written when the call ends, with its duration ``s``,
+    outcome ``r`` ("ok", the HTTP status, "error", "rejected" for a failure
+    not worth retrying that has no status, or "cancelled") and reply
+    length ``o``. Writes are buffered and flushed every ``flush_interval``
+    seconds; recording stops once the file reaches ``max_bytes`` (0 = no cap).
+    """
+
+    def __init__(
+        self,
+        path: str,
+        salt: Optional[str] = None,
+        max_bytes: int = 0,
+        flush_interval: float = 1.0,
+        commands: Sequence[str] = ('start', 'help', 'status', 'clear', 'channel', 'cache')
+    ):
+        self.path = path
+        self._key = (salt or secrets.token_hex(16)).encode()
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.commands = frozenset(commands)
+        self.recorded = 0
+        self.full = False
+        self._file = open(path, 'a', encoding='utf-8')
+        self._size = os.path.getsize(path)
+        self._flushed_at = time.monotonic()
+        self._write({'e': 'start', 't': round(time.time(), 3), 'v': FORMAT_VERSION})
+        logger.info(f"📼 Recording anonymized traffic to {path}")
+
+    def anonymize(self, kind: str, value) -> str:
+        """Keyed hash of an id or text; ``kind`` keeps users, chats and texts apart"""
+        return hmac.new(self._key, f"{kind}:{value}".encode(), hashlib.sha256).hexdigest()[:12]
+
+    def _write(self, record: Dict):
+        if self.full or self._file is None:
+            return
+        line = json.dumps(record, separators=(',', ':')) + "\n"
+        if self.max_bytes and self._size + len(line) > self.max_bytes:
+            self.full = True
+            self._file.flush()
+            logger.warning(f"📼 Traffic recording stopped: {self.path} reached {self.max_bytes / (1024 * 1024):.1f} MB")
+            return
+        self._file.write(line)
+        self._size += len(line)
+        self.recorded += 1
+        TRAFFIC_RECORDED.inc(event=record['e'])
+        now = time.monotonic()
+        if now - self._flushed_at >= self.flush_interval:
+            self._file.flush()
+            self._flushed_at = now
+
+    def record_update(self, update: object):
+        """Record an inbound update as it is queued"""
+        if not isinstance(update, Update):
+            return
+        record = {'e': 'u', 't': round(time.time(), 3)}
+        if update.effective_user is not None:
+            record['u'] = self.anonymize('user', update.effective_user.id)
+        if update.effective_chat is not None:
+            record['c'] = self.anonymize('chat', update.effective_chat.id)
+            record['ct'] = update.effective_chat.type
+        message = update.message
+        text = message.text if message is not None else None
+        if text is None:
+            record['k'] = 'other'
+        elif text.startswith('/'):
+            command = text[1:].split(maxsplit=1)[0].split('@')[0].lower() if len(text) > 1 else ''
+            record['k'] = 'cmd'
+            record['cmd'] = command if command in self.commands else 'other'
+        else:
+            record['k'] = 'text'
+            record['n'] = len(text)
+            record['h'] = self.anonymize('text', text)
+        self._write(record)
+
+    def record_backend(self, user_message: str, method: str, seconds: float, result: str, output: int = 0):
+        """Record one finished backend call"""
+        self._write({
+            'e': 'b',
+            't': round(time.time(), 3),
+            'h': self.anonymize('text', user_message),
+            'm': method,
+            's': round(seconds, 4),
+            'r': result,
+            'o': output
+        })
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            logger.info(f"📼 Traffic recording closed: {self.recorded} events in {self.path}")
+
+    def stats(self) -> Dict:
+        return {'path': self.path, 'recorded': self.recorded, 'bytes': self._size, 'full': self.full}
+
+
+def _result(error: BackendError) -> str:
+    if error.status is not None:
+        return str(error.status)
+    return 'error' if error.retryable is not False else 'rejected'
+
+
+class RecordingEngine:
+    """
+    Wraps an engine and records every call's duration and outcome
+
+    Put it directly around the primary engine, inside any router and retry
+    layers, so each attempt is recorded as the backend saw it and a replay
+    reproduces the retries by itself.
+    """
+
+    def __init__(self, engine, recorder: TrafficRecorder):
+        self.engine = engine
+        self.recorder = recorder
+
+    async def complete(
+        self,
+        user_message: str,
+        conversation_history: Sequence,
+        user_context: str = "",
+        system_prompt: str = ""
+    ) -> str:
+        started = time.perf_counter()
+        result, output = 'cancelled', 0
+        try:
+            response = await self.engine.complete(user_message, conversation_history, user_context, system_prompt)
+            result, output = 'ok', len(response)
+            return response
+        except BackendError as e:
+            result = _result(e)
+            raise
+        except Exception:
+            result = 'error'
+            raise
+        finally:
+            self.recorder.record_backend(user_message, 'complete', time.perf_counter() - started, result, output)
+
+    async def stream_response(
+        self,
+        user_message: str,
+        conversation_history: Sequence,
+        user_context: str = "",
+        system_prompt: str = ""
+    ) -> AsyncIterator[str]:
+        started = time.perf_counter()
+        result, output = 'cancelled', 0  # Until the stream runs to its end
+        stream = self.engine.stream_response(user_message, conversation_history, user_context, system_prompt)
+        try:
+            async for delta in stream:
+                output += len(delta)
+                yield delta
+            result = 'ok'
+        except BackendError as e:
+            result = _result(e)
+            raise
+        except Exception:
+            result = 'error'
+            raise
+        finally:
+            await stream.aclose()
+            self.recorder.record_backend(user_message, 'stream', time.perf_counter() - started, result, output)
+
+    async def generate_response(
+        self,
+        user_message: str,
+        conversation_history: Sequence,
+        user_context: str = "",
+        system_prompt: str = ""
+    ) -> str:
+        """Like complete(), but returns a user-facing message instead of raising"""
+        try:
+            return await self.complete(user_message, conversation_history, user_context, system_prompt)
+        except BackendError as e:
+            logger.error(str(e))
+            return e.user_message
+
+    async def close(self):
+        await self.engine.close()
+
+    def stats(self) -> Dict:
+        """Recording figures, plus the wrapped engine's stats if it has any"""
+        stats = {'recording': self.recorder.stats()}
+        if hasattr(self.engine, 'stats'):
+            stats['engine'] = self.engine.stats()
+        return stats